@@ -0,0 +1,346 @@
+'''
+  Append-only store of the entity sentiment results served, with hourly and daily rollups by entity.
+  Entities are counted by canonical key, like the merge of provider results, so "Apple" and "apple" are one entity, shown with the first spelling recorded in each bucket.
+  Recording only appends to a buffer; a background thread writes the buffer in batches to SQLite and, optionally, Firestore. SQLite keeps the rollups up to date in the same transaction as the raw records, so trend and top-N queries read a few rollup rows instead of scanning records.
+'''
+from datatypes import nlp_client_types
+from monitoring import metrics
+from normalization import canonicalizer
+import collections
+import dataclasses
+import json
+import logging
+import sqlite3
+import threading
+import time
+import utils
+
+firestore = utils.LazyModule('google.cloud.firestore')
+
+_ENTITY_RESULTS = 'entity_results'
+# Max writes of a Firestore batch.
+_FIRESTORE_BATCH_SIZE = 500
+
+# Granularities of rollups, and the length of their buckets in seconds. Buckets
+# are aligned on UTC.
+HOUR = 'hour'
+DAY = 'day'
+BUCKET_SECONDS = {HOUR: 60 * 60, DAY: 24 * 60 * 60}
+
+# Orders of top-N queries.
+MOST_MENTIONED = 'mentions'
+MOST_POSITIVE = 'positive'
+MOST_NEGATIVE = 'negative'
+ORDERS = (MOST_MENTIONED, MOST_POSITIVE, MOST_NEGATIVE)
+_ORDER_BY = {
+    MOST_MENTIONED: 'mentions DESC',
+    MOST_POSITIVE: 'mean_score DESC',
+    MOST_NEGATIVE: 'mean_score ASC',
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entity_results (
+  timestamp REAL NOT NULL,
+  entity_key TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  scores TEXT NOT NULL,
+  score REAL,
+  overall_sentiment TEXT
+);
+CREATE TABLE IF NOT EXISTS entity_rollups (
+  granularity TEXT NOT NULL,
+  entity_key TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  bucket INTEGER NOT NULL,
+  mentions INTEGER NOT NULL,
+  scored INTEGER NOT NULL,
+  score_sum REAL NOT NULL,
+  positive INTEGER NOT NULL,
+  negative INTEGER NOT NULL,
+  neutral INTEGER NOT NULL,
+  unsure INTEGER NOT NULL,
+  PRIMARY KEY (granularity, entity_key, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entity_rollups_by_bucket
+  ON entity_rollups (granularity, bucket);
+'''
+
+_UPSERT_ROLLUP = '''
+INSERT INTO entity_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (granularity, entity_key, bucket) DO UPDATE SET
+  mentions = mentions + excluded.mentions,
+  scored = scored + excluded.scored,
+  score_sum = score_sum + excluded.score_sum,
+  positive = positive + excluded.positive,
+  negative = negative + excluded.negative,
+  neutral = neutral + excluded.neutral,
+  unsure = unsure + excluded.unsure
+'''
+
+# Mean score of the rows, NULL when none of them had a score.
+_MEAN_SCORE = 'SUM(score_sum) / NULLIF(SUM(scored), 0)'
+
+_WRITE_SECONDS = metrics.Histogram('analytics_write_seconds',
+                                   'Latency of writes of entity records.',
+                                   ('sink',))
+_DROPPED_RECORDS = metrics.Counter(
+    'analytics_dropped_records_total',
+    'Entity records dropped, because a write failed or the buffer was full.',
+    ('reason',))
+
+
+@dataclasses.dataclass(slots=True)
+class EntityRecord:
+  entity: str
+  # Canonical key of entity, see canonicalizer.
+  entity_key: str
+  scores: dict[str, float]
+  overall_sentiment: str | None
+  timestamp: float  # Seconds since the epoch.
+
+  @property
+  def score(self) -> float | None:
+    ''' Mean score of the providers, or None without any. '''
+    if not self.scores:
+      return None
+    return sum(self.scores.values()) / len(self.scores)
+
+  def to_dict(self) -> dict:
+    return dataclasses.asdict(self)
+
+
+@dataclasses.dataclass(slots=True)
+class Rollup:
+  ''' Aggregate of the records of an entity over a bucket, or a range of buckets. '''
+  entity: str
+  bucket: int | None  # Start of the bucket, in seconds since the epoch.
+  mentions: int
+  mean_score: float | None
+  positive: int
+  negative: int
+  neutral: int
+  unsure: int
+
+  def to_dict(self) -> dict:
+    return dataclasses.asdict(self)
+
+
+def Records(merged_entities: nlp_client_types.MergedNlpEntities,
+            timestamp: float) -> list[EntityRecord]:
+  ''' Returns a record of each entity of a result. '''
+  return [
+      EntityRecord(entity=entity.text,
+                   entity_key=canonicalizer.CanonicalKey(entity.text),
+                   scores=dict(entity.scores),
+                   overall_sentiment=entity.overall_sentiment.name
+                   if entity.overall_sentiment else None,
+                   timestamp=timestamp) for entity in merged_entities.entities
+  ]
+
+
+def Bucket(timestamp: float, granularity: str) -> int:
+  ''' Returns the start of the bucket holding timestamp. '''
+  seconds = BUCKET_SECONDS[granularity]
+  return int(timestamp // seconds) * seconds
+
+
+def _RollupRows(records: list[EntityRecord]) -> list[tuple]:
+  ''' Aggregates records by granularity, entity key and bucket, in the column order of entity_rollups. '''
+  sentiments = ('Positive', 'Negative', 'Neutral', 'Unsure')
+  aggregates = collections.defaultdict(lambda: [0, 0, 0.0, 0, 0, 0, 0])
+  # Entity key -> first text of the entity.
+  texts = {}
+  for record in records:
+    score = record.score
+    texts.setdefault(record.entity_key, record.entity)
+    for granularity in BUCKET_SECONDS:
+      aggregate = aggregates[(granularity, record.entity_key,
+                              Bucket(record.timestamp, granularity))]
+      aggregate[0] += 1
+      if score is not None:
+        aggregate[1] += 1
+        aggregate[2] += score
+      if record.overall_sentiment in sentiments:
+        aggregate[3 + sentiments.index(record.overall_sentiment)] += 1
+  return [(granularity, entity_key, texts[entity_key], bucket, *aggregate)
+          for (granularity, entity_key,
+               bucket), aggregate in aggregates.items()]
+
+
+class SqliteEntityStore:
+  ''' Entity records and their rollups in a SQLite database.
+
+    Several processes may share the database file: SQLite serializes their
+    writes, and rollups are incremented in the same transaction as the records
+    they count.
+  '''
+
+  name = 'sqlite'
+
+  def __init__(self, path: str):
+    self.path = path
+    self._connection = sqlite3.connect(path,
+                                       timeout=30,
+                                       check_same_thread=False,
+                                       isolation_level=None)
+    self._lock = threading.Lock()
+    with self._lock:
+      if path != ':memory:':
+        self._connection.execute('PRAGMA journal_mode=WAL')
+      self._connection.executescript(_SCHEMA)
+
+  def Write(self, records: list[EntityRecord]):
+    ''' Appends records and adds them to their rollups, in one transaction. '''
+    with self._lock:
+      connection = self._connection
+      connection.execute('BEGIN IMMEDIATE')
+      try:
+        connection.executemany(
+            'INSERT INTO entity_results VALUES (?, ?, ?, ?, ?, ?)',
+            [(record.timestamp, record.entity_key, record.entity,
+              json.dumps(record.scores), record.score, record.overall_sentiment)
+             for record in records])
+        connection.executemany(_UPSERT_ROLLUP, _RollupRows(records))
+      except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+      connection.execute('COMMIT')
+
+  def Trend(self, entity: str, granularity: str, since: float,
+            until: float) -> list[Rollup]:
+    ''' Returns the rollups of entity, or any spelling of it, in the buckets of [since, until), in time order. '''
+    with self._lock:
+      rows = self._connection.execute(
+          '''SELECT entity, bucket, mentions, score_sum / NULLIF(scored, 0),
+                     positive, negative, neutral, unsure
+              FROM entity_rollups
+              WHERE granularity = ? AND entity_key = ? AND bucket >= ?
+                AND bucket < ?
+              ORDER BY bucket''',
+          (granularity, canonicalizer.CanonicalKey(entity),
+           Bucket(since, granularity), until)).fetchall()
+    return [Rollup(*row) for row in rows]
+
+  def Top(self,
+          granularity: str,
+          since: float,
+          until: float,
+          n: int,
+          order: str = MOST_MENTIONED,
+          min_mentions: int = 1) -> list[Rollup]:
+    ''' Returns the n first entities of the buckets of [since, until) by order, summed over the buckets. '''
+    # Entities without any score have no place in a ranking by score.
+    having_score = '' if order == MOST_MENTIONED else (
+        ' AND mean_score IS NOT NULL')
+    with self._lock:
+      rows = self._connection.execute(
+          f'''SELECT MIN(entity), NULL, SUM(mentions) AS mentions,
+                     {_MEAN_SCORE} AS mean_score, SUM(positive),
+                     SUM(negative), SUM(neutral), SUM(unsure)
+              FROM entity_rollups
+              WHERE granularity = ? AND bucket >= ? AND bucket < ?
+              GROUP BY entity_key
+              HAVING SUM(mentions) >= ?{having_score}
+              ORDER BY {_ORDER_BY[order]}, entity_key
+              LIMIT ?''', (granularity, Bucket(
+              since, granularity), until, min_mentions, n)).fetchall()
+    return [Rollup(*row) for row in rows]
+
+  def Close(self):
+    with self._lock:
+      self._connection.close()
+
+
+class FirestoreEntitySink:
+  ''' Appends entity records to a Firestore collection, e.g. for other tools to export. '''
+
+  name = 'firestore'
+
+  def __init__(self, db: 'firestore.Client'):
+    self.db = db
+
+  def Write(self, records: list[EntityRecord]):
+    collection = self.db.collection(_ENTITY_RESULTS)
+    for begin in range(0, len(records), _FIRESTORE_BATCH_SIZE):
+      batch = self.db.batch()
+      for record in records[begin:begin + _FIRESTORE_BATCH_SIZE]:
+        batch.set(collection.document(), record.to_dict())
+      batch.commit()
+
+
+class EntityRecorder:
+  ''' Records the entities of served results, writing them to sinks in the background.
+
+    Record() only appends to a buffer. A background thread writes the buffer
+    to every sink every flush_interval_seconds, or sooner once flush_records
+    are buffered. A failed write is logged and its records dropped for that
+    sink, and records past max_pending_records are dropped, so that a slow
+    sink never grows memory without bound.
+  '''
+
+  def __init__(self,
+               sinks: list,
+               flush_interval_seconds: float = 5,
+               flush_records: int = 1000,
+               max_pending_records: int = 100000,
+               clock=time.time):
+    self.sinks = sinks
+    self.flush_interval_seconds = flush_interval_seconds
+    self.flush_records = flush_records
+    self.max_pending_records = max_pending_records
+    self._clock = clock
+    self._lock = threading.Lock()
+    # Serializes flushes so that records are written in order.
+    self._flush_lock = threading.Lock()
+    self._pending = []
+    self._wake = threading.Event()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def Start(self):
+    self._thread = threading.Thread(target=self._Run,
+                                    name='entity_recorder',
+                                    daemon=True)
+    self._thread.start()
+
+  def Close(self):
+    ''' Stops the background writer and writes pending records. '''
+    self._stopped.set()
+    self._wake.set()
+    if self._thread is not None:
+      self._thread.join()
+    self.Flush()
+
+  def Record(self, merged_entities: nlp_client_types.MergedNlpEntities):
+    records = Records(merged_entities, self._clock())
+    with self._lock:
+      room = self.max_pending_records - len(self._pending)
+      if len(records) > room:
+        _DROPPED_RECORDS.Inc('buffer_full', amount=len(records) - max(room, 0))
+        records = records[:max(room, 0)]
+      self._pending += records
+      if len(self._pending) >= self.flush_records:
+        self._wake.set()
+
+  def Flush(self):
+    ''' Writes pending records to every sink. '''
+    with self._flush_lock:
+      with self._lock:
+        records, self._pending = self._pending, []
+      if not records:
+        return
+      for sink in self.sinks:
+        try:
+          with _WRITE_SECONDS.Time(sink.name):
+            sink.Write(records)
+        except Exception as e:
+          _DROPPED_RECORDS.Inc('write_failed', amount=len(records))
+          logging.warning('Failed to write %d entity records to %s: %s',
+                          len(records), sink.name, e)
+
+  def _Run(self):
+    while not self._stopped.is_set():
+      self._wake.wait(self.flush_interval_seconds)
+      self._wake.clear()
+      if not self._stopped.is_set():
+        self.Flush()
@@ -0,0 +1,153 @@
+import unittest
+
+from analytics import entity_store
+from datatypes import nlp_client_types
+
+_HOUR = 60 * 60
+_DAY = 24 * _HOUR
+
+
+def _Result(*entities):
+  ''' Returns a result of (text, score, sentiment) entities. '''
+  entities = [
+      nlp_client_types.Entity(text=text,
+                              scores={
+                                  'aws': score,
+                                  'gcp': score
+                              } if score is not None else {},
+                              overall_sentiment=sentiment)
+      for text, score, sentiment in entities
+  ]
+  return nlp_client_types.MergedNlpEntities(common_entities=entities,
+                                            entities=entities)
+
+
+def _Records(result, timestamp):
+  return entity_store.Records(result, timestamp)
+
+
+class SqliteEntityStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.store = entity_store.SqliteEntityStore(':memory:')
+    self.addCleanup(self.store.Close)
+    positive = nlp_client_types.Sentiment.Positive
+    negative = nlp_client_types.Sentiment.Negative
+    self.store.Write(
+        _Records(_Result(('coffee', 0.8, positive), ('tea', -0.4, negative)),
+                 10 * _DAY + 100))
+    self.store.Write(
+        _Records(_Result(('coffee', 0.4, positive)), 10 * _DAY + 200))
+    self.store.Write(
+        _Records(_Result(('coffee', -0.6, negative), ('milk', None, None)),
+                 10 * _DAY + 2 * _HOUR))
+
+  def test_trend_reads_hourly_rollups(self):
+    rollups = self.store.Trend('coffee', entity_store.HOUR, 10 * _DAY,
+                               11 * _DAY)
+
+    self.assertEqual([rollup.bucket for rollup in rollups],
+                     [10 * _DAY, 10 * _DAY + 2 * _HOUR])
+    self.assertEqual([rollup.mentions for rollup in rollups], [2, 1])
+    self.assertAlmostEqual(rollups[0].mean_score, 0.6)
+    self.assertEqual((rollups[0].positive, rollups[1].negative), (2, 1))
+
+  def test_trend_reads_daily_rollups(self):
+    rollup, = self.store.Trend('coffee', entity_store.DAY, 10 * _DAY, 11 * _DAY)
+
+    self.assertEqual(rollup.mentions, 3)
+    self.assertAlmostEqual(rollup.mean_score, 0.2)
+
+  def test_trend_is_limited_to_range(self):
+    self.assertEqual(
+        self.store.Trend('coffee', entity_store.HOUR, 11 * _DAY, 12 * _DAY), [])
+
+  def test_top_orders_entities(self):
+
+    def Top(order):
+      return [
+          rollup.entity for rollup in self.store.Top(
+              entity_store.DAY, 10 * _DAY, 11 * _DAY, n=3, order=order)
+      ]
+
+    self.assertEqual(Top(entity_store.MOST_MENTIONED),
+                     ['coffee', 'milk', 'tea'])
+    # milk has no score to rank by.
+    self.assertEqual(Top(entity_store.MOST_POSITIVE), ['coffee', 'tea'])
+    self.assertEqual(Top(entity_store.MOST_NEGATIVE), ['tea', 'coffee'])
+
+  def test_top_skips_rarely_mentioned_entities(self):
+    self.assertEqual([
+        rollup.entity for rollup in self.store.Top(
+            entity_store.DAY, 10 * _DAY, 11 * _DAY, n=3, min_mentions=2)
+    ], ['coffee'])
+
+  def test_spellings_of_an_entity_are_counted_together(self):
+    self.store.Write(
+        _Records(_Result(('coffees', 0.2, None), ('Tea', 0.2, None)),
+                 10 * _DAY + 300))
+
+    rollup, = self.store.Trend('COFFEE', entity_store.DAY, 10 * _DAY, 11 * _DAY)
+    self.assertEqual((rollup.entity, rollup.mentions), ('coffee', 4))
+    self.assertEqual([(rollup.entity, rollup.mentions)
+                      for rollup in self.store.Top(
+                          entity_store.DAY, 10 * _DAY, 11 * _DAY, n=3)],
+                     [('coffee', 4), ('tea', 2), ('milk', 1)])
+
+
+class _FakeSink:
+
+  name = 'fake'
+
+  def __init__(self, error=None):
+    self.error = error
+    self.records = []
+
+  def Write(self, records):
+    if self.error:
+      raise self.error
+    self.records += records
+
+
+class EntityRecorderTest(unittest.TestCase):
+
+  def test_record_only_buffers(self):
+    sink = _FakeSink()
+    recorder = entity_store.EntityRecorder([sink], clock=lambda: 5)
+
+    recorder.Record(_Result(('coffee', 0.5, None)))
+    self.assertEqual(sink.records, [])
+    recorder.Flush()
+
+    self.assertEqual(sink.records, [
+        entity_store.EntityRecord(entity='coffee',
+                                  entity_key='coffee',
+                                  scores={
+                                      'aws': 0.5,
+                                      'gcp': 0.5
+                                  },
+                                  overall_sentiment=None,
+                                  timestamp=5)
+    ])
+
+  def test_failed_sink_does_not_stop_others(self):
+    sink = _FakeSink()
+    recorder = entity_store.EntityRecorder(
+        [_FakeSink(error=RuntimeError('unavailable')), sink])
+
+    recorder.Record(_Result(('coffee', 0.5, None)))
+    recorder.Flush()
+
+    self.assertEqual(len(sink.records), 1)
+
+  def test_records_past_max_pending_are_dropped(self):
+    sink = _FakeSink()
+    recorder = entity_store.EntityRecorder([sink], max_pending_records=2)
+
+    recorder.Record(_Result(('coffee', 0.5, None), ('tea', 0.1, None)))
+    recorder.Record(_Result(('milk', 0.5, None)))
+    recorder.Close()
+
+    self.assertEqual([record.entity for record in sink.records],
+                     ['coffee', 'tea'])
@@ -0,0 +1,95 @@
+'''
+  Startup-time benchmark, measuring the import of each entry point with `python -X importtime` in a fresh interpreter.
+  Run from the repository root: `python -m benchmarks.import_time --max_import_ms=500`, which fails if any entry point got slower than that.
+'''
+from absl import app, flags
+import json
+import statistics
+import subprocess
+import sys
+
+_MODULES = flags.DEFINE_list(
+    'modules',
+    ['main', 'service', 'clients.nlp_client', 'normalization.normalizer'],
+    'Modules whose import is measured.')
+_RUNS = flags.DEFINE_integer(
+    'runs', 5, 'Number of fresh interpreters each import is measured in.')
+_SLOWEST = flags.DEFINE_integer(
+    'slowest', 10, 'Number of slowest transitive imports reported per module.')
+_MAX_IMPORT_MS = flags.DEFINE_float(
+    'max_import_ms', 0,
+    'Fails if the median import of any module is slower. 0 disables the check.')
+_IMPORT_RESULTS_FILE = flags.DEFINE_string(
+    'import_results_file', 'import_time_results.json',
+    'JSON file the results are written to.')
+
+
+def MeasureImport(module: str) -> dict[str, int]:
+  ''' Returns the cumulative import microseconds of module and of every module it imported, in a fresh interpreter. '''
+  completed = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+      capture_output=True,
+      text=True,
+      check=True)
+  # Lines are "import time: self [us] | cumulative | imported package", each
+  # module after the modules it imported, which are indented further.
+  imports = []
+  for line in completed.stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, name = line[len('import time:'):].split('|')
+    imports.append(
+        (len(name) - len(name.lstrip()), name.strip(), int(cumulative)))
+
+  index = next(
+      index for index, (_, name, _) in enumerate(imports) if name == module)
+  indent, _, cumulative = imports[index]
+  cumulative_us = {module: cumulative}
+  # Modules imported by site or the interpreter before module are skipped.
+  while index > 0 and imports[index - 1][0] > indent:
+    index -= 1
+    cumulative_us.setdefault(imports[index][1], imports[index][2])
+  return cumulative_us
+
+
+def BenchmarkImport(module: str, runs: int, slowest: int) -> dict:
+  measurements = [MeasureImport(module) for _ in range(runs)]
+  import_ms = [measurement[module] / 1000 for measurement in measurements]
+  dependencies = sorted(((name, cumulative)
+                         for name, cumulative in measurements[-1].items()
+                         if name != module),
+                        key=lambda item: item[1],
+                        reverse=True)
+  return {
+      'median_ms': statistics.median(import_ms),
+      'min_ms': min(import_ms),
+      'max_ms': max(import_ms),
+      'slowest_imports_ms': {
+          name: cumulative / 1000 for name, cumulative in dependencies[:slowest]
+      },
+  }
+
+
+def RunImportBenchmarks(_):
+  results = {}
+  for module in _MODULES.value:
+    print(f'Benchmarking import of {module}...')
+    results[module] = BenchmarkImport(module, _RUNS.value, _SLOWEST.value)
+
+  with open(_IMPORT_RESULTS_FILE.value, 'w') as file:
+    json.dump(results, file, indent=2)
+
+  regressions = []
+  for module, result in results.items():
+    print(f'{module:32} median {result["median_ms"]:8.1f} ms  '
+          f'min {result["min_ms"]:8.1f} ms  max {result["max_ms"]:8.1f} ms')
+    if _MAX_IMPORT_MS.value and result['median_ms'] > _MAX_IMPORT_MS.value:
+      regressions.append(module)
+  print(f'Results written to {_IMPORT_RESULTS_FILE.value}.')
+  if regressions:
+    sys.exit(f'Import slower than {_MAX_IMPORT_MS.value} ms: '
+             f'{", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+  app.run(RunImportBenchmarks)
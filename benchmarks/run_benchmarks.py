@@ -0,0 +1,271 @@
+'''
+  Offline benchmarks of the analysis pipeline, replaying recorded provider responses.
+  Run from the repository root: `python -m benchmarks.run_benchmarks --results_file=benchmark_results.json`.
+  Reports ops/sec, p50/p95/p99 latency and allocations per stage, and end-to-end results of the Flask route at several concurrency levels.
+'''
+from absl import app, flags
+from benchmarks import stub_clients
+from cache import result_cache
+from clients import aws_comprehend, gcp_language, nlp_client
+from concurrent import futures
+from cost import admission, cost_controller
+from datatypes import nlp_client_types
+from normalization import normalizer, vectorized_normalizer
+from typing import Callable
+import datetime
+import json
+import main
+import platform
+import service
+import statistics
+import time
+import tracemalloc
+
+_RESULTS_FILE = flags.DEFINE_string('results_file', 'benchmark_results.json',
+                                    'JSON file the results are written to.')
+_ITERATIONS = flags.DEFINE_integer('iterations', 2000,
+                                   'Number of calls of each CPU-bound stage.')
+_PROVIDER_LATENCY_MS = flags.DEFINE_float(
+    'provider_latency_ms', 50, 'Simulated latency of each provider call.')
+_PROVIDER_JITTER_MS = flags.DEFINE_float(
+    'provider_jitter_ms', 20, 'Simulated uniform jitter of each provider call.')
+_REQUESTS = flags.DEFINE_integer(
+    'requests', 400, 'Number of requests of each end-to-end benchmark.')
+_CONCURRENCY = flags.DEFINE_list(
+    'concurrency', ['1', '4', '16', '64'],
+    'Concurrency levels of end-to-end benchmarks.')
+
+
+def _Percentile(sorted_values: list[float], percentile: float) -> float:
+  return sorted_values[min(
+      len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+def _Summary(latencies: list[float], wall_seconds: float) -> dict:
+  latencies = sorted(latencies)
+  return {
+      'ops': len(latencies),
+      'ops_per_sec': len(latencies) / wall_seconds,
+      'mean_ms': statistics.fmean(latencies) * 1000,
+      'p50_ms': _Percentile(latencies, 50) * 1000,
+      'p95_ms': _Percentile(latencies, 95) * 1000,
+      'p99_ms': _Percentile(latencies, 99) * 1000,
+  }
+
+
+def _Allocations(fn: Callable, iterations: int) -> dict:
+  ''' Returns the allocated bytes and blocks per call, traced in a separate pass. '''
+  tracemalloc.start()
+  try:
+    before = tracemalloc.take_snapshot()
+    for _ in range(iterations):
+      fn()
+    after = tracemalloc.take_snapshot()
+  finally:
+    tracemalloc.stop()
+  # Snapshots only see allocations still alive, see _PeakBytes for the rest.
+  stats = after.compare_to(before, 'filename')
+  return {
+      'retained_bytes_per_op':
+          sum(stat.size_diff for stat in stats) / iterations,
+      'retained_blocks_per_op':
+          sum(stat.count_diff for stat in stats) / iterations,
+  }
+
+
+def _PeakBytes(fn: Callable) -> int:
+  tracemalloc.start()
+  try:
+    fn()
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def BenchmarkStage(fn: Callable, iterations: int) -> dict:
+  ''' Benchmarks a single-threaded stage. '''
+  fn()  # Warm up.
+  latencies = []
+  start = time.perf_counter()
+  for _ in range(iterations):
+    call_start = time.perf_counter()
+    fn()
+    latencies.append(time.perf_counter() - call_start)
+  result = _Summary(latencies, time.perf_counter() - start)
+  result.update(_Allocations(fn, min(iterations, 200)))
+  result['peak_bytes_per_op'] = _PeakBytes(fn)
+  return result
+
+
+def BenchmarkConcurrent(fn: Callable, requests: int, concurrency: int) -> dict:
+  ''' Benchmarks fn called requests times from concurrency threads. '''
+
+  def Timed():
+    call_start = time.perf_counter()
+    fn()
+    return time.perf_counter() - call_start
+
+  with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+    start = time.perf_counter()
+    latencies = list(executor.map(lambda _: Timed(), range(requests)))
+    return _Summary(latencies, time.perf_counter() - start)
+
+
+def _NewClient(latency_seconds: float,
+               jitter_seconds: float) -> nlp_client.NlpClient:
+  return nlp_client.NlpClient([
+      aws_comprehend.AwsComprehendProvider(
+          stub_clients.StubComprehendClient(
+              stub_clients.LoadFixture('comprehend_response.json'),
+              latency_seconds, jitter_seconds)),
+      gcp_language.GcpLanguageProvider(
+          stub_clients.StubLanguageServiceClient(
+              stub_clients.LoadFixture('gcp_response.json'), latency_seconds,
+              jitter_seconds))
+  ])
+
+
+def _NewServer(client: nlp_client.NlpClient):
+  # The ledger is never started, so charging stays in memory; the cache is
+  # disabled so that every request reaches the providers.
+  return main.create_app(
+      service.Service(client=client,
+                      db=None,
+                      ledger=cost_controller.CostLedger(db=None),
+                      cache=result_cache.ResultCache(
+                          result_cache.LruTtlCache(0, 0)))).test_client()
+
+
+def _EntityHeavyResult(entities: int) -> nlp_client_types.MergedNlpEntities:
+  ''' Returns a result with many entities, half of them common to both providers. '''
+  merged_entities = nlp_client.MergeEntities({
+      'aws': [
+          nlp_client_types.Entity(text=f'entity {index}',
+                                  scores={'aws': index / entities})
+          for index in range(entities)
+      ],
+      'gcp': [
+          nlp_client_types.Entity(text=f'entity {index}',
+                                  scores={'gcp': -index / entities})
+          for index in range(0, entities, 2)
+      ]
+  })
+  for entity in merged_entities.entities:
+    entity.overall_sentiment = nlp_client.ComputeSentimentInMergedEntity(entity)
+  return merged_entities
+
+
+def RunStages(iterations: int) -> dict:
+  aws_fixture = stub_clients.LoadFixture('comprehend_response.json')
+  gcp_fixture = stub_clients.LoadFixture('gcp_response.json')
+  aws_response = aws_fixture['response']
+  gcp_response = stub_clients.StubLanguageServiceClient(
+      gcp_fixture).analyze_entity_sentiment(request=None)
+  aws_entities = aws_comprehend.convert_aws_response(aws_response)
+  gcp_entities = gcp_language.convert_gcp_response(gcp_response)
+  aws_normalized = normalizer.NormalizeAwsSentiment(aws_entities)
+  gcp_normalized = normalizer.NormalizeGcpSentiment(gcp_entities)
+  merged_entities = nlp_client.MergeEntities({
+      'aws': aws_normalized,
+      'gcp': gcp_normalized
+  })
+  client = _NewClient(0, 0)
+  server = _NewServer(client)
+  text = aws_fixture['text']
+  entity_heavy_result = _EntityHeavyResult(200)
+  admission_controller = admission.AdmissionController(
+      cost_controller.CostLedger(db=None), budget=float('inf'))
+
+  stages = {
+      'convert_aws_response':
+          lambda: aws_comprehend.convert_aws_response(aws_response),
+      'convert_gcp_response':
+          lambda: gcp_language.convert_gcp_response(gcp_response),
+      'NormalizeAwsSentiment':
+          lambda: normalizer.NormalizeAwsSentiment(aws_entities),
+      'NormalizeGcpSentiment':
+          lambda: normalizer.NormalizeGcpSentiment(gcp_entities),
+      'NormalizeAwsResponses_x100':
+          lambda: vectorized_normalizer.NormalizeAwsResponses([aws_response] *
+                                                              100),
+      'NormalizeGcpResponses_x100':
+          lambda: vectorized_normalizer.NormalizeGcpResponses([gcp_response] *
+                                                              100),
+      'MergeEntities':
+          lambda: nlp_client.MergeEntities({
+              'aws': aws_normalized,
+              'gcp': gcp_normalized
+          }),
+      'AdmissionController.Admit':
+          lambda: admission_controller.Admit([text]),
+      'MergedNlpEntities.to_dict':
+          merged_entities.to_dict,
+      # Serialization of responses, by json.dumps as flask.jsonify did, by the
+      # hand-rolled encoder and by orjson when installed.
+      'json.dumps_entity_heavy':
+          lambda: json.dumps(entity_heavy_result.to_dict()),
+      'hand_rolled_encoder_entity_heavy':
+          entity_heavy_result._encode,
+      'MergedNlpEntities.to_json_bytes_entity_heavy':
+          entity_heavy_result.to_json_bytes,
+      'AnalyzeSentiment_no_latency':
+          lambda: client.AnalyzeSentiment(text),
+      'route_no_latency':
+          lambda: server.post('/entity_sentiment', json={'text': text}),
+  }
+  results = {}
+  for name, fn in stages.items():
+    print(f'Benchmarking {name}...')
+    results[name] = BenchmarkStage(fn, iterations)
+  return results
+
+
+def RunEndToEnd(requests: int, concurrency_levels: list[int],
+                latency_seconds: float, jitter_seconds: float) -> dict:
+  client = _NewClient(latency_seconds, jitter_seconds)
+  server = _NewServer(client)
+  text = stub_clients.LoadFixture('comprehend_response.json')['text']
+
+  results = {}
+  for concurrency in concurrency_levels:
+    print(f'Benchmarking route at concurrency {concurrency}...')
+    results[f'route_concurrency_{concurrency}'] = BenchmarkConcurrent(
+        lambda: server.post('/entity_sentiment', json={'text': text}), requests,
+        concurrency)
+  return results
+
+
+def RunBenchmarks(_):
+  latency_seconds = _PROVIDER_LATENCY_MS.value / 1000
+  jitter_seconds = _PROVIDER_JITTER_MS.value / 1000
+  report = {
+      'timestamp':
+          datetime.datetime.now().isoformat(),
+      'python':
+          platform.python_version(),
+      'config': {
+          'iterations': _ITERATIONS.value,
+          'provider_latency_ms': _PROVIDER_LATENCY_MS.value,
+          'provider_jitter_ms': _PROVIDER_JITTER_MS.value,
+          'requests': _REQUESTS.value,
+      },
+      'stages':
+          RunStages(_ITERATIONS.value),
+      'end_to_end':
+          RunEndToEnd(_REQUESTS.value, [int(c) for c in _CONCURRENCY.value],
+                      latency_seconds, jitter_seconds),
+  }
+
+  with open(_RESULTS_FILE.value, 'w') as file:
+    json.dump(report, file, indent=2)
+
+  for section in ('stages', 'end_to_end'):
+    for name, result in report[section].items():
+      print(f'{name:32} {result["ops_per_sec"]:10.1f} ops/s  '
+            f'p50 {result["p50_ms"]:8.3f} ms  p95 {result["p95_ms"]:8.3f} ms  '
+            f'p99 {result["p99_ms"]:8.3f} ms')
+  print(f'Results written to {_RESULTS_FILE.value}.')
+
+
+if __name__ == '__main__':
+  app.run(RunBenchmarks)
@@ -0,0 +1,75 @@
+'''
+  Offline stand-ins for the Comprehend and GCP clients, replaying recorded responses from fixtures.
+  Inject them through AwsComprehendProvider(...) and GcpLanguageProvider(...).
+'''
+from google.cloud import language_v1
+import copy
+import json
+import os
+import random
+import time
+
+_FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def LoadFixture(name: str) -> dict:
+  ''' Returns a fixture holding the analyzed text and the recorded response. '''
+  with open(os.path.join(_FIXTURES_DIR, name), 'r') as file:
+    return json.load(file)
+
+
+class _SimulatedLatency:
+
+  def __init__(self, latency_seconds: float, jitter_seconds: float, seed: int):
+    self.latency_seconds = latency_seconds
+    self.jitter_seconds = jitter_seconds
+    self._random = random.Random(seed)
+
+  def Sleep(self):
+    if self.latency_seconds or self.jitter_seconds:
+      time.sleep(self.latency_seconds +
+                 self._random.uniform(0, self.jitter_seconds))
+
+
+class StubComprehendClient(_SimulatedLatency):
+  ''' Answers every text with the recorded DetectTargetedSentiment response. '''
+
+  def __init__(self,
+               fixture: dict,
+               latency_seconds: float = 0,
+               jitter_seconds: float = 0,
+               seed: int = 0):
+    super().__init__(latency_seconds, jitter_seconds, seed)
+    self.response = fixture['response']
+
+  def detect_targeted_sentiment(self, Text, LanguageCode):
+    self.Sleep()
+    # botocore returns a fresh dict per call.
+    return copy.deepcopy(self.response)
+
+  def batch_detect_targeted_sentiment(self, TextList, LanguageCode):
+    self.Sleep()
+    return {
+        'ResultList': [{
+            'Index': index,
+            **copy.deepcopy(self.response)
+        } for index in range(len(TextList))],
+        'ErrorList': []
+    }
+
+
+class StubLanguageServiceClient(_SimulatedLatency):
+  ''' Answers every text with the recorded AnalyzeEntitySentiment response. '''
+
+  def __init__(self,
+               fixture: dict,
+               latency_seconds: float = 0,
+               jitter_seconds: float = 0,
+               seed: int = 0):
+    super().__init__(latency_seconds, jitter_seconds, seed)
+    self.response_json = json.dumps(fixture['response'])
+
+  def analyze_entity_sentiment(self, request):
+    self.Sleep()
+    return language_v1.AnalyzeEntitySentimentResponse.from_json(
+        self.response_json)
@@ -0,0 +1,165 @@
+'''
+  Offline bulk analysis of JSONL files, e.g. `python main.py --input=requests.jsonl --output=results.jsonl`.
+  Records stream through a generator pipeline (read, batch, dedupe, analyze, write), so memory stays constant regardless of the input size.
+  Progress is checkpointed after every batch, and a rerun resumes from the last checkpoint.
+'''
+from cache import result_cache
+from cost import cost_controller
+from datatypes import nlp_client_types
+from typing import Iterator
+import dataclasses
+import json
+import logging
+import os
+
+
+class BudgetExceededError(Exception):
+  ''' Raised when the monthly budget does not allow analyzing more records. '''
+
+
+@dataclasses.dataclass
+class Checkpoint:
+  input_offset: int = 0  # Bytes of the input already analyzed.
+  output_offset: int = 0  # Bytes of the output written for them.
+
+  @classmethod
+  def Load(cls, path: str) -> 'Checkpoint':
+    try:
+      with open(path, 'r') as file:
+        return cls(**json.load(file))
+    except FileNotFoundError:
+      return cls()
+
+  def Save(self, path: str):
+    # Write then rename, so a crash never leaves a partial checkpoint.
+    with open(f'{path}.tmp', 'w') as file:
+      json.dump(dataclasses.asdict(self), file)
+    os.replace(f'{path}.tmp', path)
+
+
+@dataclasses.dataclass
+class _Record:
+  id: object
+  text: str | None
+  end_offset: int  # Input offset right after this record.
+  error: str | None = None
+
+
+def ReadRecords(input_file, text_field: str,
+                id_field: str) -> Iterator[_Record]:
+  ''' Yields the records of a binary JSONL file from its current position. '''
+  for line in iter(input_file.readline, b''):
+    end_offset = input_file.tell()
+    if not line.strip():
+      continue
+    try:
+      raw_record = json.loads(line)
+    except json.JSONDecodeError:
+      raw_record = None
+    if not isinstance(raw_record, dict):
+      yield _Record(id=None,
+                    text=None,
+                    end_offset=end_offset,
+                    error='record is not a JSON object')
+      continue
+    text = raw_record.get(text_field)
+    if not text or not isinstance(text, str):
+      text = None
+    yield _Record(id=raw_record.get(id_field),
+                  text=text,
+                  end_offset=end_offset,
+                  error=None if text else f'{text_field} is empty')
+
+
+def Batches(records: Iterator[_Record],
+            batch_size: int) -> Iterator[list[_Record]]:
+  batch = []
+  for record in records:
+    batch.append(record)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def AnalyzeBatch(batch: list[_Record], client, ledger,
+                 cache: result_cache.ResultCache) -> list[dict]:
+  ''' Returns the output records of a batch, in input order.
+
+    Texts seen before (in this batch or still in the cache) are analyzed and
+    charged only once. Raises BudgetExceededError without analyzing or
+    charging anything if the batch does not fit in the budget.
+  '''
+  items: list[nlp_client_types.BatchItemResult | None] = [None] * len(batch)
+  key_to_text = {}
+  for index, record in enumerate(batch):
+    if record.error:
+      items[index] = nlp_client_types.BatchItemResult(error=record.error)
+      continue
+    merged_entities = cache.Get(record.text)
+    if merged_entities is not None:
+      items[index] = nlp_client_types.BatchItemResult(result=merged_entities)
+    else:
+      key_to_text.setdefault(result_cache.CacheKey(record.text), record.text)
+
+  if key_to_text:
+    if client.billable:
+      aws_unit, gcp_unit = cost_controller.Units(
+          client.BilledTexts(list(key_to_text.values())))
+      charged, _ = ledger.TryCharge(aws_unit, gcp_unit,
+                                    cost_controller.MONTHLY_BUDGET)
+      if not charged:
+        raise BudgetExceededError('Insufficient budget')
+    analyzed_items = client.AnalyzeSentimentBatch(list(key_to_text.values()))
+    key_to_item = dict(zip(key_to_text, analyzed_items))
+    for text, item in zip(key_to_text.values(), analyzed_items):
+      if item.result is not None:
+        cache.Put(text, item.result)
+    for index, record in enumerate(batch):
+      if items[index] is None:
+        items[index] = key_to_item[result_cache.CacheKey(record.text)]
+
+  return [{
+      'id': record.id,
+      **item.to_dict()
+  } for record, item in zip(batch, items)]
+
+
+def Run(input_path: str,
+        output_path: str,
+        client,
+        ledger,
+        cache: result_cache.ResultCache,
+        text_field: str = 'text',
+        id_field: str = 'id',
+        batch_size: int = 100,
+        checkpoint_path: str | None = None) -> Checkpoint:
+  ''' Analyzes every record of input_path into output_path, returns the final checkpoint.
+
+    Resumes from checkpoint_path (output_path + '.checkpoint' by default). The
+    output is truncated to the checkpointed size first, so records written
+    after the last checkpoint are not duplicated.
+  '''
+  checkpoint_path = checkpoint_path or f'{output_path}.checkpoint'
+  checkpoint = Checkpoint.Load(checkpoint_path)
+  if checkpoint.input_offset:
+    logging.info('Resuming from input offset %d.', checkpoint.input_offset)
+
+  with open(input_path, 'rb') as input_file:
+    with open(output_path, 'ab') as output_file:
+      input_file.seek(checkpoint.input_offset)
+      output_file.truncate(checkpoint.output_offset)
+
+      for batch in Batches(ReadRecords(input_file, text_field, id_field),
+                           batch_size):
+        for output_record in AnalyzeBatch(batch, client, ledger, cache):
+          output_file.write(json.dumps(output_record).encode('utf-8') + b'\n')
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+        checkpoint = Checkpoint(input_offset=batch[-1].end_offset,
+                                output_offset=output_file.tell())
+        checkpoint.Save(checkpoint_path)
+
+  return checkpoint
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bulk import bulk_analyzer
+from cache import result_cache
+from cost import cost_controller
+from datatypes import nlp_client_types
+
+
+class _FakeNlpClient:
+  ''' Reports each text as a single entity. '''
+  billable = True
+
+  def __init__(self):
+    self.analyzed_texts = []
+
+  def BilledTexts(self, texts):
+    return texts
+
+  def AnalyzeSentimentBatch(self, texts):
+    self.analyzed_texts.extend(texts)
+    return [
+        nlp_client_types.
+        BatchItemResult(result=nlp_client_types.MergedNlpEntities(
+            common_entities=[],
+            entities=[nlp_client_types.Entity(text=text, scores={'aws': 0.5})]))
+        for text in texts
+    ]
+
+
+class _FakeLedger:
+  ''' Charges texts of 3 AWS units each, up to budget_texts of them. '''
+
+  def __init__(self, budget_texts=None):
+    self.budget_texts = budget_texts
+    self.aws_unit = 0
+
+  def TryCharge(self, aws_unit, gcp_unit, limit):
+    cost = cost_controller.Cost(month='2023-12',
+                                aws_unit=self.aws_unit + aws_unit)
+    if self.budget_texts is not None and cost.aws_unit > 3 * self.budget_texts:
+      cost.total_cost = limit + 1
+      return False, cost
+    self.aws_unit = cost.aws_unit
+    return True, cost
+
+
+class RunTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.input_path = os.path.join(directory.name, 'requests.jsonl')
+    self.output_path = os.path.join(directory.name, 'results.jsonl')
+
+  def _WriteInput(self, records):
+    with open(self.input_path, 'w') as file:
+      for record in records:
+        file.write(
+            (json.dumps(record) if isinstance(record, dict) else record) + '\n')
+
+  def _ReadOutput(self):
+    with open(self.output_path, 'r') as file:
+      return [json.loads(line) for line in file]
+
+  def _Cache(self):
+    return result_cache.ResultCache(result_cache.LruTtlCache(100, 60))
+
+  def test_results_are_written_in_input_order(self):
+    self._WriteInput([{'id': i, 'text': f'text_{i}'} for i in range(5)])
+
+    bulk_analyzer.Run(self.input_path,
+                      self.output_path,
+                      _FakeNlpClient(),
+                      _FakeLedger(),
+                      self._Cache(),
+                      batch_size=2)
+
+    output = self._ReadOutput()
+    self.assertEqual([record['id'] for record in output], list(range(5)))
+    self.assertEqual(output[3]['result']['entities'][0]['text'], 'text_3')
+
+  def test_duplicate_texts_are_analyzed_and_charged_once(self):
+    self._WriteInput([{
+        'id': i,
+        'text': 'same  text' if i % 2 else 'same text'
+    } for i in range(6)])
+    client = _FakeNlpClient()
+    ledger = _FakeLedger()
+
+    bulk_analyzer.Run(self.input_path,
+                      self.output_path,
+                      client,
+                      ledger,
+                      self._Cache(),
+                      batch_size=4)
+
+    self.assertEqual(client.analyzed_texts, ['same text'])
+    self.assertEqual(ledger.aws_unit, 3)
+    self.assertEqual(len(self._ReadOutput()), 6)
+
+  def test_invalid_records_get_errors(self):
+    self._WriteInput(['not json', {'id': 1}, {'id': 2, 'text': 'text'}])
+
+    bulk_analyzer.Run(self.input_path, self.output_path, _FakeNlpClient(),
+                      _FakeLedger(), self._Cache())
+
+    output = self._ReadOutput()
+    self.assertIsNotNone(output[0]['error'])
+    self.assertEqual(output[1]['error'], 'text is empty')
+    self.assertIsNone(output[2]['error'])
+
+  def test_rerun_resumes_after_budget_is_exceeded(self):
+    self._WriteInput([{'id': i, 'text': f'text_{i}'} for i in range(6)])
+
+    with self.assertRaises(bulk_analyzer.BudgetExceededError):
+      bulk_analyzer.Run(self.input_path,
+                        self.output_path,
+                        _FakeNlpClient(),
+                        _FakeLedger(budget_texts=2),
+                        self._Cache(),
+                        batch_size=2)
+    client = _FakeNlpClient()
+    bulk_analyzer.Run(self.input_path,
+                      self.output_path,
+                      client,
+                      _FakeLedger(),
+                      self._Cache(),
+                      batch_size=2)
+
+    self.assertEqual(client.analyzed_texts,
+                     ['text_2', 'text_3', 'text_4', 'text_5'])
+    self.assertEqual([record['id'] for record in self._ReadOutput()],
+                     list(range(6)))
+
+  def test_batch_over_budget_is_not_charged(self):
+    self._WriteInput([{'id': 0, 'text': 'text_0'}])
+    ledger = cost_controller.CostLedger(db=None)
+    ledger.TryCharge(aws_unit=1000000, gcp_unit=0, limit=float('inf'))
+
+    for _ in range(2):
+      with self.assertRaises(bulk_analyzer.BudgetExceededError):
+        bulk_analyzer.Run(self.input_path, self.output_path, _FakeNlpClient(),
+                          ledger, self._Cache())
+
+    self.assertEqual(ledger.View().aws_unit, 1000000)
+
+  def test_output_written_after_last_checkpoint_is_discarded(self):
+    self._WriteInput([{'id': i, 'text': f'text_{i}'} for i in range(2)])
+    bulk_analyzer.Checkpoint().Save(f'{self.output_path}.checkpoint')
+    with open(self.output_path, 'w') as file:
+      file.write('{"id": "written before a crash"}\n')
+
+    bulk_analyzer.Run(self.input_path, self.output_path, _FakeNlpClient(),
+                      _FakeLedger(), self._Cache())
+
+    self.assertEqual([record['id'] for record in self._ReadOutput()], [0, 1])
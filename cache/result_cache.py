@@ -0,0 +1,192 @@
+'''
+  Content-addressed cache of entity sentiment results.
+  Texts are keyed by a hash of their whitespace-normalized content, so re-posted or syndicated copies of the same text share an entry.
+'''
+from datatypes import nlp_client_types
+import collections
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+_CACHE = 'entity_sentiment_cache'
+
+
+def NormalizeText(text: str) -> str:
+  ''' Collapses whitespace, which does not change provider results. '''
+  return ' '.join(text.split())
+
+
+def CacheKey(text: str) -> str:
+  return hashlib.sha256(NormalizeText(text).encode('utf-8')).hexdigest()
+
+
+@dataclasses.dataclass
+class CacheStats:
+  hits: int = 0
+  misses: int = 0
+  evictions: int = 0  # Entries dropped to stay within capacity.
+  expirations: int = 0  # Entries dropped because their TTL elapsed.
+  tier_hits: int = 0  # Hits served by the second tier, included in hits.
+  size: int = 0
+
+
+class LruTtlCache:
+  ''' Thread-safe in-process LRU cache whose entries expire after a TTL. '''
+
+  def __init__(self,
+               max_entries: int,
+               ttl_seconds: float,
+               clock=time.monotonic):
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self._clock = clock
+    self._entries = collections.OrderedDict()  # key -> (expires_at, value)
+    self._lock = threading.Lock()
+    self.evictions = 0
+    self.expirations = 0
+
+  def Get(self, key: str):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      expires_at, value = entry
+      if expires_at <= self._clock():
+        del self._entries[key]
+        self.expirations += 1
+        return None
+      self._entries.move_to_end(key)
+      return value
+
+  def Put(self, key: str, value):
+    if self.max_entries <= 0:
+      return
+    with self._lock:
+      self._entries[key] = (self._clock() + self.ttl_seconds, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+
+class DiskTier:
+  ''' Second cache tier persisting results as JSON files in a directory. '''
+
+  def __init__(self, directory: str, ttl_seconds: float):
+    self.directory = directory
+    self.ttl_seconds = ttl_seconds
+    os.makedirs(directory, exist_ok=True)
+
+  def _Path(self, key: str) -> str:
+    return os.path.join(self.directory, f'{key}.json')
+
+  def Get(self, key: str) -> nlp_client_types.MergedNlpEntities | None:
+    try:
+      with open(self._Path(key), 'r') as file:
+        entry = json.load(file)
+    except FileNotFoundError:
+      return None
+    if entry['expires_at'] <= time.time():
+      os.remove(self._Path(key))
+      return None
+    return nlp_client_types.MergedNlpEntities.from_dict(entry['value'])
+
+  def Put(self, key: str, value: nlp_client_types.MergedNlpEntities):
+    # Write then rename, so concurrent readers never see a partial file.
+    tmp_path = f'{self._Path(key)}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as file:
+      json.dump(
+          {
+              'expires_at': time.time() + self.ttl_seconds,
+              'value': value.to_dict()
+          }, file)
+    os.replace(tmp_path, self._Path(key))
+
+
+class FirestoreTier:
+  ''' Second cache tier shared by all servers through Firestore. '''
+
+  def __init__(self, db, ttl_seconds: float):
+    self.db = db
+    self.ttl_seconds = ttl_seconds
+
+  def Get(self, key: str) -> nlp_client_types.MergedNlpEntities | None:
+    doc = self.db.collection(_CACHE).document(key).get()
+    if not doc.exists:
+      return None
+    entry = doc.to_dict()
+    if entry['expires_at'] <= time.time():
+      return None
+    return nlp_client_types.MergedNlpEntities.from_dict(entry['value'])
+
+  def Put(self, key: str, value: nlp_client_types.MergedNlpEntities):
+    self.db.collection(_CACHE).document(key).set({
+        'expires_at': time.time() + self.ttl_seconds,
+        'value': value.to_dict()
+    })
+
+
+class ResultCache:
+  ''' Two-tier cache of MergedNlpEntities keyed by normalized text.
+
+    The in-process LRU is consulted first; on a miss the optional second tier
+    (DiskTier or FirestoreTier) is consulted and hits are promoted to memory.
+    Partial results are never cached, so a provider outage does not outlive
+    itself in the cache.
+  '''
+
+  def __init__(self, memory: LruTtlCache, second_tier=None):
+    self.memory = memory
+    self.second_tier = second_tier
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._tier_hits = 0
+    self._misses = 0
+
+  def Get(self, text: str) -> nlp_client_types.MergedNlpEntities | None:
+    key = CacheKey(text)
+    result = self.memory.Get(key)
+    from_tier = False
+    if result is None and self.second_tier is not None:
+      try:
+        result = self.second_tier.Get(key)
+      except Exception as e:
+        logging.warning('Failed to read cache tier: %s', e)
+      if result is not None:
+        from_tier = True
+        self.memory.Put(key, result)
+
+    with self._lock:
+      if result is None:
+        self._misses += 1
+      else:
+        self._hits += 1
+        self._tier_hits += from_tier
+    return result
+
+  def Put(self, text: str, result: nlp_client_types.MergedNlpEntities):
+    if result.partial:
+      return
+    key = CacheKey(text)
+    self.memory.Put(key, result)
+    if self.second_tier is not None:
+      try:
+        self.second_tier.Put(key, result)
+      except Exception as e:
+        logging.warning('Failed to write cache tier: %s', e)
+
+  def Stats(self) -> CacheStats:
+    with self._lock:
+      return CacheStats(hits=self._hits,
+                        misses=self._misses,
+                        evictions=self.memory.evictions,
+                        expirations=self.memory.expirations,
+                        tier_hits=self._tier_hits,
+                        size=len(self.memory))
@@ -0,0 +1,92 @@
+import tempfile
+import unittest
+
+from cache import result_cache
+from datatypes import nlp_client_types
+
+
+class _FakeClock:
+
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+
+def _MergedEntities(partial=False):
+  entity = nlp_client_types.Entity(
+      text='coffee',
+      scores={
+          'aws': 0.5,
+          'gcp': 0.4
+      },
+      overall_sentiment=nlp_client_types.Sentiment.Positive)
+  return nlp_client_types.MergedNlpEntities(common_entities=[entity],
+                                            entities=[entity],
+                                            partial=partial)
+
+
+class LruTtlCacheTest(unittest.TestCase):
+
+  def test_get_missing_key_returns_none(self):
+    cache = result_cache.LruTtlCache(max_entries=2, ttl_seconds=10)
+    self.assertIsNone(cache.Get('key'))
+
+  def test_least_recently_used_entry_is_evicted(self):
+    cache = result_cache.LruTtlCache(max_entries=2, ttl_seconds=10)
+    cache.Put('a', 1)
+    cache.Put('b', 2)
+    cache.Get('a')
+    cache.Put('c', 3)
+
+    self.assertEqual(cache.Get('a'), 1)
+    self.assertIsNone(cache.Get('b'))
+    self.assertEqual(cache.evictions, 1)
+
+  def test_entry_expires_after_ttl(self):
+    clock = _FakeClock()
+    cache = result_cache.LruTtlCache(max_entries=2, ttl_seconds=10, clock=clock)
+    cache.Put('a', 1)
+    clock.now = 10
+
+    self.assertIsNone(cache.Get('a'))
+    self.assertEqual(cache.expirations, 1)
+    self.assertEqual(len(cache), 0)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+  def test_texts_differing_in_whitespace_share_entry(self):
+    cache = result_cache.ResultCache(result_cache.LruTtlCache(10, 10))
+    cache.Put('I like  coffee.\n', _MergedEntities())
+
+    self.assertEqual(cache.Get(' I like coffee.'), _MergedEntities())
+    self.assertEqual(cache.Stats().hits, 1)
+
+  def test_miss_is_counted(self):
+    cache = result_cache.ResultCache(result_cache.LruTtlCache(10, 10))
+
+    self.assertIsNone(cache.Get('I like coffee.'))
+    self.assertEqual(cache.Stats().misses, 1)
+
+  def test_partial_result_is_not_cached(self):
+    cache = result_cache.ResultCache(result_cache.LruTtlCache(10, 10))
+    cache.Put('I like coffee.', _MergedEntities(partial=True))
+
+    self.assertIsNone(cache.Get('I like coffee.'))
+
+  def test_disk_tier_hit_is_promoted_to_memory(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = result_cache.ResultCache(result_cache.LruTtlCache(10, 10),
+                                       second_tier=result_cache.DiskTier(
+                                           directory, ttl_seconds=10))
+      cache.Put('I like coffee.', _MergedEntities())
+      # A fresh process only has the disk tier.
+      cache = result_cache.ResultCache(result_cache.LruTtlCache(10, 10),
+                                       second_tier=result_cache.DiskTier(
+                                           directory, ttl_seconds=10))
+
+      self.assertEqual(cache.Get('I like coffee.'), _MergedEntities())
+      self.assertEqual(cache.Stats().tier_hits, 1)
+      self.assertEqual(cache.Stats().size, 1)
@@ -0,0 +1,50 @@
+'''
+  Coalesces concurrent identical work: while a call for a key is in flight, later callers with the same key wait for its result instead of calling again.
+  Unlike the result cache, which only helps once a result exists, this absorbs bursts of the same text arriving within the latency of a single analysis.
+'''
+from monitoring import metrics
+import concurrent.futures
+import threading
+
+_COALESCED = metrics.Counter(
+    'single_flight_coalesced_total',
+    'Calls that waited for an identical in-flight call instead of calling.')
+
+
+class SingleFlight:
+  ''' Shares one call of a function among the concurrent callers of a key.
+
+    Every waiter gets the result, or the exception, of the call in flight.
+    Once it returns, the next caller of the key calls again.
+  '''
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls: dict[str, concurrent.futures.Future] = {}
+
+  def Do(self, key: str, function):
+    ''' Returns function(), or the result of the in-flight call of key. '''
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = concurrent.futures.Future()
+    if not leader:
+      _COALESCED.Inc()
+      return call.result()
+
+    try:
+      result = function()
+    except Exception as e:
+      call.set_exception(e)
+      raise
+    else:
+      call.set_result(result)
+      return result
+    finally:
+      with self._lock:
+        del self._calls[key]
+
+  def __len__(self) -> int:
+    ''' Number of calls in flight. '''
+    return len(self._calls)
@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+from cache import single_flight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+  def _CallConcurrently(self, flight, key, function, callers):
+    ''' Calls flight.Do from callers threads, returning their results or exceptions. '''
+    results = [None] * callers
+    started = threading.Barrier(callers)
+
+    def Call(index):
+      started.wait()
+      try:
+        results[index] = flight.Do(key, function)
+      except Exception as e:
+        results[index] = e
+
+    threads = [
+        threading.Thread(target=Call, args=(index,)) for index in range(callers)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def test_concurrent_callers_share_one_call(self):
+    flight = single_flight.SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def Analyze():
+      calls.append(1)
+      release.wait(timeout=5)
+      return 'result'
+
+    # Releases the call once all other callers had the time to wait for it.
+    threading.Timer(0.2, release.set).start()
+    results = self._CallConcurrently(flight, 'key', Analyze, callers=8)
+
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(results, ['result'] * 8)
+    self.assertEqual(len(flight), 0)
+
+  def test_waiters_get_the_exception_of_the_call(self):
+    flight = single_flight.SingleFlight()
+    release = threading.Event()
+
+    def Fail():
+      release.wait(timeout=5)
+      raise RuntimeError('unavailable')
+
+    threading.Timer(0.2, release.set).start()
+    results = self._CallConcurrently(flight, 'key', Fail, callers=4)
+
+    self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+  def test_sequential_and_distinct_keys_call_again(self):
+    flight = single_flight.SingleFlight()
+    calls = []
+
+    def Analyze():
+      calls.append(1)
+      return len(calls)
+
+    self.assertEqual(flight.Do('a', Analyze), 1)
+    self.assertEqual(flight.Do('a', Analyze), 2)
+    self.assertEqual(flight.Do('b', Analyze), 3)
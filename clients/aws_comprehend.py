@@ -0,0 +1,268 @@
+'''
+  AWS Comprehend provider, based on DetectTargetedSentiment.
+  Reference https://docs.aws.amazon.com/comprehend/latest/APIReference/API_DetectTargetedSentiment.html.
+'''
+from clients import providers, replay, resilience
+from datatypes import aws_types
+from normalization import canonicalizer, normalizer
+from segmentation import packer
+import collections
+import copy
+import json
+import utils
+
+botocore_config = utils.LazyModule('botocore.config')
+botocore_exceptions = utils.LazyModule('botocore.exceptions')
+botocore_session = utils.LazyModule('botocore.session')
+vectorized_normalizer = utils.LazyModule('normalization.vectorized_normalizer')
+
+_THROTTLING_CODES = ('ThrottlingException', 'TooManyRequestsException')
+_TRANSIENT_CODES = ('InternalServerException', 'ServiceUnavailableException')
+
+
+def convert_aws_response(response) -> list[aws_types.AwsEntity]:
+  aws_entities = []
+
+  for raw_entity in response.get('Entities', []):
+    aws_entity = aws_types.AwsEntity(text=canonicalizer.CanonicalText(
+        aws_types.DescriptiveText(raw_entity)),
+                                     mentions=[])
+
+    for raw_mention in raw_entity['Mentions']:
+      aws_entity.mentions.append(
+          aws_types.Mention(text=raw_mention['Text'],
+                            score=raw_mention['Score'],
+                            group_score=raw_mention['GroupScore'],
+                            sentiments=aws_types.SentimentScore(
+                                positive=raw_mention['MentionSentiment']
+                                ['SentimentScore']['Positive'],
+                                negative=raw_mention['MentionSentiment']
+                                ['SentimentScore']['Negative'])))
+
+    aws_entities.append(aws_entity)
+
+  return aws_entities
+
+
+def CombineAwsResponses(responses: list[dict]) -> dict:
+  ''' Returns a response holding the entities of all chunks of a document. '''
+  if len(responses) == 1:
+    return responses[0]
+  return {
+      'Entities': [
+          raw_entity for response in responses
+          for raw_entity in response.get('Entities', [])
+      ]
+  }
+
+
+def ClassifyAwsError(error: Exception) -> str | None:
+  ''' Returns whether a Comprehend error is worth retrying, see resilience.ProviderGuard. '''
+  if isinstance(error, botocore_exceptions.ClientError):
+    code = error.response.get('Error', {}).get('Code')
+    if code in _THROTTLING_CODES:
+      return resilience.THROTTLED
+    if code in _TRANSIENT_CODES:
+      return resilience.TRANSIENT
+    return None
+  if isinstance(error, (botocore_exceptions.ConnectionError,
+                        botocore_exceptions.HTTPClientError)):
+    return resilience.TRANSIENT
+  return None
+
+
+def SplitPackedAwsResponse(response: dict, pack: packer.Pack) -> list[dict]:
+  ''' Splits a response to pack.text into a response to each packed document.
+
+    Entity groups are split by document, keeping their descriptive mention
+    where possible, or else the longest one.
+  '''
+  documents = [{'Entities': []} for _ in pack.documents]
+  for raw_entity in response.get('Entities', []):
+    descriptive_indices = set(raw_entity.get('DescriptiveMentionIndex', []))
+    # Position in the pack -> (index in the group, rebased mention).
+    position_mentions = collections.defaultdict(list)
+    for index, raw_mention in enumerate(raw_entity['Mentions']):
+      position = pack.Locate(raw_mention['BeginOffset'], pack.char_spans)
+      if position is None:
+        continue
+      begin = pack.char_spans[position][0]
+      position_mentions[position].append((index, {
+          **raw_mention, 'BeginOffset': raw_mention['BeginOffset'] - begin,
+          'EndOffset': raw_mention['EndOffset'] - begin
+      }))
+    for position, mentions in position_mentions.items():
+      descriptive_mention_index = [
+          new_index for new_index, (index, _) in enumerate(mentions)
+          if index in descriptive_indices
+      ] or [
+          max(range(len(mentions)),
+              key=lambda new_index: len(mentions[new_index][1]['Text']))
+      ]
+      documents[position]['Entities'].append({
+          **raw_entity, 'DescriptiveMentionIndex': descriptive_mention_index,
+          'Mentions': [raw_mention for _, raw_mention in mentions]
+      })
+  return documents
+
+
+def _InjectedAwsError() -> Exception:
+  return botocore_exceptions.ClientError(
+      {
+          'Error': {
+              'Code': 'ServiceUnavailableException',
+              'Message': 'Injected by the replay transport.'
+          }
+      }, 'DetectTargetedSentiment')
+
+
+class ReplayComprehendClient:
+  ''' Stands in for the Comprehend client, recording or replaying responses with a replay.Transport.
+
+    Recording needs the live client. Replayed batches report texts without a
+    recorded response in their ErrorList.
+  '''
+
+  def __init__(self, transport: replay.Transport, live_client=None):
+    self.transport = transport
+    self.live_client = live_client
+
+  def detect_targeted_sentiment(self, Text, LanguageCode):
+    return self.transport.Call(
+        AwsComprehendProvider.name,
+        Text,
+        lambda: self.live_client.detect_targeted_sentiment(
+            Text=Text, LanguageCode=LanguageCode),
+        encode=lambda response: json.dumps(response, default=str),
+        decode=json.loads,
+        error=_InjectedAwsError)
+
+  def batch_detect_targeted_sentiment(self, TextList, LanguageCode):
+    name = AwsComprehendProvider.name
+    if self.transport.recording:
+      response = self.live_client.batch_detect_targeted_sentiment(
+          TextList=TextList, LanguageCode=LanguageCode)
+      for item in response.get('ResultList', []):
+        result = copy.copy(item)
+        del result['Index']
+        self.transport.Save(name, TextList[item['Index']],
+                            json.dumps(result, default=str))
+      return response
+
+    self.transport.Simulate(name, _InjectedAwsError)
+    response = {'ResultList': [], 'ErrorList': []}
+    for index, text in enumerate(TextList):
+      encoded = self.transport.Load(name, text)
+      if encoded is None:
+        response['ErrorList'].append({
+            'Index': index,
+            'ErrorCode': 'ReplayMiss',
+            'ErrorMessage': 'No response recorded for the text.'
+        })
+      else:
+        response['ResultList'].append({'Index': index, **json.loads(encoded)})
+    return response
+
+  def list_endpoints(self, MaxResults):
+    if self.transport.recording:
+      return self.live_client.list_endpoints(MaxResults=MaxResults)
+    return {'EndpointPropertiesList': []}
+
+
+@providers.Register
+class AwsComprehendProvider(providers.Provider):
+  name = 'aws'
+  # Max number of documents per BatchDetectTargetedSentiment call.
+  batch_size = 25
+  packable = True
+  # Max size of a DetectTargetedSentiment document.
+  max_document_bytes = 5000
+
+  def __init__(self, comprehend_client, **kwargs):
+    super().__init__(**kwargs)
+    self.comprehend_client = comprehend_client
+
+  @classmethod
+  def FromConfig(cls, config) -> 'AwsComprehendProvider':
+    ''' Returns a provider calling Comprehend with the credentials of config.aws_cred_file.
+
+      The connection pool should hold at least as many connections as there
+      are concurrent calls, or calls queue for a free connection. Calls are
+      rate limited to config.aws_tps, which should be the quota divided by the
+      number of serving processes.
+    '''
+    if not config.aws_cred_file:
+      raise ValueError('Did not find any AWS credential provided.')
+    aws_credentials = utils.LoadAwsCredentials(config.aws_cred_file)
+    return cls(
+        botocore_session.Session().create_client(
+            'comprehend',
+            region_name='us-west-2',
+            aws_access_key_id=aws_credentials.access_key_id,
+            aws_secret_access_key=aws_credentials.secret_access_key,
+            config=botocore_config.Config(
+                max_pool_connections=config.aws_max_pool_connections,
+                tcp_keepalive=True,
+                # Retries are left to resilience.ProviderGuard.
+                retries={'total_max_attempts': 1})),
+        guard=cls._Guard(config))
+
+  @classmethod
+  def _Guard(cls, config) -> resilience.ProviderGuard:
+    return resilience.ProviderGuard(cls.name,
+                                    ClassifyAwsError,
+                                    bucket=resilience.TokenBucket(
+                                        config.aws_tps))
+
+  @classmethod
+  def FromReplay(cls, config,
+                 transport: replay.Transport) -> 'AwsComprehendProvider':
+    ''' Returns a provider replaying recorded responses, or recording those of Comprehend. '''
+    live_client = None
+    if transport.recording:
+      live_client = cls.FromConfig(config).comprehend_client
+    return cls(ReplayComprehendClient(transport, live_client),
+               guard=cls._Guard(config))
+
+  ClassifyError = staticmethod(ClassifyAwsError)
+
+  def Request(self, text: str) -> dict:
+    return self.comprehend_client.detect_targeted_sentiment(
+        Text=text  # UTF-8 encoded text, maximum string size 5KB.
+        ,
+        LanguageCode='en'  # English (en) is the only supported language.
+    )
+
+  def RequestBatch(self, texts: list[str]) -> list:
+    response = self.comprehend_client.batch_detect_targeted_sentiment(
+        TextList=texts, LanguageCode='en')
+    results = [None] * len(texts)
+    for item in response.get('ResultList', []):
+      results[item['Index']] = item
+    for error in response.get('ErrorList', []):
+      results[error['Index']] = providers.DocumentError(
+          f'{error.get("ErrorCode")}: {error.get("ErrorMessage")}')
+    return results
+
+  def Combine(self, responses: list[dict]) -> dict:
+    return CombineAwsResponses(responses)
+
+  def SplitPacked(self, response: dict, pack: packer.Pack) -> list[dict]:
+    return SplitPackedAwsResponse(response, pack)
+
+  def NormalizeOne(self, response: dict) -> list:
+    return normalizer.NormalizeAwsSentiment(convert_aws_response(response))
+
+  def NormalizeMany(self, responses: list[dict]) -> list:
+    return vectorized_normalizer.NormalizeAwsResponses(responses)
+
+  def _WarmUp(self):
+    try:
+      # ListEndpoints is free, and served by the same endpoint as analyses.
+      self.comprehend_client.list_endpoints(MaxResults=1)
+    except botocore_exceptions.ClientError:
+      pass  # Comprehend answered, e.g. denied the call, so the connection is open.
+
+  def WarmUpCalls(self, connections: int, timeout_seconds: float) -> list:
+    # Concurrent calls fill the connection pool with TLS connections.
+    return [self._WarmUp] * connections
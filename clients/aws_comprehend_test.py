@@ -0,0 +1,215 @@
+import tempfile
+import unittest
+from clients import aws_comprehend, providers, replay
+from datatypes import aws_types
+from segmentation import packer
+
+
+class ConvertAwsResponseTest(unittest.TestCase):
+
+  def test_convert_aws_comprehend_response_expectedly(self):
+    response = aws_comprehend.convert_aws_response({
+        "Entities": [{
+            "DescriptiveMentionIndex": [0],
+            "Mentions": [{
+                "Score": 0.9999949932098389,
+                "GroupScore": 1,
+                "Text": "I",
+                "Type": "PERSON",
+                "MentionSentiment": {
+                    "Sentiment": "NEUTRAL",
+                    "SentimentScore": {
+                        "Positive": 0,
+                        "Negative": 0,
+                        "Neutral": 1,
+                        "Mixed": 0
+                    }
+                },
+                "BeginOffset": 0,
+                "EndOffset": 1
+            }]
+        }, {
+            "DescriptiveMentionIndex": [0, 1],
+            "Mentions": [{
+                "Score": 0.9999819993972778,
+                "GroupScore": 0.999563992023468,
+                "Text": "coffee",
+                "Type": "OTHER",
+                "MentionSentiment": {
+                    "Sentiment": "NEGATIVE",
+                    "SentimentScore": {
+                        "Positive": 0.000003999999989900971,
+                        "Negative": 0.9992110133171082,
+                        "Neutral": 0.0007830000249668956,
+                        "Mixed": 0.0000019999999949504854
+                    }
+                },
+                "BeginOffset": 103,
+                "EndOffset": 109
+            }, {
+                "Score": 0.9999650120735168,
+                "GroupScore": 1,
+                "Text": "coffee",
+                "Type": "OTHER",
+                "MentionSentiment": {
+                    "Sentiment": "POSITIVE",
+                    "SentimentScore": {
+                        "Positive": 0.9999989867210388,
+                        "Negative": 0,
+                        "Neutral": 0,
+                        "Mixed": 0
+                    }
+                },
+                "BeginOffset": 17,
+                "EndOffset": 23
+            }]
+        }]
+    })
+
+    expected_entities = [
+        aws_types.AwsEntity(text='I',
+                            mentions=[
+                                aws_types.Mention(
+                                    text='I',
+                                    score=0.9999949932098389,
+                                    group_score=1,
+                                    sentiments=aws_types.SentimentScore(
+                                        positive=0,
+                                        negative=0,
+                                    )),
+                            ]),
+        aws_types.AwsEntity(
+            text='coffee',
+            mentions=[
+                aws_types.Mention(text='coffee',
+                                  score=0.9999819993972778,
+                                  group_score=0.999563992023468,
+                                  sentiments=aws_types.SentimentScore(
+                                      positive=0.000003999999989900971,
+                                      negative=0.9992110133171082,
+                                  )),
+                aws_types.Mention(text='coffee',
+                                  score=0.9999650120735168,
+                                  group_score=1,
+                                  sentiments=aws_types.SentimentScore(
+                                      positive=0.9999989867210388,
+                                      negative=0,
+                                  )),
+            ]),
+    ]
+    self.assertEqual(response, expected_entities)
+
+  def test_pronoun_gives_way_to_descriptive_mention(self):
+    mention = {
+        'Score': 1,
+        'GroupScore': 1,
+        'MentionSentiment': {
+            'SentimentScore': {
+                'Positive': 1,
+                'Negative': 0
+            }
+        }
+    }
+
+    aws_entity, = aws_comprehend.convert_aws_response({
+        'Entities': [{
+            'DescriptiveMentionIndex': [1],
+            'Mentions': [{
+                **mention, 'Text': 'AWS Comprehend'
+            }, {
+                **mention, 'Text': 'it'
+            }]
+        }]
+    })
+
+    self.assertEqual(aws_entity.text, 'AWS Comprehend')
+
+
+def _Mention(text, begin_offset):
+  return {
+      'Text': text,
+      'BeginOffset': begin_offset,
+      'EndOffset': begin_offset + len(text)
+  }
+
+
+class SplitPackedAwsResponseTest(unittest.TestCase):
+
+  def test_entity_groups_are_split_by_document(self):
+    pack, = packer.PackDocuments(['I like tea.', 'Tea is bad, it is cold.'],
+                                 100)
+
+    documents = aws_comprehend.SplitPackedAwsResponse(
+        {
+            'Entities': [{
+                'DescriptiveMentionIndex': [1],
+                'Mentions': [
+                    _Mention('tea', 7),
+                    _Mention('Tea', 13),
+                    _Mention('it', 25)
+                ]
+            }]
+        }, pack)
+
+    self.assertEqual(documents, [{
+        'Entities': [{
+            'DescriptiveMentionIndex': [0],
+            'Mentions': [_Mention('tea', 7)]
+        }]
+    }, {
+        'Entities': [{
+            'DescriptiveMentionIndex': [0],
+            'Mentions': [_Mention('Tea', 0),
+                         _Mention('it', 12)]
+        }]
+    }])
+
+
+class _LiveComprehendClient:
+
+  def __init__(self):
+    self.calls = 0
+
+  def _Response(self, text):
+    return {'Entities': [{'Mentions': [{'Text': text}]}]}
+
+  def detect_targeted_sentiment(self, Text, LanguageCode):
+    self.calls += 1
+    return self._Response(Text)
+
+  def batch_detect_targeted_sentiment(self, TextList, LanguageCode):
+    self.calls += 1
+    return {
+        'ResultList': [{
+            'Index': index,
+            **self._Response(text)
+        } for index, text in enumerate(TextList)],
+        'ErrorList': []
+    }
+
+
+class ReplayComprehendClientTest(unittest.TestCase):
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.live_client = _LiveComprehendClient()
+    self.recorder = aws_comprehend.AwsComprehendProvider(
+        aws_comprehend.ReplayComprehendClient(
+            replay.Transport(replay.RECORD, directory.name), self.live_client))
+    self.player = aws_comprehend.AwsComprehendProvider(
+        aws_comprehend.ReplayComprehendClient(
+            replay.Transport(replay.REPLAY, directory.name)))
+
+  def test_replays_single_and_batch_responses_by_text(self):
+    self.recorder.Request('coffee')
+    self.recorder.RequestBatch(['tea', 'water'])
+
+    self.assertEqual(self.player.Request('water'),
+                     self.live_client._Response('water'))
+    results = self.player.RequestBatch(['coffee', 'juice', 'tea'])
+
+    self.assertEqual(self.live_client.calls, 2)
+    self.assertEqual(results[0]['Entities'][0]['Mentions'][0]['Text'], 'coffee')
+    self.assertIsInstance(results[1], providers.DocumentError)
+    self.assertEqual(results[2]['Entities'][0]['Mentions'][0]['Text'], 'tea')
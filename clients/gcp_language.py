@@ -0,0 +1,239 @@
+'''
+  GCP Natural Language provider, based on AnalyzeEntitySentiment.
+  Reference https://cloud.google.com/natural-language/docs/reference/rest/v1/documents/analyzeEntitySentiment.
+'''
+from clients import providers, replay, resilience
+from datatypes import gcp_types
+from normalization import canonicalizer, normalizer
+from segmentation import packer
+import collections
+import itertools
+import threading
+import utils
+
+language_v1 = utils.LazyModule('google.cloud.language_v1')
+language_grpc = utils.LazyModule(
+    'google.cloud.language_v1.services.language_service.transports.grpc')
+api_exceptions = utils.LazyModule('google.api_core.exceptions')
+grpc = utils.LazyModule('grpc')
+vectorized_normalizer = utils.LazyModule('normalization.vectorized_normalizer')
+
+
+def convert_gcp_response(
+    response: 'language_v1.AnalyzeEntitySentimentResponse'
+) -> list[gcp_types.GcpEntity]:
+  return list(
+      map(
+          lambda raw_entity: gcp_types.GcpEntity(
+              name=canonicalizer.CanonicalText(raw_entity.name),
+              salience=raw_entity.salience,
+              sentiment=gcp_types.Sentiment(score=raw_entity.sentiment.score,
+                                            magnitude=raw_entity.sentiment.
+                                            magnitude)),
+          response.entities,
+      ))
+
+
+def CombineGcpResponses(
+    responses: list['language_v1.AnalyzeEntitySentimentResponse']
+) -> 'language_v1.AnalyzeEntitySentimentResponse':
+  ''' Returns a response holding the entities of all chunks of a document. '''
+  if len(responses) == 1:
+    return responses[0]
+  return language_v1.AnalyzeEntitySentimentResponse(entities=[
+      raw_entity for response in responses for raw_entity in response.entities
+  ])
+
+
+def SplitPackedGcpResponse(
+    response: 'language_v1.AnalyzeEntitySentimentResponse',
+    pack: packer.Pack) -> list['language_v1.AnalyzeEntitySentimentResponse']:
+  ''' Splits a response to pack.text into a response to each packed document.
+
+    Mention offsets are in UTF-8 bytes, as requested with EncodingType.UTF8.
+    An entity mentioned in several documents is split, with the mean score and
+    the summed magnitude of its mentions in each document as sentiment.
+  '''
+  document_entities = [[] for _ in pack.documents]
+  for raw_entity in response.entities:
+    position_mentions = collections.defaultdict(list)
+    for raw_mention in raw_entity.mentions:
+      position = pack.Locate(raw_mention.text.begin_offset, pack.byte_spans)
+      if position is None:
+        continue
+      position_mentions[position].append(
+          language_v1.EntityMention(text=language_v1.TextSpan(
+              content=raw_mention.text.content,
+              begin_offset=raw_mention.text.begin_offset -
+              pack.byte_spans[position][0]),
+                                    type_=raw_mention.type_,
+                                    sentiment=raw_mention.sentiment))
+    for position, mentions in position_mentions.items():
+      sentiment = raw_entity.sentiment
+      if len(position_mentions) > 1:
+        sentiment = language_v1.Sentiment(
+            score=sum(mention.sentiment.score for mention in mentions) /
+            len(mentions),
+            magnitude=sum(mention.sentiment.magnitude for mention in mentions))
+      document_entities[position].append(
+          language_v1.Entity(name=raw_entity.name,
+                             type_=raw_entity.type_,
+                             metadata=dict(raw_entity.metadata),
+                             salience=raw_entity.salience,
+                             mentions=mentions,
+                             sentiment=sentiment))
+  return [
+      language_v1.AnalyzeEntitySentimentResponse(entities=entities)
+      for entities in document_entities
+  ]
+
+
+def ClassifyGcpError(error: Exception) -> str | None:
+  ''' Returns whether a GCP error is worth retrying, see resilience.ProviderGuard. '''
+  if isinstance(error, api_exceptions.ResourceExhausted):
+    return resilience.THROTTLED
+  if isinstance(
+      error,
+      (api_exceptions.ServiceUnavailable, api_exceptions.DeadlineExceeded,
+       api_exceptions.InternalServerError, api_exceptions.Aborted)):
+    return resilience.TRANSIENT
+  return None
+
+
+def _GrpcChannelOptions(keepalive_seconds: int) -> list[tuple]:
+  return [
+      ('grpc.keepalive_time_ms', keepalive_seconds * 1000),
+      ('grpc.keepalive_timeout_ms', 10 * 1000),
+      ('grpc.keepalive_permit_without_calls', 1),
+      ('grpc.http2.max_pings_without_data', 0),
+      # Gives each channel its own connection instead of sharing subchannels.
+      ('grpc.use_local_subchannel_pool', 1),
+  ]
+
+
+class GcpClientPool:
+  ''' Spreads calls round-robin over LanguageServiceClients with a channel each.
+
+    A channel multiplexes all its calls on a single HTTP/2 connection, which
+    caps the number of concurrent streams.
+  '''
+
+  def __init__(self, clients: list['language_v1.LanguageServiceClient']):
+    self.clients = clients
+    self._next_client = itertools.cycle(clients)
+    self._lock = threading.Lock()
+
+  def analyze_entity_sentiment(self, request):
+    with self._lock:
+      client = next(self._next_client)
+    # Retries are left to resilience.ProviderGuard.
+    return client.analyze_entity_sentiment(request=request, retry=None)
+
+  def WarmUp(self, timeout_seconds: float):
+    ''' Connects all channels, without sending any request. '''
+    for client in self.clients:
+      grpc.channel_ready_future(
+          client.transport.grpc_channel).result(timeout=timeout_seconds)
+
+
+def _InjectedGcpError() -> Exception:
+  return api_exceptions.ServiceUnavailable('Injected by the replay transport.')
+
+
+class ReplayLanguageClient:
+  ''' Stands in for GcpClientPool, recording or replaying responses with a replay.Transport.
+
+    Recording needs the live client pool.
+  '''
+
+  def __init__(self, transport: replay.Transport, live_client=None):
+    self.transport = transport
+    self.live_client = live_client
+
+  def analyze_entity_sentiment(self, request):
+    response_type = language_v1.AnalyzeEntitySentimentResponse
+    return self.transport.Call(
+        GcpLanguageProvider.name,
+        request['document']['content'],
+        lambda: self.live_client.analyze_entity_sentiment(request),
+        encode=response_type.to_json,
+        decode=response_type.from_json,
+        error=_InjectedGcpError)
+
+  def WarmUp(self, timeout_seconds: float):
+    if self.transport.recording:
+      self.live_client.WarmUp(timeout_seconds)
+
+
+@providers.Register
+class GcpLanguageProvider(providers.Provider):
+  name = 'gcp'
+  packable = True
+  # Max size of a Natural Language API document.
+  max_document_bytes = 1_000_000
+
+  def __init__(self, language_client, **kwargs):
+    super().__init__(**kwargs)
+    self.language_client = language_client
+
+  @classmethod
+  def FromConfig(cls, config) -> 'GcpLanguageProvider':
+    ''' Returns a provider calling GCP with the default credentials.
+
+      Calls are spread on config.gcp_channels gRPC channels and rate limited to
+      config.gcp_tps, which should be the quota divided by the number of
+      serving processes.
+    '''
+    transport = language_grpc.LanguageServiceGrpcTransport
+    return cls(GcpClientPool([
+        language_v1.LanguageServiceClient(transport=transport(
+            channel=transport.create_channel(
+                options=_GrpcChannelOptions(config.keepalive_seconds))))
+        for _ in range(config.gcp_channels)
+    ]),
+               guard=cls._Guard(config))
+
+  @classmethod
+  def _Guard(cls, config) -> resilience.ProviderGuard:
+    return resilience.ProviderGuard(cls.name,
+                                    ClassifyGcpError,
+                                    bucket=resilience.TokenBucket(
+                                        config.gcp_tps))
+
+  @classmethod
+  def FromReplay(cls, config,
+                 transport: replay.Transport) -> 'GcpLanguageProvider':
+    ''' Returns a provider replaying recorded responses, or recording those of GCP. '''
+    live_client = None
+    if transport.recording:
+      live_client = cls.FromConfig(config).language_client
+    return cls(ReplayLanguageClient(transport, live_client),
+               guard=cls._Guard(config))
+
+  ClassifyError = staticmethod(ClassifyGcpError)
+
+  def Request(self, text: str) -> 'language_v1.AnalyzeEntitySentimentResponse':
+    return self.language_client.analyze_entity_sentiment(
+        request={
+            "document": {
+                "content": text,
+                "type_": language_v1.types.Document.Type.PLAIN_TEXT,
+                # "language": "en" # Optional. If not specified, the language is automatically detected.
+            },
+            "encoding_type": language_v1.EncodingType.UTF8
+        })
+
+  def Combine(self, responses: list):
+    return CombineGcpResponses(responses)
+
+  def SplitPacked(self, response, pack: packer.Pack) -> list:
+    return SplitPackedGcpResponse(response, pack)
+
+  def NormalizeOne(self, response) -> list:
+    return normalizer.NormalizeGcpSentiment(convert_gcp_response(response))
+
+  def NormalizeMany(self, responses: list) -> list:
+    return vectorized_normalizer.NormalizeGcpResponses(responses)
+
+  def WarmUpCalls(self, connections: int, timeout_seconds: float) -> list:
+    return [lambda: self.language_client.WarmUp(timeout_seconds)]
@@ -0,0 +1,130 @@
+import tempfile
+import unittest
+from clients import gcp_language, replay
+from google.cloud import language_v1
+from datatypes import gcp_types
+from segmentation import packer
+
+
+class ConvertGcpResponseTest(unittest.TestCase):
+
+  def test_convert_gcp_nlp_api_response_expectedly(self):
+    response = language_v1.AnalyzeEntitySentimentResponse.from_json('''
+        {
+            "entities": [
+            {
+                "name": "coffee",
+                "salience": 1,
+                "mentions": [
+                {
+                    "text": {
+                    "content": "coffee",
+                    "begin_offset": 7
+                    },
+                    "sentiment": {
+                    "magnitude": 1,
+                    "score": 0
+                    }
+                }
+                ],
+                "sentiment": {
+                "magnitude": 1,
+                "score": 0
+                }
+            }
+            ],
+            "language": "en"
+        }
+        ''')
+
+    self.assertAlmostEqual(gcp_language.convert_gcp_response(response), [
+        gcp_types.GcpEntity(name='coffee',
+                            salience=1,
+                            sentiment=gcp_types.Sentiment(
+                                score=0,
+                                magnitude=1,
+                            )),
+    ])
+
+
+class SplitPackedGcpResponseTest(unittest.TestCase):
+
+  def test_entities_are_split_by_document_on_byte_offsets(self):
+    pack, = packer.PackDocuments(['Café is good.', 'The café is bad.'], 100)
+
+    def Mention(begin_offset, score):
+      return language_v1.EntityMention(
+          text=language_v1.TextSpan(content='café', begin_offset=begin_offset),
+          sentiment=language_v1.Sentiment(score=score, magnitude=abs(score)))
+
+    documents = gcp_language.SplitPackedGcpResponse(
+        language_v1.AnalyzeEntitySentimentResponse(entities=[
+            language_v1.Entity(
+                name='café',
+                mentions=[Mention(0, 0.8), Mention(20, -0.6)],
+                sentiment=language_v1.Sentiment(score=0.1, magnitude=1.4))
+        ]), pack)
+
+    self.assertEqual(len(documents), 2)
+    first_entity, = documents[0].entities
+    second_entity, = documents[1].entities
+    self.assertEqual(first_entity.mentions[0].text.begin_offset, 0)
+    self.assertAlmostEqual(first_entity.sentiment.score, 0.8, places=5)
+    self.assertEqual(second_entity.mentions[0].text.begin_offset, 4)
+    self.assertAlmostEqual(second_entity.sentiment.score, -0.6, places=5)
+
+
+class _FakeLanguageServiceClient:
+
+  def analyze_entity_sentiment(self, request, retry):
+    pass
+
+
+class GcpClientPoolTest(unittest.TestCase):
+
+  def test_calls_are_spread_round_robin(self):
+    clients = [_FakeLanguageServiceClient(), _FakeLanguageServiceClient()]
+    calls = []
+    for index, client in enumerate(clients):
+      client.analyze_entity_sentiment = (
+          lambda request, retry, index=index: calls.append(index))
+    pool = gcp_language.GcpClientPool(clients)
+
+    for _ in range(3):
+      pool.analyze_entity_sentiment(request={})
+
+    self.assertEqual(calls, [0, 1, 0])
+
+
+class _LivePool:
+
+  def __init__(self):
+    self.requests = []
+
+  def analyze_entity_sentiment(self, request):
+    self.requests.append(request)
+    return language_v1.AnalyzeEntitySentimentResponse(entities=[
+        language_v1.Entity(name=request['document']['content'],
+                           sentiment=language_v1.Sentiment(score=0.5))
+    ])
+
+
+class ReplayLanguageClientTest(unittest.TestCase):
+
+  def test_replays_recorded_responses(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    live_pool = _LivePool()
+    recorder = gcp_language.GcpLanguageProvider(
+        gcp_language.ReplayLanguageClient(
+            replay.Transport(replay.RECORD, directory.name), live_pool))
+    recorded = recorder.Request('coffee')
+
+    player = gcp_language.GcpLanguageProvider(
+        gcp_language.ReplayLanguageClient(
+            replay.Transport(replay.REPLAY, directory.name)))
+
+    self.assertEqual(player.Request('coffee'), recorded)
+    self.assertEqual(len(live_pool.requests), 1)
+    with self.assertRaises(replay.ReplayMiss):
+      player.Request('tea')
@@ -0,0 +1,181 @@
+'''
+  Offline entity-sentiment provider scoring sentences with a sentiment lexicon, on CPU only.
+  Each content word, or run of capitalized words, of a sentence is an entity mention carrying the sentiment of that sentence, so entities get the same normalized Entity shape as cloud providers and merge with them by text.
+'''
+from clients import providers
+from datatypes import nlp_client_types
+from normalization import canonicalizer, normalizer
+from segmentation import segmenter
+import math
+import os
+import re
+
+_DEFAULT_LEXICON_FILE = os.path.join(os.path.dirname(__file__), 'data',
+                                     'sentiment_lexicon.tsv')
+# Squashes summed valences into (-1, 1), as in VADER.
+_NORMALIZATION_ALPHA = 15
+# Number of words after a negation whose valence it flips.
+_NEGATION_SCOPE = 3
+_TOKEN = re.compile(r"[^\W\d_](?:[\w'’-]*\w)?")
+# Contrasting clauses of a sentence often differ in sentiment, e.g. "the pizza
+# was bad, but the beer was great".
+_CLAUSE_BREAK = re.compile(r'[,;:]+|\s(?:but|however|although|though|while)\s',
+                           re.IGNORECASE)
+_NEGATIONS = frozenset(
+    "not no never none nobody nothing neither nor without isn't wasn't aren't "
+    "weren't don't doesn't didn't can't cannot couldn't won't wouldn't "
+    "shouldn't hardly barely".split())
+_INTENSIFIERS = {
+    'very': 1.5,
+    'really': 1.5,
+    'extremely': 1.8,
+    'so': 1.3,
+    'too': 1.3,
+    'quite': 1.2,
+    'absolutely': 1.8,
+    'totally': 1.5,
+    'slightly': 0.6,
+    'somewhat': 0.7,
+}
+# Function words and common verbs, which are never entities.
+_STOPWORDS = frozenset(
+    "a about above after again against all also am an and any are as at be "
+    "because been before being below between both but by could did do does "
+    "doing down during each even ever every few for from further get gets got "
+    "had has have having he her here hers herself him himself his how i if in "
+    "into is it its itself just let me more most much must my myself of off on "
+    "once only or other our ours ourselves out over own same she should since "
+    "some such than that the their theirs them themselves then there these "
+    "they this those through to under until up us was we were what when where "
+    "which while who whom why will with would you your yours yourself "
+    "yourselves one two go going went gone come came make made take took say "
+    "said see saw seem seems seemed think thought feel felt know knew try "
+    "tried use used want wanted need needed look looked give gave find found "
+    "tell told ask asked work worked call called keep kept put yet still "
+    "already again almost always often sometimes usually maybe perhaps "
+    "anyway though although however instead rather yes yeah oh i'm it's "
+    "that's there's i've i'd i'll you're we're they're".split())
+
+
+def LoadLexicon(path: str) -> dict[str, float]:
+  ''' Reads a tab-separated file of lowercase words and their valence in [-4, 4]. '''
+  lexicon = {}
+  with open(path, 'r', encoding='utf-8') as file:
+    for line in file:
+      if not line.strip() or line.startswith('#'):
+        continue
+      word, valence = line.split('\t')
+      lexicon[word.strip().lower()] = float(valence)
+  return lexicon
+
+
+class LexiconAnalyzer:
+  ''' Finds entity mentions in text and scores them with the sentiment of their sentence. '''
+
+  def __init__(self, lexicon: dict[str, float]):
+    self.lexicon = lexicon
+
+  def Valence(self, words: list[str]) -> float:
+    ''' Returns the summed valence of lowercase words, accounting for negations and intensifiers. '''
+    total = 0
+    negated_words = 0
+    intensity = 1
+    for word in words:
+      if word in _NEGATIONS:
+        negated_words = _NEGATION_SCOPE
+        continue
+      if word in _INTENSIFIERS:
+        intensity *= _INTENSIFIERS[word]
+        continue
+      valence = self.lexicon.get(word)
+      if valence is not None:
+        total += valence * intensity * (-0.75 if negated_words else 1)
+      intensity = 1
+      negated_words = max(0, negated_words - 1)
+    return total
+
+  def _IsCandidate(self, word: str) -> bool:
+    lower_word = word.lower()
+    return (len(word) > 1 and lower_word not in _STOPWORDS and
+            lower_word not in self.lexicon and lower_word not in _NEGATIONS and
+            lower_word not in _INTENSIFIERS)
+
+  def Mentions(self, sentence: str) -> list[str]:
+    ''' Returns the entity mentions of a sentence, joining runs of capitalized words like "New York". '''
+    mentions = []
+    run = []
+    for word in _TOKEN.findall(sentence):
+      if not self._IsCandidate(word):
+        run = []
+        continue
+      if run and word[0].isupper() and run[-1][0].isupper():
+        run.append(word)
+        mentions[-1] = ' '.join(run)
+      else:
+        run = [word]
+        mentions.append(word)
+    return mentions
+
+  def Analyze(self, text: str) -> list[tuple[str, float]]:
+    ''' Returns (entity text, score in (-1, 1)) of every mention, in order.
+
+      A mention gets the sentiment of its clause, or of its sentence if the
+      clause has no sentiment word.
+    '''
+    mentions = []
+    for sentence in segmenter.SplitSentences(text):
+      clauses = _CLAUSE_BREAK.split(sentence)
+      valences = [
+          self.Valence([word.lower()
+                        for word in _TOKEN.findall(clause)])
+          for clause in clauses
+      ]
+      sentence_valence = sum(valences)
+      for clause, valence in zip(clauses, valences):
+        valence = valence or sentence_valence
+        score = valence / math.sqrt(valence * valence + _NORMALIZATION_ALPHA)
+        mentions += [(mention, score) for mention in self.Mentions(clause)]
+    return mentions
+
+
+@normalizer.NORMALIZE_SECONDS.Timed('local', 'scalar')
+def NormalizeLocalSentiment(
+    mentions: list[tuple[str, float]]) -> list[nlp_client_types.Entity]:
+  ''' Averages the scores of the mentions of each entity. '''
+  text_to_mentions = normalizer.GroupByCanonicalKey(
+      mentions, lambda mention: canonicalizer.CanonicalText(mention[0]))
+  return [
+      nlp_client_types.Entity(text=text,
+                              scores={
+                                  'local':
+                                      normalizer.ArithmeticMean(
+                                          [score for _, score in mentions])
+                              }) for text, mentions in text_to_mentions.items()
+  ]
+
+
+@providers.Register
+class LexiconProvider(providers.Provider):
+  name = 'local'
+  # Runs on CPU, so calls cost nothing.
+  billable = False
+
+  def __init__(self, analyzer: LexiconAnalyzer, **kwargs):
+    super().__init__(**kwargs)
+    self.analyzer = analyzer
+
+  @classmethod
+  def FromConfig(cls, config) -> 'LexiconProvider':
+    ''' Returns a provider with the lexicon of config.local_lexicon_file, or the bundled one. '''
+    return cls(
+        LexiconAnalyzer(
+            LoadLexicon(config.local_lexicon_file or _DEFAULT_LEXICON_FILE)))
+
+  def Request(self, text: str) -> list[tuple[str, float]]:
+    return self.analyzer.Analyze(text)
+
+  def Combine(self, responses: list) -> list[tuple[str, float]]:
+    return [mention for response in responses for mention in response]
+
+  def NormalizeOne(self, response: list) -> list[nlp_client_types.Entity]:
+    return NormalizeLocalSentiment(response)
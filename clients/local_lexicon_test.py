@@ -0,0 +1,61 @@
+import unittest
+from clients import local_lexicon
+
+_LEXICON = {'good': 2, 'great': 3, 'bad': -2, 'like': 1}
+
+
+class LexiconAnalyzerTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.analyzer = local_lexicon.LexiconAnalyzer(_LEXICON)
+
+  def test_valence_flips_negated_words(self):
+    self.assertEqual(self.analyzer.Valence(['not', 'good']), -1.5)
+
+  def test_valence_scales_intensified_words(self):
+    self.assertEqual(self.analyzer.Valence(['very', 'good']), 3)
+
+  def test_mentions_skip_stopwords_and_sentiment_words(self):
+    self.assertEqual(self.analyzer.Mentions('The coffee was good'), ['coffee'])
+
+  def test_mentions_join_capitalized_runs(self):
+    self.assertEqual(self.analyzer.Mentions('I like Blue Bottle Coffee'),
+                     ['Blue Bottle Coffee'])
+
+  def test_contrasting_clauses_get_their_own_sentiment(self):
+    mentions = dict(
+        self.analyzer.Analyze('The pizza was bad, but the beer was great.'))
+
+    self.assertLess(mentions['pizza'], 0)
+    self.assertGreater(mentions['beer'], 0)
+
+  def test_clause_without_sentiment_words_gets_the_sentence_sentiment(self):
+    mentions = dict(
+        self.analyzer.Analyze('The coffee, which I ordered, was great.'))
+
+    self.assertGreater(mentions['coffee'], 0)
+
+
+class LexiconProviderTest(unittest.TestCase):
+
+  def test_entities_average_mentions_of_all_chunks(self):
+    provider = local_lexicon.LexiconProvider(
+        local_lexicon.LexiconAnalyzer(_LEXICON))
+
+    entities = provider.NormalizeOne(
+        provider.Combine([
+            provider.Request('The coffee is great.'),
+            provider.Request('The coffee is bad.')
+        ]))
+
+    self.assertEqual([entity.text for entity in entities], ['coffee'])
+    # Mean of 3 / sqrt(3^2 + 15) and -2 / sqrt(2^2 + 15).
+    self.assertAlmostEqual(entities[0].scores['local'],
+                           (3 / 24**0.5 - 2 / 19**0.5) / 2)
+
+  def test_bundled_lexicon_loads(self):
+    lexicon = local_lexicon.LoadLexicon(local_lexicon._DEFAULT_LEXICON_FILE)
+
+    self.assertGreater(lexicon['excellent'], 0)
+    self.assertLess(lexicon['terrible'], 0)
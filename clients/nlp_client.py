@@ -1,66 +1,184 @@
-from datatypes import aws_types, gcp_types, nlp_client_types
-from google.cloud import language_v1
-from google.auth import credentials
-from botocore import session
-from normalization import normalizer
-import collections
-
-
-def convert_aws_response(response) -> list[aws_types.AwsEntity]:
-  aws_entities = []
-
-  for raw_entity in response.get('Entities', []):
-    aws_entity = aws_types.AwsEntity(text='', mentions=[])
-
-    if raw_entity.get('DescriptiveMentionIndex'):
-      # Able to find a descriptive mention index best matching this entity group.
-      description_index = raw_entity['DescriptiveMentionIndex'][0]
-      aws_entity.text = raw_entity['Mentions'][description_index]['Text']
-
-    for raw_mention in raw_entity['Mentions']:
-      aws_entity.mentions.append(
-          aws_types.Mention(text=raw_mention['Text'],
-                            score=raw_mention['Score'],
-                            group_score=raw_mention['GroupScore'],
-                            sentiments=aws_types.SentimentScore(
-                                positive=raw_mention['MentionSentiment']
-                                ['SentimentScore']['Positive'],
-                                negative=raw_mention['MentionSentiment']
-                                ['SentimentScore']['Negative'])))
-
-    aws_entities.append(aws_entity)
-
-  return aws_entities
-
-
-def convert_gcp_response(
-    response: language_v1.AnalyzeEntitySentimentResponse
-) -> list[gcp_types.GcpEntity]:
-  return list(
-      map(
-          lambda raw_entity: gcp_types.GcpEntity(
-              name=raw_entity.name,
-              salience=raw_entity.salience,
-              sentiment=gcp_types.Sentiment(score=raw_entity.sentiment.score,
-                                            magnitude=raw_entity.sentiment.
-                                            magnitude)),
-          response.entities,
-      ))
+# Registers the providers ServiceConfig.providers can name.
+from clients import aws_comprehend, gcp_language, local_lexicon  # pylint: disable=unused-import
+from cache import result_cache
+from clients import providers, replay, resilience
+from datatypes import nlp_client_types
+from monitoring import metrics
+from normalization import canonicalizer
+from segmentation import packer, segmenter
+from concurrent import futures
+from typing import Callable
+import logging
+import math
+import threading
+import time
+
+# Upper bound of in-flight provider calls shared by all NlpClient instances.
+_MAX_PROVIDER_WORKERS = 32
+# Max number of provider calls one batch keeps in flight.
+_DEFAULT_BATCH_CONCURRENCY = 8
+# Max size of packed requests, the Comprehend document limit.
+_DEFAULT_PACK_MAX_BYTES = 5000
+# Seconds a batch may wait for provider calls, below the gunicorn timeout.
+_DEFAULT_BATCH_TIMEOUT_SECONDS = 45
+# Analysis modes, see NewClient.
+CLOUD = 'cloud'
+LOCAL = 'local'
+LOCAL_FIRST = 'local_first'
+
+_PROVIDER_ERRORS = metrics.Counter('nlp_provider_errors_total',
+                                   'Failed or timed out NLP provider calls.',
+                                   ('provider', 'reason'))
+_STAGE_SECONDS = metrics.Histogram('nlp_client_stage_seconds',
+                                   'Latency of NlpClient stages.', ('stage',))
+_SENTENCE_LOOKUPS = metrics.Counter(
+    'nlp_incremental_sentences_total',
+    'Sentences of incrementally analyzed texts, by whether their provider response was cached.',
+    ('provider', 'outcome'))
+_ESCALATIONS = metrics.Counter(
+    'nlp_escalations_total',
+    'Texts the local provider was unsure of, by whether they were sent to the cloud providers.',
+    ('outcome',))
+
+_shared_executor: futures.ThreadPoolExecutor | None = None
+_shared_executor_lock = threading.Lock()
+
+
+class ProviderError(Exception):
+  ''' Raised when no NLP provider returned a usable result. '''
+
+
+def SharedExecutor() -> futures.ThreadPoolExecutor:
+  ''' Returns the process-wide thread pool used to fan out provider calls. '''
+  global _shared_executor
+  with _shared_executor_lock:
+    if _shared_executor is None:
+      _shared_executor = futures.ThreadPoolExecutor(
+          max_workers=_MAX_PROVIDER_WORKERS, thread_name_prefix='nlp_provider')
+    return _shared_executor
+
+
+def _Succeeded(future: futures.Future) -> bool:
+  return future.done() and not future.cancelled() and future.exception() is None
+
+
+def RunBounded(executor: futures.Executor,
+               calls: list,
+               max_in_flight: int,
+               deadlines: list[float] | None = None):
+  ''' Runs the zero-argument calls on executor with at most max_in_flight at once.
+
+    Returns results in the order of calls, with the raised exception in place
+    of the result of a failed call. With deadlines, the time.monotonic() each
+    call must finish by, calls still running at their deadline get a
+    futures.TimeoutError and are no longer waited for, and calls still queued
+    then are not run at all.
+  '''
+  results = [None] * len(calls)
+  pending = {}
+  next_call = 0
+  while next_call < len(calls) or pending:
+    while next_call < len(calls) and len(pending) < max_in_flight:
+      if deadlines is not None and deadlines[next_call] <= time.monotonic():
+        results[next_call] = futures.TimeoutError('Deadline exceeded.')
+      else:
+        pending[executor.submit(calls[next_call])] = next_call
+      next_call += 1
+    if not pending:
+      continue
+    timeout = None
+    if deadlines is not None:
+      timeout = max(
+          0,
+          min(deadlines[index] for index in pending.values()) -
+          time.monotonic())
+    done, _ = futures.wait(pending,
+                           timeout=timeout,
+                           return_when=futures.FIRST_COMPLETED)
+    for future in done:
+      index = pending.pop(future)
+      try:
+        results[index] = future.result()
+      except Exception as e:
+        results[index] = e
+    if deadlines is not None:
+      now = time.monotonic()
+      for future, index in list(pending.items()):
+        if deadlines[index] <= now:
+          del pending[future]
+          future.cancel()
+          results[index] = futures.TimeoutError('Deadline exceeded.')
+  return results
+
+
+def _CombineChunks(combine, text_chunks: list[list[str]],
+                   results: list) -> list:
+  ''' Combines the results of the chunks of each text, or returns the exception of any failed chunk. '''
+  combined = []
+  begin = 0
+  for chunks in text_chunks:
+    chunk_results = results[begin:begin + len(chunks)]
+    begin += len(chunks)
+    error = next(
+        (result for result in chunk_results if isinstance(result, Exception)),
+        None)
+    combined.append(error or combine(chunk_results))
+  return combined
+
+
+def _NormalizeDocuments(normalize_documents, results: list) -> list:
+  ''' Normalizes the raw responses in results in one call, keeping exceptions. '''
+  indices = [
+      index for index, result in enumerate(results)
+      if not isinstance(result, Exception)
+  ]
+  normalized = normalize_documents([results[index] for index in indices])
+  results = list(results)
+  for index, entities in zip(indices, normalized):
+    results[index] = entities
+  return results
+
+
+def _UnpackDocuments(split, packs: list[packer.Pack], results: list,
+                     document_count: int) -> list:
+  ''' Splits the result of each pack into results of its documents, which get the exception of a failed pack. '''
+  document_results = [None] * document_count
+  for pack, result in zip(packs, results):
+    if isinstance(result, Exception):
+      pack_results = [result] * len(pack.documents)
+    else:
+      pack_results = split(result, pack)
+    for index, document_result in zip(pack.documents, pack_results):
+      document_results[index] = document_result
+  return document_results
+
+
+def _NewProvider(provider_class: type[providers.Provider], config,
+                 transport: replay.Transport | None) -> providers.Provider:
+  if transport is None:
+    return provider_class.FromConfig(config)
+  return provider_class.FromReplay(config, transport)
 
 
 def ComputeSentimentInMergedEntity(
-    entity: nlp_client_types.Entity) -> nlp_client_types.Sentiment:
+    entity: nlp_client_types.Entity,
+    min_polar_score: float = 0) -> nlp_client_types.Sentiment:
   ''' Returns a unanimous sentiment derived from ALL results of NLP sentiment analysis to the specified entity. 
   
     Positive: When all sentiments are positive.
     Negative: When all sentiments are negative.
     Neutral: When all sentiments exhibit a state of neutrality within a defined range.
     Unsure: Cannot decide. 
+
+    Positive and negative sentiments also need all scores to be at least
+    min_polar_score away from 0, which lets a single provider be unsure.
   '''
-  scores = [entity.aws_score, entity.gcp_score]
+  scores = entity.scores.values()
 
   if all(abs(score) <= 0.1 for score in scores):
     return nlp_client_types.Sentiment.Neutral
+  elif not all(abs(score) >= min_polar_score for score in scores):
+    return nlp_client_types.Sentiment.Unsure
   elif all(score > 0 for score in scores):
     return nlp_client_types.Sentiment.Positive
   elif all(score < 0 for score in scores):
@@ -69,80 +187,577 @@ def ComputeSentimentInMergedEntity(
   return nlp_client_types.Sentiment.Unsure
 
 
-# TODO: refactor here.
 def MergeEntities(
-    aws_entities: list[nlp_client_types.Entity],
-    gcp_entities: list[nlp_client_types.Entity]
-) -> list[nlp_client_types.Entity]:
-
-  text_to_entitiy_sentiment = collections.defaultdict(
-      lambda: nlp_client_types.Entity(
-          text=None, aws_score=None, gcp_score=None, overall_sentiment=None))
-
-  for aws_entity in aws_entities:
-    text_to_entitiy_sentiment[aws_entity.text].text = aws_entity.text
-    text_to_entitiy_sentiment[aws_entity.text].aws_score = aws_entity.aws_score
-  for gcp_entity in gcp_entities:
-    text_to_entitiy_sentiment[gcp_entity.text].text = gcp_entity.text
-    text_to_entitiy_sentiment[gcp_entity.text].gcp_score = gcp_entity.gcp_score
-
-  return nlp_client_types.MergedNlpEntities(
-      common_entities=[
-          text_to_entitiy_sentiment[text]
-          for text in sorted(text_to_entitiy_sentiment)
-          if text_to_entitiy_sentiment[text].gcp_score is not None and
-          text_to_entitiy_sentiment[text].aws_score is not None
-      ],
-      entities=[
-          text_to_entitiy_sentiment[text]
-          for text in sorted(text_to_entitiy_sentiment)
-      ])
+    provider_entities: dict[str, list[nlp_client_types.Entity] | None]
+) -> nlp_client_types.MergedNlpEntities:
+  ''' Merges the entities of each provider by canonical text, in a single pass over all of them.
+
+    A merged entity has the text of the first provider which found it, see
+    canonicalizer. A provider mapped to None failed, so no entity is common to
+    all providers.
+  '''
+  key_to_entity = {}
+  for entities in provider_entities.values():
+    for entity in entities or ():
+      key = canonicalizer.CanonicalKey(entity.text)
+      merged_entity = key_to_entity.get(key)
+      if merged_entity is None:
+        key_to_entity[key] = nlp_client_types.Entity(text=entity.text,
+                                                     scores=dict(entity.scores))
+      else:
+        merged_entity.scores.update(entity.scores)
+
+  entities = sorted(key_to_entity.values(), key=lambda entity: entity.text)
+  return nlp_client_types.MergedNlpEntities(common_entities=[
+      entity for entity in entities
+      if len(entity.scores) == len(provider_entities)
+  ],
+                                            entities=entities,
+                                            providers=list(provider_entities))
 
 
 class NlpClient:
+  ''' Analyzes texts with all providers concurrently and merges their entities. '''
+
+  def __init__(self,
+               providers: list[providers.Provider],
+               executor: futures.Executor | None = None,
+               batch_concurrency: int = _DEFAULT_BATCH_CONCURRENCY,
+               max_chunk_bytes: int | None = None,
+               min_polar_score: float = 0,
+               pack_max_bytes: int = 0,
+               batch_timeout_seconds: float = _DEFAULT_BATCH_TIMEOUT_SECONDS):
+    self.providers = providers
+    self.executor = executor or SharedExecutor()
+    self.batch_concurrency = batch_concurrency
+    # Caps the max_document_bytes of every provider if set.
+    self.max_chunk_bytes = max_chunk_bytes
+    self.min_polar_score = min_polar_score
+    # Batches pack short documents into requests of up to pack_max_bytes for
+    # the providers supporting it, or not at all if 0.
+    self.pack_max_bytes = pack_max_bytes
+    # Documents of a batch whose provider calls cannot finish within
+    # batch_timeout_seconds, e.g. waiting for the rate limiter, fail.
+    self.batch_timeout_seconds = batch_timeout_seconds
 
-  def __init__(self, aws_comprehend_client=None, gcp_nlp_client=None):
-    self.aws_comprehend_client = aws_comprehend_client
-    self.gcp_nlp_client = gcp_nlp_client
+  @property
+  def billable(self) -> bool:
+    ''' Whether analyses are paid for, so callers charge texts to the cost ledger first. '''
+    return any(provider.billable for provider in self.providers)
 
   @classmethod
-  def NewNlpClient(cls, aws_credentials,
-                   gcp_credentials: credentials.Credentials | None):
-    return NlpClient(
-        aws_comprehend_client=session.Session().create_client(
-            'comprehend',
-            region_name='us-west-2',
-            aws_access_key_id=aws_credentials.access_key_id,
-            aws_secret_access_key=aws_credentials.secret_access_key),
-        gcp_nlp_client=language_v1.LanguageServiceClient(
-            credentials=gcp_credentials),
-    )
+  def NewNlpClient(cls, config) -> 'NlpClient':
+    ''' Returns a client of the providers listed in config.providers, see service.ServiceConfig.
+
+      With config.transport set to record or replay, the cloud providers call
+      through a replay.Transport.
+    '''
+    transport = replay.NewTransport(config)
+    return cls(
+        [
+            _NewProvider(providers.Get(name.strip()), config, transport)
+            for name in config.providers.split(',')
+        ],
+        # Incremental analysis packs sentences, which alone would mostly pay
+        # for the minimum units of a request.
+        pack_max_bytes=_DEFAULT_PACK_MAX_BYTES
+        if config.pack_texts or config.incremental else 0,
+        batch_timeout_seconds=config.batch_timeout_seconds)
+
+  def WarmUp(self, connections: int, timeout_seconds: float) -> dict[str, bool]:
+    ''' Opens provider connections ahead of the first request.
+
+      Runs the warm-up calls of all providers concurrently, e.g. `connections`
+      free calls filling the Comprehend connection pool. Returns whether each
+      provider was reached within timeout_seconds.
+    '''
+    provider_futures = {
+        provider.name: [
+            self.executor.submit(call)
+            for call in provider.WarmUpCalls(connections, timeout_seconds)
+        ] for provider in self.providers
+    }
+    futures.wait([
+        future for warm_up_futures in provider_futures.values()
+        for future in warm_up_futures
+    ],
+                 timeout=timeout_seconds)
+
+    status = {
+        name: all(_Succeeded(future) for future in warm_up_futures)
+        for name, warm_up_futures in provider_futures.items()
+    }
+    for name, succeeded in status.items():
+      if not succeeded:
+        logging.warning('Failed to warm up %s connections.', name)
+    return status
+
+  def _ChunkBytes(self, provider: providers.Provider) -> int | None:
+    limits = [
+        max_bytes for max_bytes in (provider.max_document_bytes,
+                                    self.max_chunk_bytes) if max_bytes
+    ]
+    return min(limits) if limits else None
+
+  def Chunk(self, provider: providers.Provider, text: str) -> list[str]:
+    ''' Splits text on sentence boundaries into the documents provider analyzes it in. '''
+    max_bytes = self._ChunkBytes(provider)
+    return segmenter.Chunk(text, max_bytes) if max_bytes else [text]
+
+  @staticmethod
+  def _Entities(provider: providers.Provider,
+                responses: list) -> list[nlp_client_types.Entity] | None:
+    ''' Returns the provider's entities of all chunks, or None if any chunk failed or timed out. '''
+    try:
+      error = next((response for response in responses
+                    if isinstance(response, Exception)), None)
+      if error is not None:
+        raise error
+      return provider.NormalizeOne(provider.Combine(responses))
+    except futures.TimeoutError:
+      _PROVIDER_ERRORS.Inc(provider.name, 'timeout')
+      logging.warning('%s timed out, continuing without its result.',
+                      provider.name)
+    except (resilience.CircuitOpenError, resilience.RateLimitedError) as e:
+      # Already counted by the provider guard.
+      logging.info('%s skipped, continuing without its result: %s',
+                   provider.name, e)
+    except Exception as e:
+      _PROVIDER_ERRORS.Inc(provider.name, 'error')
+      logging.warning('%s failed, continuing without its result: %s',
+                      provider.name, e)
+    return None
 
   def AnalyzeSentiment(self, text: str) -> nlp_client_types.MergedNlpEntities:
-    aws_response = self.aws_comprehend_client.detect_targeted_sentiment(
-        Text=text  # UTF-8 encoded text, maximum string size 5KB.
-        ,
-        LanguageCode='en'  # English (en) is the only supported language.
-    )
-    aws_entities = normalizer.NormalizeAwsSentiment(
-        convert_aws_response(aws_response))
-
-    gcp_response = self.gcp_nlp_client.analyze_entity_sentiment(
-        request={
-            "document": {
-                "content": text,
-                "type_": language_v1.types.Document.Type.PLAIN_TEXT,
-                # "language": "en" # Optional. If not specified, the language is automatically detected.
-            },
-            "encoding_type": language_v1.EncodingType.UTF8
-        })
-    gcp_entities = normalizer.NormalizeGcpSentiment(
-        convert_gcp_response(gcp_response))
-
-    merged_entities = MergeEntities(aws_entities, gcp_entities)
+    ''' Calls all providers concurrently and merges whatever they return.
+
+      Texts longer than a provider's max_document_bytes are split on sentence
+      boundaries and all chunks are analyzed concurrently, with at most
+      batch_concurrency calls in flight. The entities of all chunks are
+      normalized together, so each mention weighs the same as in a single
+      request. A provider that fails, exceeds its timeout or has an open
+      circuit on any chunk contributes no entities, so the result only fills
+      `entities`. Raises ProviderError if all providers failed.
+    '''
+    start = time.monotonic()
+    provider_chunks = [
+        self.Chunk(provider, text) for provider in self.providers
+    ]
+    calls = []
+    deadlines = []
+    for provider, chunks in zip(self.providers, provider_chunks):
+      deadline = start + provider.timeout_seconds
+      for chunk in chunks:
+        calls.append(lambda provider=provider, chunk=chunk, deadline=deadline:
+                     provider.Call(chunk, deadline))
+        deadlines.append(deadline)
+
+    with _STAGE_SECONDS.Time('await_providers'):
+      results = iter(
+          RunBounded(self.executor, calls, self.batch_concurrency, deadlines))
+      provider_entities = {
+          provider.name:
+              self._Entities(provider, [next(results) for _ in chunks])
+          for provider, chunks in zip(self.providers, provider_chunks)
+      }
+    if all(entities is None for entities in provider_entities.values()):
+      raise ProviderError('All NLP providers failed.')
+
+    with _STAGE_SECONDS.Time('merge'):
+      return self._Merge(provider_entities)
+
+  def _Merge(
+      self, provider_entities: dict[str, list[nlp_client_types.Entity] | None]
+  ) -> nlp_client_types.MergedNlpEntities:
+    merged_entities = MergeEntities(provider_entities)
+    merged_entities.partial = any(
+        entities is None for entities in provider_entities.values())
 
     # Label sentiment to common entities.
     for entity in merged_entities.common_entities:
-      entity.overall_sentiment = ComputeSentimentInMergedEntity(entity)
+      entity.overall_sentiment = ComputeSentimentInMergedEntity(
+          entity, self.min_polar_score)
 
     return merged_entities
+
+  def _CallBatch(self, provider: providers.Provider, batch: list[str],
+                 deadline: float) -> list:
+    ''' Returns raw results of a batch, or an exception for failed documents, in input order. '''
+    if time.monotonic() >= deadline:
+      _PROVIDER_ERRORS.Inc(provider.name, 'timeout', amount=len(batch))
+      return [futures.TimeoutError('Deadline exceeded.')] * len(batch)
+    try:
+      results = provider.CallBatch(batch, deadline)
+    except (resilience.CircuitOpenError, resilience.RateLimitedError) as e:
+      # Already counted by the provider guard.
+      return [e] * len(batch)
+    except Exception as e:
+      _PROVIDER_ERRORS.Inc(provider.name, 'error')
+      return [e] * len(batch)
+    _PROVIDER_ERRORS.Inc(
+        provider.name,
+        'error',
+        amount=sum(isinstance(result, Exception) for result in results))
+    return results
+
+  def _Packing(self) -> bool:
+    return bool(self.pack_max_bytes) and any(
+        provider.packable and provider.billable for provider in self.providers)
+
+  def BilledTexts(self, texts: list[str]) -> list[str]:
+    ''' Returns the texts providers bill for a batch of texts, i.e. their packs when packing.
+
+      Packs are those of the billable provider with the smallest documents,
+      e.g. Comprehend, whose minimum units make each chunk count.
+    '''
+    if not self._Packing():
+      return texts
+    provider = min((provider for provider in self.providers
+                    if provider.packable and provider.billable),
+                   key=lambda provider: self._ChunkBytes(provider) or math.inf)
+    documents = [
+        chunk for text in texts for chunk in self.Chunk(provider, text)
+    ]
+    return [
+        pack.text
+        for pack in packer.PackDocuments(documents, self.pack_max_bytes)
+    ]
+
+  def AnalyzeDocuments(self,
+                       provider_documents: list[list[str]],
+                       deadlines: list[float] | None = None) -> list[list]:
+    ''' Returns the raw response of each provider to each of its documents.
+
+      provider_documents holds the documents of each provider, in the order of
+      providers; a failed document gets the exception in place of its
+      response. So does a document whose provider call did not finish by the
+      deadline of its provider, batch_timeout_seconds from now by default,
+      including calls that would have waited for the rate limiter past it.
+      With pack_max_bytes, documents are packed together into requests to the
+      providers supporting it, and their responses are split back by mention
+      offsets. Each provider gets its requests in batches of its batch_size,
+      e.g. 25 per BatchDetectTargetedSentiment call for AWS and one per call
+      for GCP; all calls share a bound of batch_concurrency in-flight
+      requests.
+    '''
+    provider_packs = []
+    provider_batches = []
+    for provider, documents in zip(self.providers, provider_documents):
+      packs = None
+      if self.pack_max_bytes and provider.packable:
+        packs = packer.PackDocuments(documents, self.pack_max_bytes)
+      requests = [pack.text for pack in packs] if packs else documents
+      provider_packs.append(packs)
+      provider_batches.append([
+          requests[begin:begin + provider.batch_size]
+          for begin in range(0, len(requests), provider.batch_size)
+      ])
+    if deadlines is None:
+      deadlines = [time.monotonic() + self.batch_timeout_seconds] * len(
+          self.providers)
+    calls = []
+    call_deadlines = []
+    for provider, batches, deadline in zip(self.providers, provider_batches,
+                                           deadlines):
+      for batch in batches:
+        calls.append(lambda provider=provider, batch=batch, deadline=deadline:
+                     self._CallBatch(provider, batch, deadline))
+        call_deadlines.append(deadline)
+    results = iter(
+        RunBounded(self.executor, calls, self.batch_concurrency,
+                   call_deadlines))
+
+    provider_results = []
+    for provider, documents, packs, batches in zip(self.providers,
+                                                   provider_documents,
+                                                   provider_packs,
+                                                   provider_batches):
+      document_results = []
+      for batch in batches:
+        batch_results = next(results)
+        if isinstance(batch_results, futures.TimeoutError):
+          _PROVIDER_ERRORS.Inc(provider.name, 'timeout', amount=len(batch))
+          batch_results = [batch_results] * len(batch)
+        document_results += batch_results
+      if packs:
+        document_results = _UnpackDocuments(provider.SplitPacked, packs,
+                                            document_results, len(documents))
+      provider_results.append(document_results)
+    return provider_results
+
+  def AnalyzeSentimentBatch(
+      self, texts: list[str]) -> list[nlp_client_types.BatchItemResult]:
+    ''' Analyzes many texts with few provider round-trips.
+
+      Long texts are split for each provider as in AnalyzeSentiment, each
+      chunk being a separate document analyzed by AnalyzeDocuments. The raw
+      responses of all texts are normalized together by each provider's
+      NormalizeMany. Results are in input order, and an item only carries an
+      error if all providers failed on it.
+    '''
+    provider_text_chunks = [[self.Chunk(provider, text)
+                             for text in texts]
+                            for provider in self.providers]
+    provider_results = self.AnalyzeDocuments(
+        [[chunk
+          for chunks in text_chunks
+          for chunk in chunks]
+         for text_chunks in provider_text_chunks])
+    return self.MergeDocuments([
+        _CombineChunks(provider.Combine, text_chunks, document_results)
+        for provider, text_chunks, document_results in zip(
+            self.providers, provider_text_chunks, provider_results)
+    ])
+
+  def MergeDocuments(
+      self,
+      provider_results: list[list]) -> list[nlp_client_types.BatchItemResult]:
+    ''' Normalizes and merges the raw response of each provider to each text, in the order of providers. '''
+    text_count = len(provider_results[0]) if provider_results else 0
+    provider_results = {
+        provider.name:
+            _NormalizeDocuments(provider.NormalizeMany, document_results)
+        for provider, document_results in zip(self.providers, provider_results)
+    }
+    items = []
+    for index in range(text_count):
+      text_results = {
+          name: results[index] for name, results in provider_results.items()
+      }
+      errors = [
+          result for result in text_results.values()
+          if isinstance(result, Exception)
+      ]
+      if len(errors) == len(text_results):
+        items.append(
+            nlp_client_types.BatchItemResult(
+                error='All NLP providers failed: ' +
+                '; '.join(str(error) for error in errors)))
+        continue
+      items.append(
+          nlp_client_types.BatchItemResult(result=self._Merge({
+              name: None if isinstance(result, Exception) else result
+              for name, result in text_results.items()
+          })))
+    return items
+
+
+def _Unsure(merged_entities: nlp_client_types.MergedNlpEntities) -> bool:
+  ''' Whether a result does not settle the sentiment of its text. '''
+  return not merged_entities.common_entities or any(
+      entity.overall_sentiment == nlp_client_types.Sentiment.Unsure
+      for entity in merged_entities.common_entities)
+
+
+class EscalatingNlpClient:
+  ''' Analyzes texts with a free local client first, escalating to the cloud client when unsure.
+
+    A local result is unsure when it has no entity or an entity of Unsure
+    sentiment. Before escalating, admit(texts) is asked whether the escalated
+    texts fit the budget, e.g. charging them to the cost ledger; texts it
+    rejects, or the cloud client fails on, keep their local result.
+  '''
+  # Only escalated texts are paid for, and admit charges them.
+  billable = False
+
+  def __init__(self,
+               local_client: NlpClient,
+               cloud_client: 'NlpClient | IncrementalNlpClient',
+               admit: Callable[[list[str]], bool] | None = None):
+    self.local_client = local_client
+    self.cloud_client = cloud_client
+    self.admit = admit or (lambda texts: True)
+
+  def WarmUp(self, connections: int, timeout_seconds: float) -> dict[str, bool]:
+    return {
+        **self.local_client.WarmUp(connections, timeout_seconds),
+        **self.cloud_client.WarmUp(connections, timeout_seconds)
+    }
+
+  def AnalyzeSentiment(self, text: str) -> nlp_client_types.MergedNlpEntities:
+    merged_entities = self.local_client.AnalyzeSentiment(text)
+    if not _Unsure(merged_entities):
+      return merged_entities
+    if not self.admit(self.cloud_client.BilledTexts([text])):
+      _ESCALATIONS.Inc('rejected')
+      return merged_entities
+    _ESCALATIONS.Inc('escalated')
+    try:
+      return self.cloud_client.AnalyzeSentiment(text)
+    except ProviderError as e:
+      logging.warning('Escalation failed, keeping the local result: %s', e)
+      return merged_entities
+
+  def AnalyzeSentimentBatch(
+      self, texts: list[str]) -> list[nlp_client_types.BatchItemResult]:
+    items = self.local_client.AnalyzeSentimentBatch(texts)
+    unsure = [
+        index for index, item in enumerate(items)
+        if item.result is None or _Unsure(item.result)
+    ]
+    if not unsure:
+      return items
+    if not self.admit(
+        self.cloud_client.BilledTexts([texts[index] for index in unsure])):
+      _ESCALATIONS.Inc('rejected', amount=len(unsure))
+      return items
+    _ESCALATIONS.Inc('escalated', amount=len(unsure))
+    cloud_items = self.cloud_client.AnalyzeSentimentBatch(
+        [texts[index] for index in unsure])
+    for index, cloud_item in zip(unsure, cloud_items):
+      if cloud_item.result is not None:
+        items[index] = cloud_item
+    return items
+
+
+class IncrementalNlpClient:
+  ''' Analyzes texts sentence by sentence, only sending providers the sentences they have not analyzed yet.
+
+    Each provider's raw response to each sentence is cached by the hash of the
+    whitespace-normalized sentence, so a resubmitted text with a small edit
+    only pays for its changed sentences. Fresh sentences of all texts are
+    analyzed together, packed into few requests when the client has
+    pack_max_bytes. Each text's cached and fresh responses are then combined
+    and go through the normalizers and MergeEntities as a single document.
+    Entities whose mentions span sentences, e.g. a pronoun referring to an
+    earlier sentence, are not grouped by providers then.
+  '''
+
+  def __init__(self, client: NlpClient,
+               sentence_cache: result_cache.LruTtlCache):
+    self.client = client
+    self.sentence_cache = sentence_cache
+
+  @property
+  def billable(self) -> bool:
+    return self.client.billable
+
+  def WarmUp(self, connections: int, timeout_seconds: float) -> dict[str, bool]:
+    return self.client.WarmUp(connections, timeout_seconds)
+
+  def _Sentences(self, provider: providers.Provider, text: str) -> list[str]:
+    return [
+        piece for sentence in segmenter.SplitSentences(text)
+        if not sentence.isspace()
+        for piece in self.client.Chunk(provider, sentence)
+    ]
+
+  @staticmethod
+  def _Key(provider: providers.Provider, sentence: str) -> str:
+    return f'{provider.name}:{result_cache.CacheKey(sentence)}'
+
+  def BilledTexts(self, texts: list[str]) -> list[str]:
+    ''' Returns the texts billable providers would bill for, i.e. the sentences of texts they have not analyzed yet. '''
+    missing = {}
+    for text in texts:
+      for provider in self.client.providers:
+        if not provider.billable:
+          continue
+        for sentence in self._Sentences(provider, text):
+          if self.sentence_cache.Get(self._Key(provider, sentence)) is None:
+            missing.setdefault(result_cache.CacheKey(sentence), sentence)
+    return self.client.BilledTexts(list(missing.values()))
+
+  def AnalyzeSentiment(self, text: str) -> nlp_client_types.MergedNlpEntities:
+    ''' Same as NlpClient.AnalyzeSentiment, reusing the responses to unchanged sentences.
+
+      Each provider gets its own timeout, and the result is partial without
+      the providers which failed or timed out.
+    '''
+    start = time.monotonic()
+    item, = self._Analyze([text], [
+        start + provider.timeout_seconds for provider in self.client.providers
+    ])
+    if item.result is None:
+      raise ProviderError(item.error)
+    return item.result
+
+  def AnalyzeSentimentBatch(
+      self, texts: list[str]) -> list[nlp_client_types.BatchItemResult]:
+    return self._Analyze(texts)
+
+  def _Analyze(
+      self,
+      texts: list[str],
+      deadlines: list[float] | None = None
+  ) -> list[nlp_client_types.BatchItemResult]:
+    provider_text_sentences = [[
+        self._Sentences(provider, text) for text in texts
+    ] for provider in self.client.providers]
+    # Per provider: key -> cached response of each sentence, and the missing
+    # sentences by key.
+    provider_responses = []
+    provider_missing = []
+    for provider, text_sentences in zip(self.client.providers,
+                                        provider_text_sentences):
+      responses = {}
+      missing = {}
+      for sentences in text_sentences:
+        for sentence in sentences:
+          key = self._Key(provider, sentence)
+          if key in responses or key in missing:
+            continue
+          response = self.sentence_cache.Get(key)
+          if response is None:
+            missing[key] = sentence
+          else:
+            responses[key] = response
+      _SENTENCE_LOOKUPS.Inc(provider.name, 'cached', amount=len(responses))
+      _SENTENCE_LOOKUPS.Inc(provider.name, 'analyzed', amount=len(missing))
+      provider_responses.append(responses)
+      provider_missing.append(missing)
+
+    provider_results = self.client.AnalyzeDocuments(
+        [list(missing.values()) for missing in provider_missing], deadlines)
+    for responses, missing, results in zip(provider_responses, provider_missing,
+                                           provider_results):
+      for key, result in zip(missing, results):
+        responses[key] = result
+        if not isinstance(result, Exception):
+          self.sentence_cache.Put(key, result)
+
+    return self.client.MergeDocuments([
+        _CombineChunks(provider.Combine, text_sentences, [
+            responses[self._Key(provider, sentence)]
+            for sentences in text_sentences
+            for sentence in sentences
+        ])
+        for provider, text_sentences, responses in zip(
+            self.client.providers, provider_text_sentences, provider_responses)
+    ])
+
+
+def _NewCloudClient(config) -> NlpClient | IncrementalNlpClient:
+  client = NlpClient.NewNlpClient(config)
+  if not config.incremental:
+    return client
+  return IncrementalNlpClient(
+      client,
+      result_cache.LruTtlCache(config.incremental_cache_size,
+                               config.cache_ttl_seconds))
+
+
+def NewClient(
+    config,
+    admit: Callable[[list[str]], bool] | None = None
+) -> NlpClient | IncrementalNlpClient | EscalatingNlpClient:
+  ''' Returns the client of config.mode, see service.ServiceConfig.
+
+    cloud: the providers of config.providers.
+    local: the local lexicon provider only, free and without network calls.
+    local_first: the local provider, escalating to the providers of
+      config.providers when unsure, see EscalatingNlpClient.
+    With config.incremental, the providers analyze texts sentence by sentence,
+    see IncrementalNlpClient.
+  '''
+  if config.mode == CLOUD:
+    return _NewCloudClient(config)
+  local_client = NlpClient([local_lexicon.LexiconProvider.FromConfig(config)],
+                           min_polar_score=config.local_min_polar_score)
+  if config.mode == LOCAL:
+    return local_client
+  if config.mode == LOCAL_FIRST:
+    return EscalatingNlpClient(local_client, _NewCloudClient(config), admit)
+  raise ValueError(
+      f'Unknown mode {config.mode}, expected {CLOUD}, {LOCAL} or {LOCAL_FIRST}.'
+  )
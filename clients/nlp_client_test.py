@@ -1,189 +1,662 @@
 import unittest
-from clients import nlp_client
+import time
+from botocore import exceptions as botocore_exceptions
+from cache import result_cache
+from clients import aws_comprehend, gcp_language, local_lexicon, nlp_client, providers, resilience
 from google.cloud import language_v1
-from datatypes import aws_types, gcp_types, nlp_client_types
+from datatypes import nlp_client_types
+from segmentation import packer
 
 
 class MergeEntitiesTest(unittest.TestCase):
 
   def test_merge_empty_entity_lists_returns_empty(self):
     self.assertEqual(
-        nlp_client.MergeEntities([], []),
-        nlp_client_types.MergedNlpEntities(entities=[], common_entities=[]))
+        nlp_client.MergeEntities({
+            'aws': [],
+            'gcp': []
+        }), nlp_client_types.MergedNlpEntities(entities=[], common_entities=[]))
 
   def test_merge_entities_with_same_text(self):
-    merged_entities = nlp_client.MergeEntities([
-        nlp_client_types.Entity(text="text_1",
-                                aws_score=0.1,
-                                gcp_score=None,
-                                overall_sentiment=None),
-        nlp_client_types.Entity(text="text_2",
-                                aws_score=0.2,
-                                gcp_score=None,
-                                overall_sentiment=None)
-    ], [
-        nlp_client_types.Entity(text="text_1",
-                                aws_score=None,
-                                gcp_score=0.3,
-                                overall_sentiment=None),
-        nlp_client_types.Entity(text="text_3",
-                                aws_score=None,
-                                gcp_score=0.4,
-                                overall_sentiment=None)
-    ])
+    merged_entities = nlp_client.MergeEntities({
+        'aws': [
+            nlp_client_types.Entity(text="text_1", scores={'aws': 0.1}),
+            nlp_client_types.Entity(text="text_2", scores={'aws': 0.2})
+        ],
+        'gcp': [
+            nlp_client_types.Entity(text="text_1", scores={'gcp': 0.3}),
+            nlp_client_types.Entity(text="text_3", scores={'gcp': 0.4})
+        ]
+    })
     self.assertEqual(
         merged_entities,
         nlp_client_types.MergedNlpEntities(
             common_entities=[
                 nlp_client_types.Entity(text="text_1",
-                                        aws_score=0.1,
-                                        gcp_score=0.3,
-                                        overall_sentiment=None)
+                                        scores={
+                                            'aws': 0.1,
+                                            'gcp': 0.3
+                                        })
             ],
             entities=[
                 nlp_client_types.Entity(text="text_1",
-                                        aws_score=0.1,
-                                        gcp_score=0.3,
-                                        overall_sentiment=None),
-                nlp_client_types.Entity(text="text_2",
-                                        aws_score=0.2,
-                                        gcp_score=None,
-                                        overall_sentiment=None),
-                nlp_client_types.Entity(text="text_3",
-                                        aws_score=None,
-                                        gcp_score=0.4,
-                                        overall_sentiment=None)
+                                        scores={
+                                            'aws': 0.1,
+                                            'gcp': 0.3
+                                        }),
+                nlp_client_types.Entity(text="text_2", scores={'aws': 0.2}),
+                nlp_client_types.Entity(text="text_3", scores={'gcp': 0.4})
             ]))
 
+  def test_merge_entities_of_three_providers(self):
+    merged_entities = nlp_client.MergeEntities({
+        'aws': [nlp_client_types.Entity(text="text_1", scores={'aws': 0.1})],
+        'gcp': [nlp_client_types.Entity(text="text_1", scores={'gcp': 0.2})],
+        'local': [
+            nlp_client_types.Entity(text="text_1", scores={'local': 0.3}),
+            nlp_client_types.Entity(text="text_2", scores={'local': 0.4})
+        ]
+    })
 
-class ParseApiResultTest(unittest.TestCase):
-
-  def test_convert_aws_comprehend_response_expectedly(self):
-    response = nlp_client.convert_aws_response({
-        "Entities": [{
-            "DescriptiveMentionIndex": [0],
-            "Mentions": [{
-                "Score": 0.9999949932098389,
-                "GroupScore": 1,
-                "Text": "I",
-                "Type": "PERSON",
-                "MentionSentiment": {
-                    "Sentiment": "NEUTRAL",
-                    "SentimentScore": {
-                        "Positive": 0,
-                        "Negative": 0,
-                        "Neutral": 1,
-                        "Mixed": 0
-                    }
-                },
-                "BeginOffset": 0,
-                "EndOffset": 1
-            }]
-        }, {
-            "DescriptiveMentionIndex": [0, 1],
-            "Mentions": [{
-                "Score": 0.9999819993972778,
-                "GroupScore": 0.999563992023468,
-                "Text": "coffee",
-                "Type": "OTHER",
-                "MentionSentiment": {
-                    "Sentiment": "NEGATIVE",
-                    "SentimentScore": {
-                        "Positive": 0.000003999999989900971,
-                        "Negative": 0.9992110133171082,
-                        "Neutral": 0.0007830000249668956,
-                        "Mixed": 0.0000019999999949504854
-                    }
-                },
-                "BeginOffset": 103,
-                "EndOffset": 109
-            }, {
-                "Score": 0.9999650120735168,
-                "GroupScore": 1,
-                "Text": "coffee",
-                "Type": "OTHER",
-                "MentionSentiment": {
-                    "Sentiment": "POSITIVE",
-                    "SentimentScore": {
-                        "Positive": 0.9999989867210388,
-                        "Negative": 0,
-                        "Neutral": 0,
-                        "Mixed": 0
-                    }
-                },
-                "BeginOffset": 17,
-                "EndOffset": 23
-            }]
-        }]
+    self.assertEqual(
+        [entity.text for entity in merged_entities.common_entities], ['text_1'])
+    self.assertEqual(merged_entities.common_entities[0].scores, {
+        'aws': 0.1,
+        'gcp': 0.2,
+        'local': 0.3
     })
 
-    expected_entities = [
-        aws_types.AwsEntity(text='I',
-                            mentions=[
-                                aws_types.Mention(
-                                    text='I',
-                                    score=0.9999949932098389,
-                                    group_score=1,
-                                    sentiments=aws_types.SentimentScore(
-                                        positive=0,
-                                        negative=0,
-                                    )),
-                            ]),
-        aws_types.AwsEntity(
-            text='coffee',
-            mentions=[
-                aws_types.Mention(text='coffee',
-                                  score=0.9999819993972778,
-                                  group_score=0.999563992023468,
-                                  sentiments=aws_types.SentimentScore(
-                                      positive=0.000003999999989900971,
-                                      negative=0.9992110133171082,
-                                  )),
-                aws_types.Mention(text='coffee',
-                                  score=0.9999650120735168,
-                                  group_score=1,
-                                  sentiments=aws_types.SentimentScore(
-                                      positive=0.9999989867210388,
-                                      negative=0,
-                                  )),
-            ]),
-    ]
-    self.assertEqual(response, expected_entities)
-
-  def test_convert_gcp_nlp_api_response_expectedly(self):
-    response = language_v1.AnalyzeEntitySentimentResponse.from_json('''
-        {
-            "entities": [
-            {
-                "name": "coffee",
-                "salience": 1,
-                "mentions": [
-                {
-                    "text": {
-                    "content": "coffee",
-                    "begin_offset": 7
-                    },
-                    "sentiment": {
-                    "magnitude": 1,
-                    "score": 0
-                    }
-                }
-                ],
-                "sentiment": {
-                "magnitude": 1,
-                "score": 0
-                }
+  def test_merge_entities_with_canonical_text(self):
+    merged_entities = nlp_client.MergeEntities({
+        'aws': [
+            nlp_client_types.Entity(text='Comprehend APIs', scores={'aws': 0.1})
+        ],
+        'gcp': [
+            nlp_client_types.Entity(text='comprehend API', scores={'gcp': 0.2})
+        ]
+    })
+
+    self.assertEqual(merged_entities.common_entities, [
+        nlp_client_types.Entity(text='Comprehend APIs',
+                                scores={
+                                    'aws': 0.1,
+                                    'gcp': 0.2
+                                })
+    ])
+
+  def test_failed_provider_leaves_no_common_entity(self):
+    merged_entities = nlp_client.MergeEntities({
+        'aws': [nlp_client_types.Entity(text="text_1", scores={'aws': 0.1})],
+        'gcp': None
+    })
+
+    self.assertEqual(merged_entities.common_entities, [])
+    self.assertEqual(len(merged_entities.entities), 1)
+
+
+class ComputeSentimentTest(unittest.TestCase):
+
+  def test_weak_scores_are_unsure_below_min_polar_score(self):
+    entity = nlp_client_types.Entity(text='coffee', scores={'local': 0.2})
+
+    self.assertEqual(nlp_client.ComputeSentimentInMergedEntity(entity),
+                     nlp_client_types.Sentiment.Positive)
+    self.assertEqual(
+        nlp_client.ComputeSentimentInMergedEntity(entity, min_polar_score=0.3),
+        nlp_client_types.Sentiment.Unsure)
+
+
+def _Paragraphs(text):
+  ''' Returns (paragraph, character offset) of the paragraphs of text, e.g. of packed documents. '''
+  paragraphs = []
+  offset = 0
+  for paragraph in text.split(packer.SEPARATOR):
+    paragraphs.append((paragraph, offset))
+    offset += len(paragraph) + len(packer.SEPARATOR)
+  return paragraphs
+
+
+def _AwsEntities(text):
+  return [{
+      'DescriptiveMentionIndex': [0],
+      'Mentions': [{
+          'Score': 1,
+          'GroupScore': 1,
+          'Text': paragraph,
+          'MentionSentiment': {
+              'SentimentScore': {
+                  'Positive': 0.9,
+                  'Negative': 0.1
+              }
+          },
+          'BeginOffset': offset,
+          'EndOffset': offset + len(paragraph)
+      }]
+  } for paragraph, offset in _Paragraphs(text)]
+
+
+def _NewClient(aws_comprehend_client,
+               gcp_nlp_client,
+               aws_guard=None,
+               gcp_timeout_seconds=providers.DEFAULT_TIMEOUT_SECONDS,
+               **kwargs):
+  return nlp_client.NlpClient([
+      aws_comprehend.AwsComprehendProvider(aws_comprehend_client,
+                                           guard=aws_guard),
+      gcp_language.GcpLanguageProvider(gcp_nlp_client,
+                                       timeout_seconds=gcp_timeout_seconds)
+  ], **kwargs)
+
+
+class _FakeComprehendClient:
+  ''' Reports each paragraph of the text as a positive entity. '''
+
+  def __init__(self, delay_seconds=0, error=None, failing_texts=()):
+    self.delay_seconds = delay_seconds
+    self.error = error
+    self.failing_texts = failing_texts
+    self.texts = []
+    self.batch_sizes = []
+
+  def detect_targeted_sentiment(self, Text, LanguageCode):
+    self.texts.append(Text)
+    time.sleep(self.delay_seconds)
+    if self.error:
+      raise self.error
+    return {'Entities': _AwsEntities(Text)}
+
+  def batch_detect_targeted_sentiment(self, TextList, LanguageCode):
+    self.batch_sizes.append(len(TextList))
+    if self.error:
+      raise self.error
+    return {
+        'ResultList': [{
+            'Index': index,
+            'Entities': _AwsEntities(text)
+        }
+                       for index, text in enumerate(TextList)
+                       if text not in self.failing_texts],
+        'ErrorList': [{
+            'Index': index,
+            'ErrorCode': 'INTERNAL_SERVER_ERROR',
+            'ErrorMessage': 'failed'
+        } for index, text in enumerate(TextList) if text in self.failing_texts],
+    }
+
+
+class _MentionCountingComprehendClient:
+  ''' Reports each "good" as a positive and each "bad" as a negative mention of "coffee". '''
+
+  def detect_targeted_sentiment(self, Text, LanguageCode):
+    mentions = [{
+        'Score': 1,
+        'GroupScore': 1,
+        'Text': 'coffee',
+        'MentionSentiment': {
+            'SentimentScore': {
+                'Positive': float(word == 'good'),
+                'Negative': float(word == 'bad')
             }
-            ],
-            "language": "en"
         }
-        ''')
-
-    self.assertAlmostEqual(nlp_client.convert_gcp_response(response), [
-        gcp_types.GcpEntity(name='coffee',
-                            salience=1,
-                            sentiment=gcp_types.Sentiment(
-                                score=0,
-                                magnitude=1,
-                            )),
+    } for word in Text.replace('.', ' ').split()]
+    return {
+        'Entities': [{
+            'DescriptiveMentionIndex': [0],
+            'Mentions': mentions
+        }]
+    }
+
+
+class _FakeLanguageServiceClient:
+  ''' Reports each paragraph of the text as a positive entity. '''
+
+  def __init__(self, delay_seconds=0, error=None, failing_texts=()):
+    self.delay_seconds = delay_seconds
+    self.error = error
+    self.failing_texts = failing_texts
+    self.texts = []
+
+  def analyze_entity_sentiment(self, request):
+    time.sleep(self.delay_seconds)
+    text = request['document']['content']
+    self.texts.append(text)
+    if self.error or text in self.failing_texts:
+      raise self.error or RuntimeError('failed')
+    sentiment = language_v1.Sentiment(magnitude=1, score=0.8)
+    return language_v1.AnalyzeEntitySentimentResponse(entities=[
+        language_v1.Entity(
+            name=paragraph,
+            salience=1,
+            mentions=[
+                language_v1.EntityMention(text=language_v1.TextSpan(
+                    content=paragraph,
+                    begin_offset=len(text[:offset].encode('utf-8'))),
+                                          sentiment=sentiment)
+            ],
+            sentiment=sentiment) for paragraph, offset in _Paragraphs(text)
     ])
+
+
+class AnalyzeSentimentTest(unittest.TestCase):
+
+  def test_analyze_sentiment_merges_both_providers(self):
+    client = _NewClient(aws_comprehend_client=_FakeComprehendClient(),
+                        gcp_nlp_client=_FakeLanguageServiceClient())
+
+    merged_entities = client.AnalyzeSentiment('I like coffee.')
+
+    self.assertFalse(merged_entities.partial)
+    self.assertEqual(len(merged_entities.common_entities), 1)
+    self.assertEqual(merged_entities.common_entities[0].overall_sentiment,
+                     nlp_client_types.Sentiment.Positive)
+
+  def test_analyze_sentiment_calls_providers_concurrently(self):
+    client = _NewClient(
+        aws_comprehend_client=_FakeComprehendClient(delay_seconds=0.2),
+        gcp_nlp_client=_FakeLanguageServiceClient(delay_seconds=0.2))
+
+    start = time.monotonic()
+    client.AnalyzeSentiment('I like coffee.')
+
+    self.assertLess(time.monotonic() - start, 0.35)
+
+  def test_analyze_sentiment_returns_partial_result_when_provider_fails(self):
+    client = _NewClient(aws_comprehend_client=_FakeComprehendClient(
+        error=RuntimeError('throttled')),
+                        gcp_nlp_client=_FakeLanguageServiceClient())
+
+    merged_entities = client.AnalyzeSentiment('I like coffee.')
+
+    self.assertTrue(merged_entities.partial)
+    self.assertEqual(merged_entities.common_entities, [])
+    self.assertEqual(len(merged_entities.entities), 1)
+    self.assertNotIn('aws', merged_entities.entities[0].scores)
+
+  def test_analyze_sentiment_returns_partial_result_when_provider_times_out(
+      self):
+    client = _NewClient(
+        aws_comprehend_client=_FakeComprehendClient(),
+        gcp_nlp_client=_FakeLanguageServiceClient(delay_seconds=0.5),
+        gcp_timeout_seconds=0.1)
+
+    merged_entities = client.AnalyzeSentiment('I like coffee.')
+
+    self.assertEqual(merged_entities.common_entities, [])
+    self.assertNotIn('gcp', merged_entities.entities[0].scores)
+
+  def test_analyze_sentiment_splits_long_text_on_sentences(self):
+    aws_client = _FakeComprehendClient(delay_seconds=0.2)
+    client = _NewClient(
+        aws_comprehend_client=aws_client,
+        gcp_nlp_client=_FakeLanguageServiceClient(delay_seconds=0.2),
+        max_chunk_bytes=20)
+
+    start = time.monotonic()
+    merged_entities = client.AnalyzeSentiment('I like coffee. I like tea.')
+
+    self.assertLess(time.monotonic() - start, 0.35)
+    self.assertEqual(sorted(aws_client.texts),
+                     ['I like coffee. ', 'I like tea.'])
+    self.assertEqual(
+        [entity.text for entity in merged_entities.common_entities],
+        ['I like coffee. ', 'I like tea.'])
+
+  def test_analyze_sentiment_chunks_text_by_provider_document_limit(self):
+    aws_client = _FakeComprehendClient()
+    gcp_client = _FakeLanguageServiceClient()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=gcp_client)
+    text = 'I like coffee. ' * 500
+
+    client.AnalyzeSentiment(text)
+
+    self.assertEqual(len(aws_client.texts), 2)
+    self.assertEqual(gcp_client.texts, [text])
+
+  def test_analyze_sentiment_bounds_calls_in_flight(self):
+    client = _NewClient(
+        aws_comprehend_client=_FakeComprehendClient(delay_seconds=0.1),
+        gcp_nlp_client=_FakeLanguageServiceClient(delay_seconds=0.1),
+        max_chunk_bytes=20,
+        batch_concurrency=2)
+
+    start = time.monotonic()
+    client.AnalyzeSentiment('I like coffee. I like tea.')
+
+    self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+  def test_analyze_sentiment_weighs_mentions_of_all_chunks_equally(self):
+    client = _NewClient(
+        aws_comprehend_client=_MentionCountingComprehendClient(),
+        gcp_nlp_client=_FakeLanguageServiceClient(),
+        max_chunk_bytes=12)
+
+    merged_entities = client.AnalyzeSentiment('good good. bad.')
+
+    coffee = next(entity for entity in merged_entities.entities
+                  if entity.text == 'coffee')
+    self.assertAlmostEqual(coffee.scores['aws'], 1 / 3)
+
+  def test_analyze_sentiment_retries_throttled_calls(self):
+    aws_client = _FakeComprehendClient(error=botocore_exceptions.ClientError(
+        {'Error': {
+            'Code': 'ThrottlingException'
+        }}, 'DetectTargetedSentiment'))
+    client = _NewClient(
+        aws_comprehend_client=aws_client,
+        gcp_nlp_client=_FakeLanguageServiceClient(),
+        aws_guard=resilience.ProviderGuard(
+            'aws',
+            aws_comprehend.ClassifyAwsError,
+            retry_policy=resilience.RetryPolicy(base_delay_seconds=0)))
+
+    merged_entities = client.AnalyzeSentiment('I like coffee.')
+
+    self.assertTrue(merged_entities.partial)
+    self.assertEqual(len(aws_client.texts), 3)
+
+  def test_analyze_sentiment_skips_provider_with_open_circuit(self):
+    aws_client = _FakeComprehendClient()
+    breaker = resilience.CircuitBreaker(failure_threshold=1)
+    breaker.RecordFailure()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=_FakeLanguageServiceClient(),
+                        aws_guard=resilience.ProviderGuard(
+                            'aws',
+                            aws_comprehend.ClassifyAwsError,
+                            breaker=breaker))
+
+    merged_entities = client.AnalyzeSentiment('I like coffee.')
+
+    self.assertTrue(merged_entities.partial)
+    self.assertEqual(merged_entities.common_entities, [])
+    self.assertEqual(len(merged_entities.entities), 1)
+    self.assertEqual(aws_client.texts, [])
+
+  def test_analyze_sentiment_raises_when_all_providers_fail(self):
+    client = _NewClient(
+        aws_comprehend_client=_FakeComprehendClient(error=RuntimeError()),
+        gcp_nlp_client=_FakeLanguageServiceClient(error=RuntimeError()))
+
+    with self.assertRaises(nlp_client.ProviderError):
+      client.AnalyzeSentiment('I like coffee.')
+
+
+class AnalyzeSentimentBatchTest(unittest.TestCase):
+
+  def test_batch_results_are_in_input_order(self):
+    client = _NewClient(aws_comprehend_client=_FakeComprehendClient(),
+                        gcp_nlp_client=_FakeLanguageServiceClient())
+    texts = [f'text_{i}' for i in range(30)]
+
+    items = client.AnalyzeSentimentBatch(texts)
+
+    self.assertEqual([item.result.common_entities[0].text for item in items],
+                     texts)
+
+  def test_batch_chunks_aws_calls_by_25_documents(self):
+    aws_client = _FakeComprehendClient()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=_FakeLanguageServiceClient())
+
+    client.AnalyzeSentimentBatch([f'text_{i}' for i in range(30)])
+
+    self.assertEqual(sorted(aws_client.batch_sizes), [5, 25])
+
+  def test_batch_fails_documents_rate_limited_past_deadline(self):
+    aws_client = _FakeComprehendClient()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=_FakeLanguageServiceClient(),
+                        aws_guard=resilience.ProviderGuard(
+                            'aws',
+                            aws_comprehend.ClassifyAwsError,
+                            bucket=resilience.TokenBucket(max_rate=0.1,
+                                                          burst=1)),
+                        batch_timeout_seconds=0.2)
+
+    items = client.AnalyzeSentimentBatch([f'text_{i}' for i in range(30)])
+
+    self.assertEqual(len(aws_client.batch_sizes), 1)
+    self.assertEqual(sum(item.result.partial for item in items),
+                     30 - aws_client.batch_sizes[0])
+
+  def test_batch_combines_chunks_of_long_texts(self):
+    aws_client = _FakeComprehendClient()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=_FakeLanguageServiceClient(),
+                        max_chunk_bytes=20)
+
+    items = client.AnalyzeSentimentBatch(
+        ['I like coffee. I like tea.', 'text_1'])
+
+    self.assertEqual(aws_client.batch_sizes, [3])
+    self.assertEqual(
+        [entity.text for entity in items[0].result.common_entities],
+        ['I like coffee. ', 'I like tea.'])
+    self.assertEqual(items[1].result.common_entities[0].text, 'text_1')
+
+  def test_batch_item_failed_by_one_provider_is_partial(self):
+    client = _NewClient(
+        aws_comprehend_client=_FakeComprehendClient(failing_texts=['text_1']),
+        gcp_nlp_client=_FakeLanguageServiceClient())
+
+    items = client.AnalyzeSentimentBatch(['text_0', 'text_1'])
+
+    self.assertFalse(items[0].result.partial)
+    self.assertTrue(items[1].result.partial)
+    self.assertEqual(items[1].result.common_entities, [])
+
+  def test_batch_item_failed_by_all_providers_carries_error(self):
+    client = _NewClient(
+        aws_comprehend_client=_FakeComprehendClient(failing_texts=['text_1']),
+        gcp_nlp_client=_FakeLanguageServiceClient(failing_texts=['text_1']))
+
+    items = client.AnalyzeSentimentBatch(['text_0', 'text_1'])
+
+    self.assertIsNotNone(items[0].result)
+    self.assertIsNone(items[1].result)
+    self.assertIsNotNone(items[1].error)
+
+  def test_batch_packs_short_texts_into_few_requests(self):
+    aws_client = _FakeComprehendClient()
+    gcp_client = _FakeLanguageServiceClient()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=gcp_client,
+                        pack_max_bytes=50)
+    texts = [f'text_{i}' for i in range(10)]
+
+    items = client.AnalyzeSentimentBatch(texts)
+
+    self.assertEqual(aws_client.batch_sizes, [2])
+    self.assertEqual(len(gcp_client.texts), 2)
+    self.assertEqual([item.result.common_entities[0].text for item in items],
+                     texts)
+    self.assertEqual(sorted(client.BilledTexts(texts)),
+                     sorted(gcp_client.texts))
+
+  def test_failed_pack_fails_its_texts_only(self):
+    client = _NewClient(aws_comprehend_client=_FakeComprehendClient(),
+                        gcp_nlp_client=_FakeLanguageServiceClient(
+                            failing_texts=['text_0\n\ntext_1']),
+                        pack_max_bytes=14)
+
+    items = client.AnalyzeSentimentBatch(['text_0', 'text_1', 'text_2'])
+
+    self.assertTrue(items[0].result.partial)
+    self.assertTrue(items[1].result.partial)
+    self.assertFalse(items[2].result.partial)
+
+
+class _WarmableComprehendClient:
+
+  def __init__(self, error=None):
+    self.error = error
+    self.warm_up_calls = 0
+
+  def list_endpoints(self, MaxResults):
+    self.warm_up_calls += 1
+    if self.error:
+      raise self.error
+    return {'EndpointPropertiesList': []}
+
+
+class _WarmableLanguageServiceClient:
+
+  def __init__(self, delay_seconds=0):
+    self.delay_seconds = delay_seconds
+
+  def WarmUp(self, timeout_seconds):
+    time.sleep(self.delay_seconds)
+
+
+class IncrementalNlpClientTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.aws_client = _FakeComprehendClient()
+    self.gcp_client = _FakeLanguageServiceClient()
+    self.client = nlp_client.IncrementalNlpClient(
+        _NewClient(aws_comprehend_client=self.aws_client,
+                   gcp_nlp_client=self.gcp_client,
+                   pack_max_bytes=5000),
+        result_cache.LruTtlCache(max_entries=100, ttl_seconds=60))
+
+  def test_resubmitted_text_only_sends_changed_sentences(self):
+    self.client.AnalyzeSentiment('I like coffee. I like tea.')
+    self.gcp_client.texts = []
+
+    merged_entities = self.client.AnalyzeSentiment(
+        'I like coffee.  I love tea.')
+
+    self.assertEqual(self.gcp_client.texts, ['I love tea.'])
+    self.assertEqual(self.aws_client.batch_sizes, [1, 1])
+    self.assertEqual(
+        [entity.text for entity in merged_entities.common_entities],
+        ['I like coffee. ', 'I love tea.'])
+
+  def test_billed_texts_are_unanalyzed_sentences(self):
+    self.client.AnalyzeSentiment('I like coffee. I like tea.')
+
+    self.assertEqual(
+        self.client.BilledTexts(
+            ['I like coffee. I love tea.', 'I love tea. I like milk.']),
+        ['I love tea.\n\nI like milk.'])
+
+  def test_slow_provider_times_out_into_partial_result(self):
+    client = nlp_client.IncrementalNlpClient(
+        _NewClient(aws_comprehend_client=_FakeComprehendClient(),
+                   gcp_nlp_client=_FakeLanguageServiceClient(delay_seconds=0.5),
+                   gcp_timeout_seconds=0.1),
+        result_cache.LruTtlCache(max_entries=100, ttl_seconds=60))
+
+    merged_entities = client.AnalyzeSentiment('I like coffee.')
+
+    self.assertTrue(merged_entities.partial)
+    self.assertNotIn('gcp', merged_entities.entities[0].scores)
+
+  def test_failed_sentences_are_not_cached(self):
+    self.gcp_client.error = RuntimeError('unavailable')
+    merged_entities = self.client.AnalyzeSentiment('I like coffee.')
+    self.assertTrue(merged_entities.partial)
+    self.gcp_client.error = None
+    self.gcp_client.texts = []
+
+    merged_entities = self.client.AnalyzeSentiment('I like coffee.')
+
+    self.assertEqual(self.gcp_client.texts, ['I like coffee.'])
+    self.assertFalse(merged_entities.partial)
+
+
+class WarmUpTest(unittest.TestCase):
+
+  def test_warm_up_fills_aws_connection_pool(self):
+    aws_client = _WarmableComprehendClient()
+    client = _NewClient(aws_comprehend_client=aws_client,
+                        gcp_nlp_client=_WarmableLanguageServiceClient())
+
+    self.assertEqual(client.WarmUp(connections=4, timeout_seconds=1), {
+        'aws': True,
+        'gcp': True
+    })
+    self.assertEqual(aws_client.warm_up_calls, 4)
+
+  def test_aws_answering_with_an_error_is_warm(self):
+    client = _NewClient(aws_comprehend_client=_WarmableComprehendClient(
+        error=botocore_exceptions.ClientError(
+            {'Error': {
+                'Code': 'AccessDeniedException'
+            }}, 'ListEndpoints')),
+                        gcp_nlp_client=_WarmableLanguageServiceClient())
+
+    self.assertTrue(client.WarmUp(connections=1, timeout_seconds=1)['aws'])
+
+  def test_unreachable_or_slow_providers_are_not_warm(self):
+    client = _NewClient(
+        aws_comprehend_client=_WarmableComprehendClient(
+            error=botocore_exceptions.EndpointConnectionError(
+                endpoint_url='https://comprehend')),
+        gcp_nlp_client=_WarmableLanguageServiceClient(delay_seconds=0.5))
+
+    self.assertEqual(client.WarmUp(connections=1, timeout_seconds=0.1), {
+        'aws': False,
+        'gcp': False
+    })
+
+
+def _NewLocalClient():
+  return nlp_client.NlpClient([
+      local_lexicon.LexiconProvider(
+          local_lexicon.LexiconAnalyzer({
+              'great': 3,
+              'okay': 1
+          }))
+  ],
+                              min_polar_score=0.3)
+
+
+class EscalatingNlpClientTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.aws_client = _FakeComprehendClient()
+    self.admitted_texts = []
+    self.client = nlp_client.EscalatingNlpClient(
+        _NewLocalClient(),
+        _NewClient(aws_comprehend_client=self.aws_client,
+                   gcp_nlp_client=_FakeLanguageServiceClient()),
+        admit=lambda texts: self.admitted_texts.extend(texts) or True)
+
+  def test_confident_local_result_is_not_escalated(self):
+    merged_entities = self.client.AnalyzeSentiment('The coffee is great.')
+
+    self.assertEqual(merged_entities.common_entities[0].scores.keys(),
+                     {'local'})
+    self.assertEqual(self.aws_client.texts, [])
+    self.assertEqual(self.admitted_texts, [])
+
+  def test_unsure_local_result_is_escalated(self):
+    merged_entities = self.client.AnalyzeSentiment('The coffee is okay.')
+
+    self.assertEqual(merged_entities.common_entities[0].scores.keys(),
+                     {'aws', 'gcp'})
+    self.assertEqual(self.admitted_texts, ['The coffee is okay.'])
+
+  def test_rejected_escalation_keeps_local_result(self):
+    self.client.admit = lambda texts: False
+
+    merged_entities = self.client.AnalyzeSentiment('The coffee is okay.')
+
+    self.assertEqual(merged_entities.common_entities[0].overall_sentiment,
+                     nlp_client_types.Sentiment.Unsure)
+    self.assertEqual(self.aws_client.texts, [])
+
+  def test_batch_escalates_only_unsure_texts(self):
+    items = self.client.AnalyzeSentimentBatch(
+        ['The coffee is great.', 'The coffee is okay.'])
+
+    self.assertEqual(items[0].result.common_entities[0].scores.keys(),
+                     {'local'})
+    self.assertEqual(items[1].result.common_entities[0].scores.keys(),
+                     {'aws', 'gcp'})
+    self.assertEqual(self.admitted_texts, ['The coffee is okay.'])
+    self.assertFalse(self.client.billable)
@@ -0,0 +1,120 @@
+'''
+  Interface of sentiment providers and the registry NlpClient builds its providers from.
+  A provider module subclasses Provider and decorates it with @Register; enabling it is then only a matter of listing its name in ServiceConfig.providers.
+'''
+from clients import resilience
+from datatypes import nlp_client_types
+from monitoring import metrics
+import abc
+
+# Seconds to wait for each provider before giving up on its result.
+DEFAULT_TIMEOUT_SECONDS = 10
+
+REQUEST_SECONDS = metrics.Histogram('nlp_provider_request_seconds',
+                                    'Latency of calls to NLP providers.',
+                                    ('provider', 'method'))
+
+_registry: dict[str, type['Provider']] = {}
+
+
+class DocumentError(Exception):
+  ''' Stands in for the response of a document a provider failed to analyze. '''
+
+
+class Provider(abc.ABC):
+  ''' A sentiment backend, analyzing documents into normalized entities.
+
+    Subclasses set `name`, send a single document in Request and turn responses
+    into entities in NormalizeOne. Calls go through a resilience.ProviderGuard,
+    whose error classification subclasses provide in ClassifyError.
+  '''
+  name = ''
+  # Max number of documents sent to RequestBatch at once.
+  batch_size = 1
+  # Whether calls are paid for, i.e. charged to the cost ledger.
+  billable = True
+  # Whether batches may pack documents, in which case the provider defines
+  # SplitPacked(response, pack: packer.Pack) -> list, splitting the response
+  # to a pack into responses to each of its documents by mention offsets.
+  packable = False
+  # Max UTF-8 bytes of a document, longer texts are analyzed in chunks. None
+  # for no limit.
+  max_document_bytes: int | None = None
+
+  def __init__(self,
+               guard: resilience.ProviderGuard | None = None,
+               timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS):
+    # Not rate limited unless given a guard, see FromConfig of each provider.
+    self.guard = guard or resilience.ProviderGuard(self.name,
+                                                   self.ClassifyError)
+    self.timeout_seconds = timeout_seconds
+
+  @classmethod
+  @abc.abstractmethod
+  def FromConfig(cls, config) -> 'Provider':
+    ''' Returns the provider configured by a service.ServiceConfig. '''
+
+  @classmethod
+  def FromReplay(cls, config, transport) -> 'Provider':
+    ''' Returns the provider calling through a replay.Transport instead of the service.
+
+      Providers without network calls ignore the transport.
+    '''
+    return cls.FromConfig(config)
+
+  @staticmethod
+  def ClassifyError(error: Exception) -> str | None:
+    return None
+
+  @abc.abstractmethod
+  def Request(self, text: str):
+    ''' Returns the raw response of the service to a single document. '''
+
+  def RequestBatch(self, texts: list[str]) -> list:
+    ''' Returns raw responses, or DocumentError for failed documents, in input order. '''
+    return [self.Request(text) for text in texts]
+
+  @abc.abstractmethod
+  def Combine(self, responses: list):
+    ''' Returns a response holding the entities of all chunks of a document. '''
+
+  @abc.abstractmethod
+  def NormalizeOne(self, response) -> list[nlp_client_types.Entity]:
+    ''' Returns the normalized entities of a raw response. '''
+
+  def NormalizeMany(self, responses: list) -> list:
+    ''' Normalizes responses, with the raised exception in place of the entities of a failed one. '''
+    results = []
+    for response in responses:
+      try:
+        results.append(self.NormalizeOne(response))
+      except Exception as e:
+        results.append(e)
+    return results
+
+  def WarmUpCalls(self, connections: int, timeout_seconds: float) -> list:
+    ''' Returns zero-argument calls, run concurrently, opening connections ahead of the first request. '''
+    return []
+
+  def Call(self, text: str, deadline: float | None = None):
+    with REQUEST_SECONDS.Time(self.name, 'request'):
+      return self.guard.Call(lambda: self.Request(text), deadline)
+
+  def CallBatch(self, texts: list[str], deadline: float | None = None) -> list:
+    with REQUEST_SECONDS.Time(self.name, 'request_batch'):
+      return self.guard.Call(lambda: self.RequestBatch(texts), deadline)
+
+
+def Register(cls: type[Provider]) -> type[Provider]:
+  ''' Class decorator making a provider available under its name. '''
+  if cls.name in _registry:
+    raise ValueError(f'Provider {cls.name} is already registered.')
+  _registry[cls.name] = cls
+  return cls
+
+
+def Get(name: str) -> type[Provider]:
+  if name not in _registry:
+    raise ValueError(
+        f'Unknown provider {name}, registered: {", ".join(sorted(_registry))}.')
+  return _registry[name]
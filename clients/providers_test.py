@@ -0,0 +1,70 @@
+import unittest
+from clients import aws_comprehend, gcp_language, providers
+from datatypes import nlp_client_types
+
+
+class RegistryTest(unittest.TestCase):
+
+  def test_get_returns_registered_providers(self):
+    self.assertIs(providers.Get('aws'), aws_comprehend.AwsComprehendProvider)
+    self.assertIs(providers.Get('gcp'), gcp_language.GcpLanguageProvider)
+
+  def test_get_unknown_provider_raises(self):
+    with self.assertRaises(ValueError):
+      providers.Get('unknown')
+
+  def test_registering_a_name_twice_raises(self):
+    with self.assertRaises(ValueError):
+
+      @providers.Register
+      class _DuplicateProvider(providers.Provider):
+        name = 'aws'
+
+
+class _EchoProvider(providers.Provider):
+  name = 'echo'
+
+  @classmethod
+  def FromConfig(cls, config):
+    return cls()
+
+  def Request(self, text):
+    if text == 'bad':
+      raise RuntimeError('failed')
+    return text
+
+  def Combine(self, responses):
+    return ''.join(responses)
+
+  def NormalizeOne(self, response):
+    return [nlp_client_types.Entity(text=response.strip())]
+
+
+class ProviderTest(unittest.TestCase):
+
+  def test_provider_without_normalizer_cannot_be_created(self):
+
+    class _RawProvider(providers.Provider):
+      name = 'raw'
+
+      @classmethod
+      def FromConfig(cls, config):
+        return cls()
+
+      def Request(self, text):
+        return text
+
+      def Combine(self, responses):
+        return ''.join(responses)
+
+    with self.assertRaises(TypeError):
+      _RawProvider()
+
+  def test_request_batch_defaults_to_one_request_per_text(self):
+    self.assertEqual(_EchoProvider().CallBatch(['a', 'b']), ['a', 'b'])
+
+  def test_normalize_many_keeps_errors_in_place(self):
+    results = _EchoProvider().NormalizeMany(['a', None])
+
+    self.assertEqual(results[0], [nlp_client_types.Entity(text='a')])
+    self.assertIsInstance(results[1], AttributeError)
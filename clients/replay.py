@@ -0,0 +1,143 @@
+'''
+  Record/replay transport of provider calls, to load-test the server without paid APIs.
+  In record mode, provider clients call the service and save each raw response to disk, keyed by provider and the SHA-256 of the exact text sent. In replay mode, they answer from those files only, after a simulated latency and with injected transient errors, so a whole server can be driven at its throughput ceiling on one box. The clients themselves live with their provider, e.g. aws_comprehend.ReplayComprehendClient.
+'''
+from monitoring import metrics
+import hashlib
+import os
+import random
+import threading
+import time
+
+# Modes.
+LIVE = 'live'  # Calls the services, without recording.
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = (LIVE, RECORD, REPLAY)
+
+_RESPONSES = metrics.Counter(
+    'replay_responses_total',
+    'Provider responses of the record/replay transport, by outcome.',
+    ('provider', 'outcome'))
+
+
+class ReplayMiss(LookupError):
+  ''' No response was recorded for a text. '''
+
+
+class Transport:
+  ''' Records provider responses to directory, or replays them from it.
+
+    Responses are stored encoded, one file each at
+    <directory>/<provider>/<sha256 of the text>.json, and kept in memory once
+    read. Texts are hashed exactly as sent, so a replay needs the chunking and
+    packing configuration of its recording. Latency and errors are only
+    simulated in replay mode: recording sees those of the service.
+  '''
+
+  def __init__(self,
+               mode: str,
+               directory: str,
+               latency_seconds: float = 0,
+               jitter_seconds: float = 0,
+               error_rate: float = 0,
+               seed: int | None = None):
+    if mode not in (RECORD, REPLAY):
+      raise ValueError(f'Invalid transport {mode}, expected {RECORD} or '
+                       f'{REPLAY}.')
+    self.mode = mode
+    self.directory = directory
+    self.latency_seconds = latency_seconds
+    self.jitter_seconds = jitter_seconds
+    self.error_rate = error_rate
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._responses = {}  # (provider, text hash) -> encoded response.
+
+  @property
+  def recording(self) -> bool:
+    return self.mode == RECORD
+
+  @staticmethod
+  def Key(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+  def _Path(self, provider: str, key: str) -> str:
+    return os.path.join(self.directory, provider, f'{key}.json')
+
+  def Load(self, provider: str, text: str) -> str | None:
+    ''' Returns the encoded response recorded for text, or None. '''
+    key = self.Key(text)
+    with self._lock:
+      encoded = self._responses.get((provider, key))
+    if encoded is None:
+      try:
+        with open(self._Path(provider, key), 'r', encoding='utf-8') as file:
+          encoded = file.read()
+      except FileNotFoundError:
+        _RESPONSES.Inc(provider, 'miss')
+        return None
+      with self._lock:
+        self._responses[(provider, key)] = encoded
+    _RESPONSES.Inc(provider, 'hit')
+    return encoded
+
+  def Save(self, provider: str, text: str, encoded: str):
+    ''' Records the encoded response to text, replacing any previous one. '''
+    key = self.Key(text)
+    path = self._Path(provider, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+      file.write(encoded)
+    os.replace(tmp_path, path)
+    with self._lock:
+      self._responses[(provider, key)] = encoded
+    _RESPONSES.Inc(provider, 'recorded')
+
+  def Simulate(self, provider: str, error):
+    ''' Sleeps for the simulated latency of a call, then raises error() at the error rate. '''
+    if self.mode != REPLAY:
+      return
+    with self._lock:
+      delay = self.latency_seconds + self._random.uniform(
+          0, self.jitter_seconds)
+      failed = self._random.random() < self.error_rate
+    if delay:
+      time.sleep(delay)
+    if failed:
+      _RESPONSES.Inc(provider, 'injected_error')
+      raise error()
+
+  def Call(self, provider: str, text: str, call, encode, decode, error):
+    ''' Returns the response to text: replayed, or from call() and recorded.
+
+      encode and decode convert responses to and from strings, and error
+      returns the exception injected into replayed calls.
+    '''
+    if self.mode == RECORD:
+      response = call()
+      self.Save(provider, text, encode(response))
+      return response
+    self.Simulate(provider, error)
+    encoded = self.Load(provider, text)
+    if encoded is None:
+      raise ReplayMiss(f'No {provider} response recorded for text '
+                       f'{self.Key(text)}.')
+    return decode(encoded)
+
+
+def NewTransport(config) -> Transport | None:
+  ''' Returns the transport of config.transport, or None to call the services, see service.ServiceConfig. '''
+  if config.transport == LIVE:
+    return None
+  if config.transport not in MODES:
+    raise ValueError(f'Invalid transport {config.transport}, expected one of '
+                     f'{", ".join(MODES)}.')
+  if not config.replay_dir:
+    raise ValueError(f'The {config.transport} transport needs a replay_dir.')
+  return Transport(config.transport,
+                   config.replay_dir,
+                   latency_seconds=config.replay_latency_seconds,
+                   jitter_seconds=config.replay_jitter_seconds,
+                   error_rate=config.replay_error_rate)
@@ -0,0 +1,90 @@
+import json
+import tempfile
+import types
+import unittest
+
+from clients import replay
+
+
+class _Error(Exception):
+  pass
+
+
+class TransportTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+  def _Call(self, transport, text, response=None):
+    return transport.Call('aws',
+                          text,
+                          lambda: response,
+                          encode=json.dumps,
+                          decode=json.loads,
+                          error=_Error)
+
+  def test_replays_recorded_responses_by_text(self):
+    recorder = replay.Transport(replay.RECORD, self.directory.name)
+    self.assertEqual(self._Call(recorder, 'a', {'Entities': [1]}),
+                     {'Entities': [1]})
+    self._Call(recorder, 'b', {'Entities': [2]})
+
+    player = replay.Transport(replay.REPLAY, self.directory.name)
+
+    self.assertEqual(self._Call(player, 'b'), {'Entities': [2]})
+    self.assertEqual(self._Call(player, 'a'), {'Entities': [1]})
+    self.assertIsNone(player.Load('gcp', 'a'))
+    with self.assertRaises(replay.ReplayMiss):
+      self._Call(player, 'c')
+
+  def test_injects_errors_at_error_rate(self):
+    recorder = replay.Transport(replay.RECORD, self.directory.name)
+    self._Call(recorder, 'a', {})
+    player = replay.Transport(replay.REPLAY,
+                              self.directory.name,
+                              error_rate=0.5,
+                              seed=1)
+
+    errors = 0
+    for _ in range(200):
+      try:
+        self._Call(player, 'a')
+      except _Error:
+        errors += 1
+
+    self.assertGreater(errors, 60)
+    self.assertLess(errors, 140)
+
+  def test_recording_injects_no_error(self):
+    recorder = replay.Transport(replay.RECORD,
+                                self.directory.name,
+                                error_rate=1)
+    self.assertEqual(self._Call(recorder, 'a', {}), {})
+
+
+class NewTransportTest(unittest.TestCase):
+
+  def _Config(self, **kwargs):
+    return types.SimpleNamespace(
+        **{
+            'transport': replay.LIVE,
+            'replay_dir': '',
+            'replay_latency_seconds': 0,
+            'replay_jitter_seconds': 0,
+            'replay_error_rate': 0,
+            **kwargs
+        })
+
+  def test_live_has_no_transport(self):
+    self.assertIsNone(replay.NewTransport(self._Config()))
+
+  def test_replay_needs_a_directory(self):
+    with self.assertRaises(ValueError):
+      replay.NewTransport(self._Config(transport=replay.REPLAY))
+    transport = replay.NewTransport(
+        self._Config(transport=replay.REPLAY,
+                     replay_dir='/tmp/replay',
+                     replay_latency_seconds=0.01))
+    self.assertEqual(transport.mode, replay.REPLAY)
+    self.assertEqual(transport.latency_seconds, 0.01)
@@ -0,0 +1,211 @@
+'''
+  Provider-call layer: rate limiting, retries and circuit breaking around each call to an NLP provider.
+  A ProviderGuard per provider composes the three; NlpClient treats a call it rejects like any other provider failure, so requests degrade to the remaining providers.
+'''
+from monitoring import metrics
+from typing import Callable
+import random
+import threading
+import time
+
+# Kinds of retryable errors, as returned by error classifiers. Other errors,
+# e.g. invalid requests, are neither retried nor counted by circuit breakers.
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+
+_RETRIES = metrics.Counter('nlp_provider_retries_total',
+                           'Retried calls to NLP providers.',
+                           ('provider', 'reason'))
+_REJECTED = metrics.Counter('nlp_provider_rejected_total',
+                            'Calls to NLP providers rejected before sending.',
+                            ('provider', 'reason'))
+_CIRCUIT_OPENED = metrics.Counter('nlp_provider_circuit_opened_total',
+                                  'Times the circuit of a provider opened.',
+                                  ('provider',))
+
+
+class CircuitOpenError(Exception):
+  ''' Raised instead of calling a provider whose circuit is open. '''
+
+
+class RateLimitedError(Exception):
+  ''' Raised when a call would wait for the rate limiter past its deadline. '''
+
+
+class TokenBucket:
+  ''' Rate limiter allowing bursts of `burst` calls, refilled at `rate` calls per second.
+
+    The rate adapts to throttling: it halves on each throttled call, down to
+    min_rate, and climbs back to max_rate by a twentieth of it per success.
+  '''
+
+  def __init__(self,
+               max_rate: float,
+               burst: float | None = None,
+               min_rate: float | None = None,
+               clock: Callable[[], float] = time.monotonic,
+               sleep: Callable[[float], None] = time.sleep):
+    self.max_rate = max_rate
+    self.min_rate = min_rate or max_rate / 16
+    self.burst = burst or max_rate
+    self.rate = max_rate
+    self._clock = clock
+    self._sleep = sleep
+    self._lock = threading.Lock()
+    self._tokens = self.burst
+    self._refilled_at = clock()
+
+  def _RefillLocked(self, now: float):
+    self._tokens = min(self.burst,
+                       self._tokens + (now - self._refilled_at) * self.rate)
+    self._refilled_at = now
+
+  def Acquire(self, deadline: float | None = None) -> bool:
+    ''' Waits for a token, returns False without one if it would wait past deadline. '''
+    while True:
+      with self._lock:
+        now = self._clock()
+        self._RefillLocked(now)
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return True
+        wait_seconds = (1 - self._tokens) / self.rate
+      if deadline is not None and now + wait_seconds > deadline:
+        return False
+      self._sleep(wait_seconds)
+
+  def OnThrottled(self):
+    with self._lock:
+      self._RefillLocked(self._clock())
+      self.rate = max(self.min_rate, self.rate / 2)
+
+  def OnSuccess(self):
+    if self.rate >= self.max_rate:
+      return
+    with self._lock:
+      self._RefillLocked(self._clock())
+      self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+  ''' Stops calling a provider after failure_threshold consecutive failures.
+
+    Once open, calls are rejected for reset_seconds. Calls are then let through
+    again (half-open): the first success closes the circuit, a failure opens it
+    for another reset_seconds.
+  '''
+
+  def __init__(self,
+               failure_threshold: int = 5,
+               reset_seconds: float = 30,
+               clock: Callable[[], float] = time.monotonic):
+    self.failure_threshold = failure_threshold
+    self.reset_seconds = reset_seconds
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._failures = 0
+    self._opened_at = None
+
+  def Allow(self) -> bool:
+    with self._lock:
+      return self._opened_at is None or (self._clock() - self._opened_at
+                                         >= self.reset_seconds)
+
+  def RecordSuccess(self):
+    with self._lock:
+      self._failures = 0
+      self._opened_at = None
+
+  def RecordFailure(self) -> bool:
+    ''' Returns whether this failure opened the circuit. '''
+    with self._lock:
+      self._failures += 1
+      half_open = self._opened_at is not None
+      if half_open or self._failures >= self.failure_threshold:
+        self._opened_at = self._clock()
+        return True
+      return False
+
+
+class RetryPolicy:
+  ''' Exponential backoff with full jitter: the n-th retry waits up to base_delay_seconds * 2^(n-1). '''
+
+  def __init__(self,
+               max_attempts: int = 3,
+               base_delay_seconds: float = 0.1,
+               max_delay_seconds: float = 2,
+               rng: random.Random | None = None):
+    self.max_attempts = max_attempts
+    self.base_delay_seconds = base_delay_seconds
+    self.max_delay_seconds = max_delay_seconds
+    self._rng = rng or random.Random()
+
+  def Delay(self, retry: int) -> float:
+    return self._rng.uniform(
+        0, min(self.max_delay_seconds,
+               self.base_delay_seconds * 2**(retry - 1)))
+
+
+class ProviderGuard:
+  ''' Calls a provider through its rate limiter, retry policy and circuit breaker.
+
+    classify_error returns THROTTLED or TRANSIENT for errors worth retrying,
+    or None for the others.
+  '''
+
+  def __init__(self,
+               provider: str,
+               classify_error: Callable[[Exception], str | None],
+               bucket: TokenBucket | None = None,
+               breaker: CircuitBreaker | None = None,
+               retry_policy: RetryPolicy | None = None,
+               clock: Callable[[], float] = time.monotonic,
+               sleep: Callable[[float], None] = time.sleep):
+    self.provider = provider
+    self.classify_error = classify_error
+    self.bucket = bucket
+    self.breaker = breaker or CircuitBreaker(clock=clock)
+    self.retry_policy = retry_policy or RetryPolicy()
+    self._clock = clock
+    self._sleep = sleep
+
+  def Call(self, call: Callable, deadline: float | None = None):
+    ''' Returns the result of call(), retrying retryable errors until deadline.
+
+      Raises CircuitOpenError or RateLimitedError without calling the provider,
+      or the error of the last attempt.
+    '''
+    if not self.breaker.Allow():
+      _REJECTED.Inc(self.provider, 'circuit_open')
+      raise CircuitOpenError(f'{self.provider} circuit is open')
+
+    retry = 0
+    while True:
+      if self.bucket is not None and not self.bucket.Acquire(deadline):
+        _REJECTED.Inc(self.provider, 'rate_limited')
+        raise RateLimitedError(
+            f'{self.provider} rate limit does not allow a call before the deadline'
+        )
+      try:
+        result = call()
+      except Exception as e:
+        kind = self.classify_error(e)
+        if kind is None:
+          raise
+        if kind == THROTTLED and self.bucket is not None:
+          self.bucket.OnThrottled()
+        retry += 1
+        delay_seconds = self.retry_policy.Delay(retry)
+        if retry >= self.retry_policy.max_attempts or (
+            deadline is not None and self._clock() + delay_seconds > deadline):
+          if self.breaker.RecordFailure():
+            _CIRCUIT_OPENED.Inc(self.provider)
+          raise
+        _RETRIES.Inc(self.provider, kind)
+        self._sleep(delay_seconds)
+        continue
+
+      if self.bucket is not None:
+        self.bucket.OnSuccess()
+      self.breaker.RecordSuccess()
+      return result
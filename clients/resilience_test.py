@@ -0,0 +1,163 @@
+import random
+import unittest
+
+from clients import resilience
+
+
+class _FakeClock:
+
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+  def Sleep(self, seconds):
+    self.now += seconds
+
+
+class _RetryableError(Exception):
+  pass
+
+
+def _Classify(error):
+  return resilience.THROTTLED if isinstance(error, _RetryableError) else None
+
+
+class _Provider:
+  ''' Fails with the given errors, then succeeds. '''
+
+  def __init__(self, errors=()):
+    self.errors = list(errors)
+    self.calls = 0
+
+  def __call__(self):
+    self.calls += 1
+    if self.errors:
+      raise self.errors.pop(0)
+    return 'result'
+
+
+class TokenBucketTest(unittest.TestCase):
+
+  def test_calls_beyond_burst_wait_for_refill(self):
+    clock = _FakeClock()
+    bucket = resilience.TokenBucket(10, burst=2, clock=clock, sleep=clock.Sleep)
+
+    for _ in range(3):
+      self.assertTrue(bucket.Acquire())
+
+    self.assertAlmostEqual(clock.now, 0.1)
+
+  def test_acquire_gives_up_at_deadline(self):
+    clock = _FakeClock()
+    bucket = resilience.TokenBucket(1, clock=clock, sleep=clock.Sleep)
+    bucket.Acquire()
+
+    self.assertFalse(bucket.Acquire(deadline=0.5))
+    self.assertEqual(clock.now, 0)
+
+  def test_rate_halves_on_throttling_and_recovers_on_success(self):
+    bucket = resilience.TokenBucket(10, clock=_FakeClock())
+
+    bucket.OnThrottled()
+    bucket.OnThrottled()
+    self.assertEqual(bucket.rate, 2.5)
+    for _ in range(20):
+      bucket.OnSuccess()
+    self.assertEqual(bucket.rate, 10)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+  def test_opens_after_consecutive_failures(self):
+    breaker = resilience.CircuitBreaker(failure_threshold=2, clock=_FakeClock())
+
+    self.assertFalse(breaker.RecordFailure())
+    breaker.RecordSuccess()
+    self.assertFalse(breaker.RecordFailure())
+    self.assertTrue(breaker.Allow())
+    self.assertTrue(breaker.RecordFailure())
+    self.assertFalse(breaker.Allow())
+
+  def test_half_open_failure_reopens_and_success_closes(self):
+    clock = _FakeClock()
+    breaker = resilience.CircuitBreaker(failure_threshold=1,
+                                        reset_seconds=30,
+                                        clock=clock)
+    breaker.RecordFailure()
+
+    clock.now = 30
+    self.assertTrue(breaker.Allow())
+    breaker.RecordFailure()
+    self.assertFalse(breaker.Allow())
+    clock.now = 60
+    breaker.RecordSuccess()
+    self.assertTrue(breaker.Allow())
+
+
+class ProviderGuardTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.clock = _FakeClock()
+
+  def _Guard(self, **kwargs):
+    return resilience.ProviderGuard('aws',
+                                    _Classify,
+                                    retry_policy=resilience.RetryPolicy(
+                                        max_attempts=3, rng=random.Random(0)),
+                                    clock=self.clock,
+                                    sleep=self.clock.Sleep,
+                                    **kwargs)
+
+  def test_retryable_errors_are_retried_with_backoff(self):
+    provider = _Provider([_RetryableError(), _RetryableError()])
+
+    self.assertEqual(self._Guard().Call(provider), 'result')
+    self.assertEqual(provider.calls, 3)
+    self.assertGreater(self.clock.now, 0)
+
+  def test_other_errors_are_raised_at_once(self):
+    provider = _Provider([ValueError()])
+
+    with self.assertRaises(ValueError):
+      self._Guard().Call(provider)
+    self.assertEqual(provider.calls, 1)
+
+  def test_retries_stop_at_deadline(self):
+    provider = _Provider([_RetryableError()] * 3)
+
+    with self.assertRaises(_RetryableError):
+      self._Guard().Call(provider, deadline=0)
+    self.assertEqual(provider.calls, 1)
+
+  def test_sustained_failures_open_the_circuit(self):
+    guard = self._Guard(breaker=resilience.CircuitBreaker(failure_threshold=2,
+                                                          clock=self.clock))
+    provider = _Provider([_RetryableError()] * 6)
+
+    for _ in range(2):
+      with self.assertRaises(_RetryableError):
+        guard.Call(provider)
+    with self.assertRaises(resilience.CircuitOpenError):
+      guard.Call(provider)
+    self.assertEqual(provider.calls, 6)
+
+  def test_throttling_slows_down_the_bucket(self):
+    bucket = resilience.TokenBucket(10,
+                                    clock=self.clock,
+                                    sleep=self.clock.Sleep)
+    guard = self._Guard(bucket=bucket)
+
+    guard.Call(_Provider([_RetryableError()]))
+
+    self.assertLess(bucket.rate, 10)
+
+  def test_call_without_token_before_deadline_is_rejected(self):
+    bucket = resilience.TokenBucket(1, clock=self.clock, sleep=self.clock.Sleep)
+    guard = self._Guard(bucket=bucket)
+    guard.Call(_Provider())
+
+    with self.assertRaises(resilience.RateLimitedError):
+      guard.Call(_Provider(), deadline=0.5)
@@ -0,0 +1,153 @@
+'''
+  Admission control: decides from the length of texts alone whether analyzing them fits the budget, before any provider call.
+  Costs are estimated with the ledger's unit formulas and checked against its locally held month cost, so a decision takes a lock and some arithmetic, and rejected requests are never charged.
+'''
+from cost import cost_controller
+from monitoring import metrics
+import dataclasses
+import threading
+
+# Share of the budget each priority may spend: as the month cost nears the
+# budget, low priority requests are shed first.
+PRIORITY_BUDGET_SHARES = {'low': 0.8, 'normal': 0.95, 'high': 1.0}
+DEFAULT_TENANT = 'default'
+
+# Decisions.
+ADMITTED = 'admitted'
+BUDGET_EXCEEDED = 'budget_exceeded'  # The month budget would be exceeded.
+SHED = 'shed'  # The share of the budget of the priority would be exceeded.
+QUOTA_EXCEEDED = 'quota_exceeded'  # The quota of the tenant would be exceeded.
+
+_DECISIONS = metrics.Counter('admission_decisions_total',
+                             'Admission decisions, by tenant.',
+                             ('tenant', 'decision'))
+
+
+@dataclasses.dataclass(slots=True)
+class Tenant:
+  name: str
+  priority: str = 'normal'
+  # Max cost of the tenant per month, at list price, or None for no quota.
+  monthly_quota: float | None = None
+
+
+@dataclasses.dataclass(slots=True)
+class Decision:
+  decision: str
+  # Estimated cost of the request, at list price.
+  estimated_cost: float = 0
+  # Name of the tenant the request was decided for.
+  tenant: str = DEFAULT_TENANT
+
+  @property
+  def admitted(self) -> bool:
+    return self.decision == ADMITTED
+
+
+def ParseTenants(spec: str) -> dict[str, Tenant]:
+  ''' Parses comma-separated name:priority[:monthly_quota] tenants, e.g. "acme:high:50,trial:low:1". '''
+  tenants = {}
+  for entry in spec.split(','):
+    if not entry.strip():
+      continue
+    fields = entry.strip().split(':')
+    if len(fields) not in (2, 3) or fields[1] not in PRIORITY_BUDGET_SHARES:
+      raise ValueError(
+          f'Invalid tenant {entry}, expected name:priority[:monthly_quota] '
+          f'with a priority in {", ".join(PRIORITY_BUDGET_SHARES)}.')
+    tenants[fields[0]] = Tenant(
+        name=fields[0],
+        priority=fields[1],
+        monthly_quota=float(fields[2]) if len(fields) == 3 else None)
+  return tenants
+
+
+def LoadApiKeys(path: str) -> dict[str, str]:
+  ''' Reads a tab-separated file of API keys and the name of the tenant each authenticates. '''
+  api_key_tenants = {}
+  with open(path, 'r', encoding='utf-8') as file:
+    for line in file:
+      if not line.strip() or line.startswith('#'):
+        continue
+      api_key, tenant_name = line.rstrip('\n').split('\t')
+      api_key_tenants[api_key.strip()] = tenant_name.strip()
+  return api_key_tenants
+
+
+class AdmissionController:
+  ''' Admits requests whose estimated cost fits their tenant quota and priority share of the budget.
+
+    Admitted requests are charged to the ledger in the same step. Tenant
+    spending is tracked per process and restarts every month, so with several
+    serving processes a quota should be divided by their number. Unknown
+    tenants are treated as the `default` tenant, without quota unless
+    configured. Priority shares only apply to configured tenants, so the
+    implicit default tenant may spend the whole budget, as without tenants.
+  '''
+
+  def __init__(self,
+               ledger: cost_controller.CostLedger,
+               budget: float = cost_controller.MONTHLY_BUDGET,
+               tenants: dict[str, Tenant] | None = None):
+    self.ledger = ledger
+    self.budget = budget
+    self.tenants = tenants or {}
+    self._default_tenant = self.tenants.get(DEFAULT_TENANT,
+                                            Tenant(DEFAULT_TENANT))
+    self._lock = threading.Lock()
+    self._month = None
+    self._tenant_spending = {}
+
+  def Admit(self, contents: list[str], tenant_name: str = '') -> Decision:
+    ''' Charges contents if admitted, see Decision. '''
+    decision = self._Decide(contents, tenant_name, charge=True)
+    _DECISIONS.Inc(decision.tenant, decision.decision)
+    return decision
+
+  def Check(self, contents: list[str], tenant_name: str = '') -> Decision:
+    ''' Returns the decision Admit would take, without charging contents.
+
+      Only rejections are counted, admitted contents being counted once
+      charged by Admit.
+    '''
+    decision = self._Decide(contents, tenant_name, charge=False)
+    if not decision.admitted:
+      _DECISIONS.Inc(decision.tenant, decision.decision)
+    return decision
+
+  def _Decide(self, contents: list[str], tenant_name: str,
+              charge: bool) -> Decision:
+    tenant = self.tenants.get(tenant_name, self._default_tenant)
+    aws_unit, gcp_unit = cost_controller.Units(contents)
+    estimated_cost = cost_controller.ListPrice(aws_unit, gcp_unit)
+
+    month = cost_controller.CurrentMonth()
+    with self._lock:
+      if month != self._month:
+        self._month = month
+        self._tenant_spending = {}
+      spending = self._tenant_spending.get(tenant.name, 0)
+      if (tenant.monthly_quota is not None and
+          spending + estimated_cost > tenant.monthly_quota):
+        decision = QUOTA_EXCEEDED
+      else:
+        limit = self.budget
+        if tenant.name in self.tenants:
+          limit *= PRIORITY_BUDGET_SHARES[tenant.priority]
+        if charge:
+          charged, cost = self.ledger.TryCharge(aws_unit, gcp_unit, limit)
+        else:
+          cost = self.ledger.Estimate(aws_unit, gcp_unit)
+          charged = cost.total_cost <= limit
+        if charged:
+          if charge:
+            self._tenant_spending[tenant.name] = spending + estimated_cost
+          decision = ADMITTED
+        elif cost.total_cost > self.budget:
+          decision = BUDGET_EXCEEDED
+        else:
+          decision = SHED
+
+    return Decision(decision=decision,
+                    estimated_cost=estimated_cost,
+                    tenant=tenant.name)
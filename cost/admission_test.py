@@ -0,0 +1,97 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from cost import admission, cost_controller
+
+
+class ParseTenantsTest(unittest.TestCase):
+
+  def test_parses_priorities_and_optional_quotas(self):
+    self.assertEqual(
+        admission.ParseTenants('acme:high:50, trial:low'), {
+            'acme': admission.Tenant('acme', 'high', 50),
+            'trial': admission.Tenant('trial', 'low', None),
+        })
+
+  def test_invalid_priority_raises(self):
+    with self.assertRaises(ValueError):
+      admission.ParseTenants('acme:urgent')
+
+
+class LoadApiKeysTest(unittest.TestCase):
+
+  def test_maps_api_keys_to_tenants(self):
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv') as file:
+      file.write('# key\ttenant\nk1\tacme\n\nk2 \t trial\n')
+      file.flush()
+      self.assertEqual(admission.LoadApiKeys(file.name), {
+          'k1': 'acme',
+          'k2': 'trial'
+      })
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    patcher = mock.patch.object(cost_controller, 'CurrentMonth',
+                                lambda: '2023-12')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.ledger = cost_controller.CostLedger(db=None)
+
+  def test_admitted_request_is_charged(self):
+    controller = admission.AdmissionController(self.ledger)
+
+    decision = controller.Admit(['a' * 250])
+
+    self.assertTrue(decision.admitted)
+    self.assertAlmostEqual(decision.estimated_cost, 3 * 0.0001 + 0.002)
+    self.assertEqual(self.ledger.View().aws_unit, 3)
+
+  def test_check_decides_without_charge(self):
+    controller = admission.AdmissionController(self.ledger, budget=0.0005)
+
+    self.assertTrue(controller.Check(['a']).admitted)
+    self.assertEqual(
+        controller.Check(['a' * 1000]).decision, admission.BUDGET_EXCEEDED)
+    self.assertEqual(self.ledger.View().aws_unit, 0)
+
+  def test_default_tenant_may_spend_the_whole_budget(self):
+    controller = admission.AdmissionController(self.ledger, budget=1)
+    self.ledger.TryCharge(aws_unit=9990, gcp_unit=0, limit=1)
+
+    self.assertTrue(controller.Admit(['text']).admitted)
+    self.assertEqual(
+        controller.Admit(['text'] * 4).decision, admission.BUDGET_EXCEEDED)
+
+  def test_request_over_budget_is_rejected_without_charge(self):
+    controller = admission.AdmissionController(self.ledger, budget=0.0002)
+
+    decision = controller.Admit(['text'])
+
+    self.assertEqual(decision.decision, admission.BUDGET_EXCEEDED)
+    self.assertEqual(self.ledger.View().aws_unit, 0)
+
+  def test_low_priority_is_shed_before_high_priority(self):
+    # 900 AWS units cost $0.09, 90% of the budget.
+    self.ledger.Charge(['a' * 100] * 300)
+    controller = admission.AdmissionController(
+        self.ledger,
+        budget=0.1,
+        tenants=admission.ParseTenants('free:low,paid:high'))
+
+    self.assertEqual(
+        controller.Admit(['text'], 'free').decision, admission.SHED)
+    self.assertTrue(controller.Admit(['text'], 'paid').admitted)
+
+  def test_tenant_over_quota_is_rejected(self):
+    controller = admission.AdmissionController(
+        self.ledger, tenants=admission.ParseTenants('trial:normal:0.004'))
+
+    self.assertTrue(controller.Admit(['text'], 'trial').admitted)
+    self.assertEqual(
+        controller.Admit(['text'], 'trial').decision, admission.QUOTA_EXCEEDED)
+    # Other tenants are not affected.
+    self.assertTrue(controller.Admit(['text'], 'other').admitted)
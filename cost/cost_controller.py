@@ -1,10 +1,22 @@
 import dataclasses
 import math
-from google.cloud import firestore
+from monitoring import metrics
+from typing import Callable
 import pytz
 import datetime
+import logging
+import threading
+import utils
+
+firestore = utils.LazyModule('google.cloud.firestore')
 
 _COST = 'cost'
+# Month cost past which texts are no longer analyzed.
+MONTHLY_BUDGET = 100
+# First 5k GCP unit is free, then $0.002 per unit. $0.0001 per AWS unit.
+_GCP_FREE_UNITS = 5000
+_GCP_UNIT_PRICE = 0.002
+_AWS_UNIT_PRICE = 0.0001
 
 
 @dataclasses.dataclass
@@ -17,9 +29,19 @@ class Cost:
   aws_cost: float = 0
 
 
-def _load_current_month_cost(db: firestore.Client) -> Cost:
-  month = datetime.datetime.now(
+_COST_SECONDS = metrics.Histogram('cost_operation_seconds',
+                                  'Latency of cost accounting operations.',
+                                  ('operation',))
+_FLUSH_ERRORS = metrics.Counter('cost_flush_errors_total',
+                                'Failed flushes of cost units to Firestore.')
+
+
+def CurrentMonth() -> str:
+  return datetime.datetime.now(
       pytz.timezone('America/Los_Angeles')).strftime('%Y-%m')
+
+
+def _load_month_cost(db: 'firestore.Client', month: str) -> Cost:
   doc = db.collection(_COST).document(month).get()
   if doc.exists:
     return Cost(**doc.to_dict())
@@ -27,29 +49,238 @@ def _load_current_month_cost(db: firestore.Client) -> Cost:
     return Cost(month=month)
 
 
-def _save_month_cost(db: firestore.Client, cost: Cost):
+def _load_current_month_cost(db: 'firestore.Client') -> Cost:
+  return _load_month_cost(db, CurrentMonth())
+
+
+def _save_month_cost(db: 'firestore.Client', cost: Cost):
   db.collection(_COST).document(cost.month).set(dataclasses.asdict(cost))
 
 
-def _update_gcp_cost(cost: Cost, content: str) -> Cost:
-  # One unit is 1,000-character. First 5k unit is free, then $0.002 per unit.
-  cost.gcp_unit += max(round(len(content) / 1000), 1)
-  cost.gcp_cost = max(0, cost.gcp_unit - 5000) * 0.002
+def _gcp_units(content: str) -> int:
+  # One unit is 1,000-character.
+  return max(round(len(content) / 1000), 1)
+
+
+def _aws_units(content: str) -> int:
+  # One unit is 100-character. With 3 units minimum charge.
+  return max(3, math.ceil(len(content) / 100))
+
+
+def Units(contents: list[str]) -> tuple[int, int]:
+  ''' Returns the AWS and GCP units charged for analyzing contents. '''
+  return (sum(_aws_units(content) for content in contents),
+          sum(_gcp_units(content) for content in contents))
+
+
+def ListPrice(aws_unit: int, gcp_unit: int) -> float:
+  ''' Returns the cost of units without the GCP free tier. '''
+  return aws_unit * _AWS_UNIT_PRICE + gcp_unit * _GCP_UNIT_PRICE
+
+
+def _add_units(cost: Cost, aws_unit: int, gcp_unit: int) -> Cost:
+  cost.aws_unit += aws_unit
+  cost.gcp_unit += gcp_unit
+  cost.gcp_cost = max(0, cost.gcp_unit - _GCP_FREE_UNITS) * _GCP_UNIT_PRICE
+  cost.aws_cost = cost.aws_unit * _AWS_UNIT_PRICE
   cost.total_cost = cost.aws_cost + cost.gcp_cost
   return cost
 
 
+def _update_gcp_cost(cost: Cost, content: str) -> Cost:
+  return _add_units(cost, 0, _gcp_units(content))
+
+
 def _update_aws_cost(cost: Cost, content: str) -> Cost:
-  # One unit is 100-character. With 3 units minimum charge. $0.0001 per unit.
-  cost.aws_unit += max(3, math.ceil(len(content) / 100))
-  cost.aws_cost = cost.aws_unit * 0.0001
-  cost.total_cost = cost.aws_cost + cost.gcp_cost
-  return cost
+  return _add_units(cost, _aws_units(content), 0)
+
+
+def FirestoreTransact(db: 'firestore.Client', function: Callable):
+  ''' Returns function(transaction), run in a Firestore transaction retried on contention. '''
+  return firestore.transactional(function)(db.transaction())
+
 
+def _apply_units(db: 'firestore.Client',
+                 month: str,
+                 aws_unit: int,
+                 gcp_unit: int,
+                 transact: Callable = FirestoreTransact) -> Cost:
+  ''' Atomically adds units to the month cost in Firestore, returns the result. '''
+  doc_ref = db.collection(_COST).document(month)
 
-def update_cost(db: firestore.Client, content: str) -> Cost:
+  def Apply(transaction) -> Cost:
+    doc = doc_ref.get(transaction=transaction)
+    cost = Cost(**doc.to_dict()) if doc.exists else Cost(month=month)
+    cost = _add_units(cost, aws_unit, gcp_unit)
+    transaction.set(doc_ref, dataclasses.asdict(cost))
+    return cost
+
+  return transact(db, Apply)
+
+
+@_COST_SECONDS.Timed('update_cost')
+def update_cost(db: 'firestore.Client', content: str) -> Cost:
+  return update_cost_batch(db, [content])
+
+
+@_COST_SECONDS.Timed('update_cost_batch')
+def update_cost_batch(db: 'firestore.Client', contents: list[str]) -> Cost:
+  ''' Charges all contents with a single read and write of the month cost. '''
   cost = _load_current_month_cost(db)
-  cost = _update_aws_cost(cost, content)
-  cost = _update_gcp_cost(cost, content)
+  for content in contents:
+    cost = _update_aws_cost(cost, content)
+    cost = _update_gcp_cost(cost, content)
   _save_month_cost(db, cost)
   return cost
+
+
+class CostLedger:
+  ''' Charges requests in memory and settles them with Firestore in the background.
+
+    Charge() never touches the network: it adds the units to a pending buffer
+    and returns the locally cached month cost plus everything pending. A
+    background thread flushes the buffer every flush_interval_seconds, or
+    sooner once flush_units are pending, adding it to the month document in a
+    transaction. Transactions keep the totals correct with several workers
+    charging the same month; the document read back by each flush also
+    refreshes the cached view with the other workers' charges.
+  '''
+
+  def __init__(self,
+               db: 'firestore.Client',
+               flush_interval_seconds: float = 5,
+               flush_units: int = 10000,
+               transact: Callable = FirestoreTransact):
+    self.db = db
+    # transact(db, function) returns function(transaction), run in a
+    # transaction of db.
+    self.transact = transact
+    self.flush_interval_seconds = flush_interval_seconds
+    self.flush_units = flush_units
+    self._lock = threading.Lock()
+    # Serializes flushes so that pending units are never applied twice.
+    self._flush_lock = threading.Lock()
+    self._settled = Cost(month=CurrentMonth())  # Last known Firestore state.
+    self._pending = {}  # month -> [aws_unit, gcp_unit] not yet in Firestore.
+    # Pending units taken by the running flush, until its transaction result
+    # is applied to _settled.
+    self._in_flight = {}
+    self._wake = threading.Event()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def Start(self):
+    ''' Loads the current month cost and starts the background flusher. '''
+    self._settled = _load_current_month_cost(self.db)
+    self._thread = threading.Thread(target=self._Run,
+                                    name='cost_ledger',
+                                    daemon=True)
+    self._thread.start()
+
+  def Close(self):
+    ''' Stops the background flusher and flushes pending units. '''
+    self._stopped.set()
+    self._wake.set()
+    if self._thread is not None:
+      self._thread.join()
+    self.Flush()
+
+  @_COST_SECONDS.Timed('charge')
+  def Charge(self, contents: list[str]) -> Cost:
+    ''' Charges all contents to the current month, returns the month cost. '''
+    aws_unit, gcp_unit = Units(contents)
+    month = CurrentMonth()
+    with self._lock:
+      self._AddPendingLocked(month, aws_unit, gcp_unit)
+      return self._ViewLocked(month)
+
+  @_COST_SECONDS.Timed('try_charge')
+  def TryCharge(self, aws_unit: int, gcp_unit: int,
+                limit: float) -> tuple[bool, Cost]:
+    ''' Charges units only if the month cost stays within limit.
+
+      Returns whether they were charged, and the month cost including them
+      either way.
+    '''
+    month = CurrentMonth()
+    with self._lock:
+      cost = _add_units(self._ViewLocked(month), aws_unit, gcp_unit)
+      if cost.total_cost > limit:
+        return False, cost
+      self._AddPendingLocked(month, aws_unit, gcp_unit)
+      return True, cost
+
+  def Estimate(self, aws_unit: int, gcp_unit: int) -> Cost:
+    ''' Returns the month cost including units, without charging them. '''
+    with self._lock:
+      return _add_units(self._ViewLocked(CurrentMonth()), aws_unit, gcp_unit)
+
+  def _AddPendingLocked(self, month: str, aws_unit: int, gcp_unit: int):
+    pending = self._pending.setdefault(month, [0, 0])
+    pending[0] += aws_unit
+    pending[1] += gcp_unit
+    if pending[0] + pending[1] >= self.flush_units:
+      self._wake.set()
+
+  def View(self) -> Cost:
+    ''' Returns the current month cost including pending units. '''
+    with self._lock:
+      return self._ViewLocked(CurrentMonth())
+
+  def _ViewLocked(self, month: str) -> Cost:
+    settled = self._settled
+    if settled.month != month:
+      settled = Cost(month=month)
+    aws_unit, gcp_unit = self._pending.get(month, (0, 0))
+    in_flight_aws_unit, in_flight_gcp_unit = self._in_flight.get(month, (0, 0))
+    return _add_units(dataclasses.replace(settled),
+                      aws_unit + in_flight_aws_unit,
+                      gcp_unit + in_flight_gcp_unit)
+
+  @_COST_SECONDS.Timed('flush')
+  def Flush(self):
+    ''' Adds pending units to Firestore and refreshes the cached month cost.
+
+      The units stay in the view while their transaction runs, and leave it
+      together with the settled cost including them.
+    '''
+    with self._flush_lock:
+      with self._lock:
+        pending, self._pending = self._pending, {}
+        self._in_flight = dict(pending)
+      month = CurrentMonth()
+
+      for pending_month, (aws_unit, gcp_unit) in pending.items():
+        try:
+          settled = _apply_units(self.db, pending_month, aws_unit, gcp_unit,
+                                 self.transact)
+        except Exception as e:
+          _FLUSH_ERRORS.Inc()
+          logging.warning('Failed to flush cost of %s: %s', pending_month, e)
+          with self._lock:
+            del self._in_flight[pending_month]
+            retry = self._pending.setdefault(pending_month, [0, 0])
+            retry[0] += aws_unit
+            retry[1] += gcp_unit
+          continue
+        with self._lock:
+          del self._in_flight[pending_month]
+          if pending_month == month:
+            self._settled = settled
+
+      if month not in pending:
+        # Nothing charged here, still pick up charges from other workers.
+        try:
+          settled = _load_month_cost(self.db, month)
+        except Exception as e:
+          logging.warning('Failed to refresh cost of %s: %s', month, e)
+          return
+        with self._lock:
+          self._settled = settled
+
+  def _Run(self):
+    while not self._stopped.is_set():
+      self._wake.wait(self.flush_interval_seconds)
+      self._wake.clear()
+      if not self._stopped.is_set():
+        self.Flush()
@@ -0,0 +1,136 @@
+import unittest
+from unittest import mock
+
+from cost import cost_controller, local_firestore
+
+
+class _FakeMonthCosts:
+  ''' Stands in for the Firestore month documents shared by all workers. '''
+
+  def __init__(self):
+    self.costs = {}
+    self.fail = False
+    self.calls = 0
+
+  def Load(self, db, month):
+    self.calls += 1
+    return self.costs.get(month, cost_controller.Cost(month=month))
+
+  def Apply(self, db, month, aws_unit, gcp_unit, transact):
+    self.calls += 1
+    if self.fail:
+      raise RuntimeError('unavailable')
+    cost = self.costs.get(month, cost_controller.Cost(month=month))
+    self.costs[month] = cost_controller._add_units(cost, aws_unit, gcp_unit)
+    return self.costs[month]
+
+
+class CostLedgerTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.month_costs = _FakeMonthCosts()
+    for name, fake in [('_load_month_cost', self.month_costs.Load),
+                       ('_apply_units', self.month_costs.Apply),
+                       ('CurrentMonth', lambda: '2023-12')]:
+      patcher = mock.patch.object(cost_controller, name, fake)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def test_charge_does_not_call_firestore(self):
+    ledger = cost_controller.CostLedger(db=None)
+
+    cost = ledger.Charge(['a' * 250])
+
+    self.assertEqual(self.month_costs.calls, 0)
+    self.assertEqual(cost.aws_unit, 3)
+    self.assertEqual(cost.gcp_unit, 1)
+
+  def test_charge_matches_update_cost_formulas(self):
+    ledger = cost_controller.CostLedger(db=None)
+    contents = ['a' * 10, 'a' * 1234, 'a' * 5600]
+
+    expected_cost = cost_controller.Cost(month='2023-12')
+    for content in contents:
+      expected_cost = cost_controller._update_aws_cost(expected_cost, content)
+      expected_cost = cost_controller._update_gcp_cost(expected_cost, content)
+
+    self.assertEqual(ledger.Charge(contents), expected_cost)
+
+  def test_try_charge_only_charges_within_limit(self):
+    ledger = cost_controller.CostLedger(db=None)
+
+    charged, cost = ledger.TryCharge(aws_unit=20000, gcp_unit=0, limit=1)
+
+    self.assertFalse(charged)
+    self.assertEqual(cost.total_cost, 2)
+    self.assertEqual(ledger.View().aws_unit, 0)
+    self.assertTrue(ledger.TryCharge(aws_unit=20000, gcp_unit=0, limit=2)[0])
+    self.assertEqual(ledger.View().aws_unit, 20000)
+
+  def test_flush_from_several_workers_keeps_month_total(self):
+    ledgers = [cost_controller.CostLedger(db=None) for _ in range(3)]
+    for ledger in ledgers:
+      ledger.Charge(['text'] * 10)
+    for ledger in ledgers:
+      ledger.Flush()
+
+    self.assertEqual(self.month_costs.costs['2023-12'].aws_unit, 90)
+    self.assertEqual(ledgers[0].View().aws_unit, 90)
+
+  def test_failed_flush_keeps_units_pending(self):
+    ledger = cost_controller.CostLedger(db=None)
+    ledger.Charge(['text'])
+    self.month_costs.fail = True
+    ledger.Flush()
+    self.month_costs.fail = False
+    ledger.Flush()
+
+    self.assertEqual(self.month_costs.costs['2023-12'].aws_unit, 3)
+    self.assertEqual(ledger.View().aws_unit, 3)
+
+  def test_view_includes_units_being_flushed(self):
+    ledger = cost_controller.CostLedger(db=None)
+    ledger.Charge(['text'])
+    views = []
+
+    def Apply(db, month, aws_unit, gcp_unit, transact):
+      views.append(ledger.View().aws_unit)
+      return self.month_costs.Apply(db, month, aws_unit, gcp_unit, transact)
+
+    with mock.patch.object(cost_controller, '_apply_units', Apply):
+      ledger.Flush()
+
+    self.assertEqual(views, [3])
+    self.assertEqual(ledger.View().aws_unit, 3)
+
+  def test_close_flushes_pending_units(self):
+    ledger = cost_controller.CostLedger(db=None,
+                                        flush_interval_seconds=60,
+                                        flush_units=10)
+    ledger.Start()
+    ledger.Charge(['text'] * 5)
+    ledger.Close()
+
+    self.assertEqual(self.month_costs.costs['2023-12'].aws_unit, 15)
+
+
+class LocalFirestoreLedgerTest(unittest.TestCase):
+
+  def test_ledgers_settle_month_cost_in_local_firestore(self):
+    db = local_firestore.LocalFirestore()
+    ledgers = [
+        cost_controller.CostLedger(
+            db, transact=local_firestore.LocalFirestore.Transact)
+        for _ in range(2)
+    ]
+    for ledger in ledgers:
+      ledger.Start()
+      ledger.Charge(['a' * 250])
+    for ledger in ledgers:
+      ledger.Close()
+
+    cost = cost_controller._load_current_month_cost(db)
+    self.assertEqual(cost.aws_unit, 6)
+    self.assertEqual(cost.gcp_unit, 2)
+    self.assertEqual(ledgers[1].View().aws_unit, 6)
@@ -0,0 +1,98 @@
+'''
+  In-memory stand-in for the Firestore client, for servers replaying provider responses, see clients/replay.py.
+  It implements the calls of the cost ledger, including its month cost transactions, and those of the Firestore cache tier and analytics sink, so a load test never reaches Firestore. Documents live in the process: every process keeps its own month cost.
+'''
+import copy
+import threading
+import uuid
+
+
+class _Snapshot:
+
+  def __init__(self, document_id: str, data: dict | None):
+    self.id = document_id
+    self._data = data
+
+  @property
+  def exists(self) -> bool:
+    return self._data is not None
+
+  def to_dict(self) -> dict | None:
+    return copy.deepcopy(self._data)
+
+
+class _DocumentReference:
+
+  def __init__(self, db: 'LocalFirestore', collection: str, document_id: str):
+    self._db = db
+    self.path = (collection, document_id)
+    self.id = document_id
+
+  def get(self, transaction=None) -> _Snapshot:
+    return _Snapshot(self.id, self._db._Read(self.path))
+
+  def set(self, data: dict):
+    self._db._Write([(self.path, data)])
+
+
+class _Collection:
+
+  def __init__(self, db: 'LocalFirestore', name: str):
+    self._db = db
+    self.name = name
+
+  def document(self, document_id: str | None = None) -> _DocumentReference:
+    return _DocumentReference(self._db, self.name, document_id or
+                              uuid.uuid4().hex)
+
+
+class _WriteBatch:
+  ''' Writes set documents at once on commit, like a Firestore batch or transaction. '''
+
+  def __init__(self, db: 'LocalFirestore'):
+    self._db = db
+    self._writes = []
+
+  def set(self, reference: _DocumentReference, data: dict):
+    self._writes.append((reference.path, data))
+
+  def commit(self):
+    self._db._Write(self._writes)
+    self._writes = []
+
+
+class LocalFirestore:
+  ''' Holds documents in memory, by collection and id. Thread-safe. '''
+
+  def __init__(self):
+    # Reentrant, so transactions read and write while holding it.
+    self._lock = threading.RLock()
+    self._documents = {}  # (collection, id) -> data.
+
+  def collection(self, name: str) -> _Collection:
+    return _Collection(self, name)
+
+  def batch(self) -> _WriteBatch:
+    return _WriteBatch(self)
+
+  def Transact(self, function):
+    ''' Returns function(transaction), whose sets are committed together.
+
+      Transactions run one at a time, so unlike Firestore they never retry.
+      Stands in for cost_controller.FirestoreTransact as the transact of the
+      cost ledger.
+    '''
+    with self._lock:
+      transaction = _WriteBatch(self)
+      result = function(transaction)
+      transaction.commit()
+      return result
+
+  def _Read(self, path: tuple[str, str]) -> dict | None:
+    with self._lock:
+      return self._documents.get(path)
+
+  def _Write(self, writes: list):
+    with self._lock:
+      for path, data in writes:
+        self._documents[path] = copy.deepcopy(data)
@@ -0,0 +1,47 @@
+import unittest
+
+from cost import local_firestore
+
+
+class LocalFirestoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.db = local_firestore.LocalFirestore()
+
+  def test_documents_are_set_and_read_back(self):
+    reference = self.db.collection('costs').document('2024-01')
+    self.assertFalse(reference.get().exists)
+    data = {'aws_unit': 3}
+    reference.set(data)
+    data['aws_unit'] = 4
+
+    snapshot = self.db.collection('costs').document('2024-01').get()
+
+    self.assertTrue(snapshot.exists)
+    self.assertEqual(snapshot.to_dict(), {'aws_unit': 3})
+
+  def test_batches_write_on_commit(self):
+    collection = self.db.collection('entity_results')
+    batch = self.db.batch()
+    references = [collection.document() for _ in range(3)]
+    for index, reference in enumerate(references):
+      batch.set(reference, {'index': index})
+    self.assertFalse(references[0].get().exists)
+    batch.commit()
+    self.assertEqual(len({reference.id for reference in references}), 3)
+    self.assertEqual(
+        [reference.get().to_dict()['index'] for reference in references],
+        [0, 1, 2])
+
+  def test_transactions_commit_their_sets(self):
+    reference = self.db.collection('costs').document('2024-01')
+
+    def Increment(transaction):
+      snapshot = reference.get(transaction=transaction)
+      count = snapshot.to_dict()['count'] if snapshot.exists else 0
+      transaction.set(reference, {'count': count + 1})
+      return count + 1
+
+    self.assertEqual(self.db.Transact(Increment), 1)
+    self.assertEqual(self.db.Transact(Increment), 2)
+    self.assertEqual(reference.get().to_dict(), {'count': 2})
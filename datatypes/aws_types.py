@@ -4,14 +4,19 @@
 '''
 import dataclasses
 
+# Mentions that refer to an entity without describing it.
+_PRONOUNS = frozenset(
+    'i me my mine we us our ours you your yours he him his she her hers it its '
+    'they them their theirs this that these those'.split())
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True)
 class SentimentScore:
   positive: float  # [0, 1].
   negative: float  # [0, 1].
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Mention:
   text: str
   score: float  # [0, 1]. "Model confidence that the entity is relevant. Value range is zero to one, where one is highest confidence."
@@ -19,8 +24,28 @@ class Mention:
   sentiments: SentimentScore
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class AwsEntity:
   ''' A group of relevant entities found in the text. E.g. In text "AWS Comprehend is good, but it could be improved," "AWS Comprehend" and "it" are two entities in a group. '''
   text: str  # The extracted text that best matches the entity group.
   mentions: list[Mention]
+
+
+def DescriptiveText(raw_entity: dict) -> str:
+  ''' Returns the text of the mention best matching a raw entity group, or empty if none.
+
+    A pronoun, e.g. "it" in a group with "AWS Comprehend", gives way to the
+    longest other mention of the group.
+  '''
+  if raw_entity.get('DescriptiveMentionIndex'):
+    # Able to find a descriptive mention index best matching this entity group.
+    description_index = raw_entity['DescriptiveMentionIndex'][0]
+    text = raw_entity['Mentions'][description_index]['Text']
+    if text.lower() in _PRONOUNS:
+      text = max((mention['Text']
+                  for mention in raw_entity['Mentions']
+                  if mention['Text'].lower() not in _PRONOUNS),
+                 key=len,
+                 default=text)
+    return text
+  return ''
@@ -5,13 +5,13 @@
 import dataclasses
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Sentiment:
   score: float  # [-1 (negative), 1 (positive)].
   magnitude: float  # [0 (week), inf (strong)). Sentiment strength.
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class GcpEntity:
   name: str
   salience: float  # [0 (less relevant), 1 (highly relevent)]. The relevance of the entity to the entire text.
@@ -3,6 +3,16 @@ from typing import Optional
 import enum
 import dataclasses
 import json
+import math
+
+try:
+  import orjson
+except ImportError:  # Optional, responses then use the hand-rolled encoder.
+  orjson = None
+
+# Serializes the numpy floats some normalizers may produce.
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+_EncodeString = json.encoder.encode_basestring_ascii
 
 
 class Sentiment(enum.Enum):
@@ -12,32 +22,162 @@ class Sentiment(enum.Enum):
   Neutral = 3  # Sentiment is neutral or mixed.
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Entity:
   text: str
-  aws_score: Optional[float] = None  # [-1 (negative), 1 (positive)]
-  gcp_score: Optional[float] = None  # [-1 (negative), 1 (positive)]
+  # Score of each provider which found the entity, by provider name.
+  scores: dict[str, float] = dataclasses.field(
+      default_factory=dict)  # [-1 (negative), 1 (positive)]
   overall_sentiment: Optional[Sentiment] = None
 
-  def to_dict(self) -> dict:
-    obj = dataclasses.asdict(self)
-    obj['overall_sentiment'] = self.overall_sentiment.name if self.overall_sentiment else None
+  def _FlatScores(self, providers) -> dict[str, float | None]:
+    ''' Returns the score of every provider, None for those which did not find the entity. '''
+    return {
+        provider: self.scores.get(provider)
+        for provider in dict.fromkeys([*providers, *self.scores])
+    }
 
+  def to_dict(self, providers=()) -> dict:
+    ''' Returns the entity with flat <provider>_score keys, null for the providers which did not find it. '''
+    # Built by hand, dataclasses.asdict deep-copies recursively.
+    sentiment = self.overall_sentiment
+    obj = {
+        'text': self.text,
+        'scores': dict(self.scores),
+        'overall_sentiment': sentiment.name if sentiment else None,
+    }
+    # Flat <provider>_score keys, as served before providers were pluggable.
+    for provider, score in self._FlatScores(providers).items():
+      obj[f'{provider}_score'] = score
     return obj
 
+  def _encode(self, providers=()) -> str:
+    ''' Returns the JSON of to_dict(providers), without building it. '''
+    sentiment = self.overall_sentiment
+    scores = ','.join(f'{_EncodeString(provider)}:{_EncodeFloat(score)}'
+                      for provider, score in self.scores.items())
+    flat_scores = ''.join(
+        f',{_EncodeString(provider + "_score")}:'
+        f'{"null" if score is None else _EncodeFloat(score)}'
+        for provider, score in self._FlatScores(providers).items())
+    return (f'{{"text":{_EncodeString(self.text)},"scores":{{{scores}}},'
+            f'"overall_sentiment":'
+            f'{_EncodeString(sentiment.name) if sentiment else "null"}'
+            f'{flat_scores}}}')
+
+  @classmethod
+  def from_dict(cls, obj: dict) -> 'Entity':
+    scores = obj.get('scores')
+    if scores is None:
+      scores = {
+          key[:-len('_score')]: value
+          for key, value in obj.items()
+          if key.endswith('_score') and value is not None
+      }
+    return cls(text=obj['text'],
+               scores=dict(scores),
+               overall_sentiment=Sentiment[obj['overall_sentiment']]
+               if obj.get('overall_sentiment') else None)
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True)
 class MergedNlpEntities:
   common_entities: list[Entity]  # Entities occured in ALL NLP analysis tools.
   entities: list[Entity]  # Entities occured in ANY NLP analysis tool.
+  partial: bool = False  # True if some NLP analysis tool failed to respond.
+  # Names of the providers texts were analyzed with, each serialized as a flat
+  # <provider>_score key of every entity.
+  providers: list[str] = dataclasses.field(default_factory=list, compare=False)
+
+  def _entity_objects(self, encode) -> tuple[list, list]:
+    ''' Returns encode() of common entities and of entities, encoding each entity once.
+
+      Common entities are usually the same objects as their counterparts in
+      entities, see nlp_client.MergeEntities.
+    '''
+    encoded = {id(entity): encode(entity) for entity in self.entities}
+    return ([
+        encoded.get(id(entity)) or encode(entity)
+        for entity in self.common_entities
+    ], [encoded[id(entity)] for entity in self.entities])
 
   def to_dict(self) -> dict:
+    common_entities, entities = self._entity_objects(
+        lambda entity: entity.to_dict(self.providers))
     return {
-        'common_entities': [
-            entity.to_dict() for entity in self.common_entities
-        ],
-        'entities': [entity.to_dict() for entity in self.entities]
+        'common_entities': common_entities,
+        'entities': entities,
+        'partial': self.partial,
     }
 
+  def _encode(self) -> str:
+    common_entities, entities = self._entity_objects(
+        lambda entity: entity._encode(self.providers))
+    return (f'{{"common_entities":[{",".join(common_entities)}],'
+            f'"entities":[{",".join(entities)}],'
+            f'"partial":{"true" if self.partial else "false"}}}')
+
+  @classmethod
+  def from_dict(cls, obj: dict) -> 'MergedNlpEntities':
+    entities = [Entity.from_dict(entity) for entity in obj['entities']]
+    # Common entities are the same objects as their counterparts in entities.
+    text_to_entity = {entity.text: entity for entity in entities}
+    # Every entity has the flat score keys of all providers.
+    providers = [
+        key[:-len('_score')]
+        for key in (obj['entities'][0] if obj['entities'] else ())
+        if key.endswith('_score')
+    ]
+    return cls(common_entities=[
+        text_to_entity[entity['text']] for entity in obj['common_entities']
+    ],
+               entities=entities,
+               partial=obj.get('partial', False),
+               providers=providers)
+
+  def to_json_bytes(self) -> bytes:
+    ''' Returns the UTF-8 JSON of to_dict(), with orjson if installed. '''
+    if orjson:
+      return orjson.dumps(self.to_dict(), option=_ORJSON_OPTIONS)
+    return self._encode().encode('utf-8')
+
   def to_json(self) -> str:
-    return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+    return self.to_json_bytes().decode('utf-8')
+
+
+@dataclasses.dataclass(slots=True)
+class BatchItemResult:
+  ''' Result of one text in a batch, either merged entities or an error. '''
+  result: Optional[MergedNlpEntities] = None
+  error: Optional[str] = None
+
+  def to_dict(self) -> dict:
+    return {
+        'result': self.result.to_dict() if self.result else None,
+        'error': self.error,
+    }
+
+  @classmethod
+  def from_dict(cls, obj: dict) -> 'BatchItemResult':
+    return cls(result=MergedNlpEntities.from_dict(obj['result'])
+               if obj.get('result') else None,
+               error=obj.get('error'))
+
+  def _encode(self) -> str:
+    result = self.result._encode() if self.result else 'null'
+    error = _EncodeString(self.error) if self.error is not None else 'null'
+    return f'{{"result":{result},"error":{error}}}'
+
+
+def _EncodeFloat(value: float) -> str:
+  # As orjson, which has no representation of NaN and infinities either.
+  return float.__repr__(value) if math.isfinite(value) else 'null'
+
+
+def EncodeBatchResults(items: list[BatchItemResult]) -> bytes:
+  ''' Returns the UTF-8 JSON of a batch response, {"results": [item.to_dict(), ...]}. '''
+  if orjson:
+    return orjson.dumps({'results': [item.to_dict() for item in items]},
+                        option=_ORJSON_OPTIONS)
+  return f'{{"results":[{",".join(item._encode() for item in items)}]}}'.encode(
+      'utf-8')
@@ -0,0 +1,78 @@
+import json
+import unittest
+
+from datatypes import nlp_client_types
+
+
+def _MergedEntities():
+  common_entity = nlp_client_types.Entity(
+      text='café "crème"',
+      scores={
+          'aws': 0.5,
+          'gcp': -0.25
+      },
+      overall_sentiment=nlp_client_types.Sentiment.Positive)
+  return nlp_client_types.MergedNlpEntities(common_entities=[common_entity],
+                                            entities=[
+                                                common_entity,
+                                                nlp_client_types.Entity(
+                                                    text='tea',
+                                                    scores={'aws': 0.1})
+                                            ],
+                                            partial=True,
+                                            providers=['aws', 'gcp'])
+
+
+class EncodingTest(unittest.TestCase):
+
+  def test_encoders_match_to_dict(self):
+    merged_entities = _MergedEntities()
+
+    self.assertEqual(json.loads(merged_entities.to_json_bytes()),
+                     merged_entities.to_dict())
+    self.assertEqual(json.loads(merged_entities._encode()),
+                     merged_entities.to_dict())
+
+  def test_common_entities_are_encoded_once(self):
+    merged_entities = _MergedEntities()
+
+    obj = merged_entities.to_dict()
+
+    self.assertIs(obj['common_entities'][0], obj['entities'][0])
+
+  def test_single_provider_entities_have_null_flat_scores(self):
+    merged_entities = _MergedEntities()
+
+    for obj in (merged_entities.to_dict(),
+                json.loads(merged_entities.to_json_bytes()),
+                json.loads(merged_entities._encode())):
+      tea = obj['entities'][1]
+      self.assertEqual(tea['aws_score'], 0.1)
+      self.assertIn('gcp_score', tea)
+      self.assertIsNone(tea['gcp_score'])
+      self.assertEqual(tea['scores'], {'aws': 0.1})
+
+  def test_providers_round_trip_through_dict(self):
+    merged_entities = nlp_client_types.MergedNlpEntities.from_dict(
+        _MergedEntities().to_dict())
+
+    self.assertEqual(merged_entities.providers, ['aws', 'gcp'])
+    self.assertEqual(merged_entities.entities[1].scores, {'aws': 0.1})
+
+  def test_non_finite_scores_are_null(self):
+    entity = nlp_client_types.Entity(text='tea', scores={'aws': float('nan')})
+
+    self.assertEqual(json.loads(entity._encode())['aws_score'], None)
+
+  def test_batch_results_encode_results_and_errors(self):
+    items = [
+        nlp_client_types.BatchItemResult(result=_MergedEntities()),
+        nlp_client_types.BatchItemResult(error='text is empty')
+    ]
+
+    self.assertEqual(json.loads(nlp_client_types.EncodeBatchResults(items)),
+                     {'results': [item.to_dict() for item in items]})
+    self.assertEqual(
+        json.loads(''.join(
+            ['[', items[0]._encode(), ',', items[1]._encode(), ']'])),
+        [item.to_dict() for item in items])
@@ -0,0 +1,40 @@
+'''
+  Gunicorn settings of the production server, overridable through environment variables.
+'''
+import glob
+import multiprocessing
+import os
+import sys
+import tempfile
+
+bind = '0.0.0.0:8080'
+workers = int(os.environ.get('workers', multiprocessing.cpu_count()))
+# Read by service.ServiceConfig.FromEnv in each worker.
+os.environ['serving_processes'] = str(workers)
+# Each worker keeps its own metrics, summed over this directory on /metrics.
+if workers > 1:
+  os.environ.setdefault('metrics_dir', tempfile.mkdtemp(prefix='metrics_'))
+# Request threads mostly wait on provider calls, so each worker runs several.
+worker_class = 'gthread'
+threads = int(os.environ.get('threads', 8))
+# Seconds a worker has to finish in-flight requests after SIGTERM.
+graceful_timeout = int(os.environ.get('graceful_timeout', 30))
+timeout = int(os.environ.get('timeout', 60))
+# Build clients after forking, never share gRPC channels across processes.
+preload_app = False
+
+
+def on_starting(server):
+  ''' Drops metric snapshots of a previous run of the server. '''
+  metrics_dir = os.environ.get('metrics_dir')
+  if not metrics_dir:
+    return
+  for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+    os.remove(path)
+
+
+def worker_exit(server, worker):
+  ''' Flushes the pending state of the exiting worker. '''
+  wsgi = sys.modules.get('wsgi')
+  if wsgi is not None:
+    wsgi.state.Close()
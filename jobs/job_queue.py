@@ -0,0 +1,357 @@
+'''
+  Queues of analysis jobs, and the store of their results until they are polled.
+  A job is queued by priority then submission time, taken by one worker and saved back once finished. MemoryJobQueue serves a single process; SqliteJobQueue is shared by all processes of a server, so a job can be polled from any of them.
+'''
+from datatypes import nlp_client_types
+import collections
+import dataclasses
+import heapq
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+# Priorities, by rank in the queue.
+HIGH = 'high'
+NORMAL = 'normal'
+LOW = 'low'
+PRIORITIES = {HIGH: 0, NORMAL: 1, LOW: 2}
+
+# Put() result when max_depth jobs are already queued.
+FULL = 'full'
+
+# Statuses.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+  id TEXT PRIMARY KEY,
+  priority INTEGER NOT NULL,
+  status TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  finished_at REAL,
+  job TEXT NOT NULL,
+  -- When the worker running the job is presumed dead.
+  leased_until REAL,
+  attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS queued_jobs ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS finished_jobs ON jobs (finished_at);
+'''
+
+
+@dataclasses.dataclass(slots=True)
+class Job:
+  id: str
+  texts: list[str]
+  # Result of each text, None until analyzed.
+  items: list[nlp_client_types.BatchItemResult | None]
+  # Indices of the texts left to analyze, i.e. neither invalid nor cached.
+  pending: list[int]
+  priority: str = NORMAL
+  status: str = QUEUED
+  # Why the job failed, if it did.
+  error: str | None = None
+  # URL the finished job is POSTed to, if any.
+  callback_url: str | None = None
+  created_at: float = 0
+  finished_at: float | None = None
+
+  @classmethod
+  def New(cls,
+          texts: list[str],
+          items: list[nlp_client_types.BatchItemResult | None],
+          priority: str = NORMAL,
+          callback_url: str | None = None) -> 'Job':
+    ''' Returns a queued job analyzing the texts without an item, or a done one if there are none. '''
+    pending = [index for index, item in enumerate(items) if item is None]
+    now = time.time()
+    return cls(id=uuid.uuid4().hex,
+               texts=texts,
+               items=items,
+               pending=pending,
+               priority=priority,
+               status=QUEUED if pending else DONE,
+               callback_url=callback_url,
+               created_at=now,
+               finished_at=None if pending else now)
+
+  @property
+  def finished(self) -> bool:
+    return self.status in (DONE, FAILED)
+
+  def to_dict(self) -> dict:
+    obj = dataclasses.asdict(self)
+    obj['items'] = [item.to_dict() if item else None for item in self.items]
+    return obj
+
+  @classmethod
+  def from_dict(cls, obj: dict) -> 'Job':
+    return cls(
+        **{
+            **obj, 'items': [
+                nlp_client_types.BatchItemResult.
+                from_dict(item) if item else None for item in obj['items']
+            ]
+        })
+
+  def Status(self) -> dict:
+    ''' Returns what a poll of the job answers, with the results once done. '''
+    obj = {
+        'id': self.id,
+        'status': self.status,
+        'priority': self.priority,
+        'created_at': self.created_at,
+        'finished_at': self.finished_at,
+    }
+    if self.status == DONE:
+      obj['results'] = [item.to_dict() for item in self.items]
+    if self.error is not None:
+      obj['error'] = self.error
+    return obj
+
+
+class MemoryJobQueue:
+  ''' Queue and results of the jobs of this process.
+
+    Results expire result_ttl_seconds after their job finished.
+  '''
+
+  def __init__(self,
+               max_depth: int,
+               result_ttl_seconds: float,
+               clock=time.time):
+    self.max_depth = max_depth
+    self.result_ttl_seconds = result_ttl_seconds
+    self._clock = clock
+    self._condition = threading.Condition()
+    self._queued = []  # Heap of (priority rank, sequence number, job id).
+    self._sequence = itertools.count()
+    self._jobs = {}
+    self._finished = collections.deque()  # (finished_at, job id) in order.
+
+  def Depth(self) -> int:
+    ''' Number of queued jobs. '''
+    with self._condition:
+      return len(self._queued)
+
+  def Put(self, job: Job, admit=None) -> str | None:
+    ''' Queues job, or returns why not: FULL if max_depth jobs are already queued.
+
+      admit, if given, is called once the queue has room for job, in the same
+      step as queuing it. It returns a decision rejecting the job, which is
+      then returned without queuing, or None.
+    '''
+    with self._condition:
+      if len(self._queued) >= self.max_depth:
+        return FULL
+      rejection = admit() if admit else None
+      if rejection:
+        return rejection
+      self._ExpireLocked()
+      self._jobs[job.id] = job
+      heapq.heappush(self._queued,
+                     (PRIORITIES[job.priority], next(self._sequence), job.id))
+      self._condition.notify()
+    return None
+
+  def Take(self, timeout_seconds: float) -> Job | None:
+    ''' Returns the first queued job, now running, or None if none was queued within timeout_seconds. '''
+    with self._condition:
+      if not self._condition.wait_for(lambda: self._queued, timeout_seconds):
+        return None
+      _, _, job_id = heapq.heappop(self._queued)
+      job = self._jobs[job_id]
+      job.status = RUNNING
+      return job
+
+  def Save(self, job: Job):
+    ''' Stores a finished job until its result expires. '''
+    with self._condition:
+      self._ExpireLocked()
+      self._jobs[job.id] = job
+      self._finished.append((job.finished_at, job.id))
+
+  def Get(self, job_id: str) -> Job | None:
+    with self._condition:
+      self._ExpireLocked()
+      return self._jobs.get(job_id)
+
+  def Close(self):
+    pass
+
+  def _ExpireLocked(self):
+    expired_before = self._clock() - self.result_ttl_seconds
+    while self._finished and self._finished[0][0] <= expired_before:
+      _, job_id = self._finished.popleft()
+      self._jobs.pop(job_id, None)
+
+
+class SqliteJobQueue:
+  ''' Queue and results of jobs in a SQLite database, which the processes of a server share.
+
+    Workers of other processes find new jobs by polling the database. A taken job
+    is leased for lease_seconds, which must outlast any run: once the lease
+    expires its worker is presumed dead and the job is queued again, or failed
+    after max_attempts runs.
+  '''
+
+  def __init__(self,
+               path: str,
+               max_depth: int,
+               result_ttl_seconds: float,
+               poll_seconds: float = 0.5,
+               lease_seconds: float = 600,
+               max_attempts: int = 2,
+               clock=time.time):
+    self.path = path
+    self.max_depth = max_depth
+    self.result_ttl_seconds = result_ttl_seconds
+    self.poll_seconds = poll_seconds
+    self.lease_seconds = lease_seconds
+    self.max_attempts = max_attempts
+    self._clock = clock
+    self._connection = sqlite3.connect(path,
+                                       timeout=30,
+                                       check_same_thread=False,
+                                       isolation_level=None)
+    self._lock = threading.Lock()
+    # Wakes the workers of this process when a job is queued.
+    self._queued = threading.Condition()
+    with self._lock:
+      if path != ':memory:':
+        self._connection.execute('PRAGMA journal_mode=WAL')
+      self._connection.executescript(_SCHEMA)
+
+  def Depth(self) -> int:
+    with self._lock:
+      return self._connection.execute(
+          'SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+
+  def Put(self, job: Job, admit=None) -> str | None:
+    ''' See MemoryJobQueue.Put, admit is called in the queuing transaction. '''
+    with self._lock:
+      connection = self._connection
+      connection.execute('BEGIN IMMEDIATE')
+      try:
+        depth = connection.execute('SELECT COUNT(*) FROM jobs WHERE status = ?',
+                                   (QUEUED,)).fetchone()[0]
+        rejection = FULL if depth >= self.max_depth else (
+            admit() if admit else None)
+        if rejection:
+          connection.execute('ROLLBACK')
+          return rejection
+        self._ExpireLocked()
+        connection.execute(
+            '''INSERT INTO jobs (id, priority, status, created_at, finished_at,
+                                 job) VALUES (?, ?, ?, ?, ?, ?)''',
+            (job.id, PRIORITIES[job.priority], job.status, job.created_at,
+             job.finished_at, json.dumps(job.to_dict())))
+      except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+      connection.execute('COMMIT')
+    with self._queued:
+      self._queued.notify()
+    return None
+
+  def Take(self, timeout_seconds: float) -> Job | None:
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+      with self._lock:
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+          now = self._clock()
+          self._RecoverLocked(now)
+          row = connection.execute(
+              '''UPDATE jobs SET status = ?, leased_until = ?,
+                                 attempts = attempts + 1
+                 WHERE id = (SELECT id FROM jobs WHERE status = ?
+                             ORDER BY priority, created_at LIMIT 1)
+                 RETURNING job''',
+              (RUNNING, now + self.lease_seconds, QUEUED)).fetchone()
+        except BaseException:
+          connection.execute('ROLLBACK')
+          raise
+        connection.execute('COMMIT')
+      if row is not None:
+        job = Job.from_dict(json.loads(row[0]))
+        job.status = RUNNING
+        return job
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return None
+      with self._queued:
+        self._queued.wait(min(remaining, self.poll_seconds))
+
+  def Save(self, job: Job):
+    with self._lock:
+      self._ExpireLocked()
+      self._connection.execute(
+          '''INSERT OR REPLACE INTO jobs (id, priority, status, created_at,
+                                          finished_at, job)
+             VALUES (?, ?, ?, ?, ?, ?)''',
+          (job.id, PRIORITIES[job.priority], job.status, job.created_at,
+           job.finished_at, json.dumps(job.to_dict())))
+
+  def Get(self, job_id: str) -> Job | None:
+    with self._lock:
+      row = self._connection.execute(
+          'SELECT status, finished_at, job FROM jobs WHERE id = ?',
+          (job_id,)).fetchone()
+    if row is None:
+      return None
+    status, finished_at, job = row
+    if finished_at is not None and (finished_at
+                                    <= self._clock() - self.result_ttl_seconds):
+      return None
+    job = Job.from_dict(json.loads(job))
+    # Taking a job only updates its status column.
+    job.status = status
+    return job
+
+  def _RecoverLocked(self, now: float):
+    ''' Queues again, or fails, the running jobs whose lease expired. '''
+    expired = self._connection.execute(
+        '''SELECT id, attempts, job FROM jobs
+           WHERE status = ? AND leased_until <= ?''',
+        (RUNNING, now)).fetchall()
+    for job_id, attempts, job in expired:
+      if attempts < self.max_attempts:
+        self._connection.execute(
+            'UPDATE jobs SET status = ?, leased_until = NULL WHERE id = ?',
+            (QUEUED, job_id))
+        continue
+      job = Job.from_dict(json.loads(job))
+      job.status = FAILED
+      job.error = 'Job worker was lost'
+      job.finished_at = now
+      self._connection.execute(
+          '''UPDATE jobs SET status = ?, finished_at = ?, leased_until = NULL,
+                             job = ? WHERE id = ?''',
+          (FAILED, now, json.dumps(job.to_dict()), job_id))
+
+  def _ExpireLocked(self):
+    self._connection.execute('DELETE FROM jobs WHERE finished_at <= ?',
+                             (self._clock() - self.result_ttl_seconds,))
+
+  def Close(self):
+    with self._lock:
+      self._connection.close()
+
+
+def NewJobQueue(spec: str, max_depth: int,
+                result_ttl_seconds: float) -> MemoryJobQueue | SqliteJobQueue:
+  ''' Returns the queue of spec: "memory" or "sqlite:<path>". '''
+  if spec == 'memory':
+    return MemoryJobQueue(max_depth, result_ttl_seconds)
+  if spec.startswith('sqlite:'):
+    return SqliteJobQueue(spec[len('sqlite:'):], max_depth, result_ttl_seconds)
+  raise ValueError(f'Invalid job queue {spec}, expected memory or '
+                   'sqlite:<path>.')
@@ -0,0 +1,161 @@
+import unittest
+
+from datatypes import nlp_client_types
+from jobs import job_queue
+
+
+def _Result(text):
+  entity = nlp_client_types.Entity(text=text, scores={'aws': 0.5})
+  return nlp_client_types.BatchItemResult(
+      result=nlp_client_types.MergedNlpEntities(common_entities=[entity],
+                                                entities=[entity]))
+
+
+class _Clock:
+
+  def __init__(self):
+    self.now = 1000
+
+  def __call__(self):
+    return self.now
+
+
+class JobTest(unittest.TestCase):
+
+  def test_new_job_without_pending_texts_is_done(self):
+    job = job_queue.Job.New(['a'], [_Result('a')])
+    self.assertEqual(job.status, job_queue.DONE)
+    self.assertEqual(job.pending, [])
+    self.assertIsNotNone(job.finished_at)
+
+  def test_round_trips_through_dict(self):
+    job = job_queue.Job.New(['a', 'b', ''], [
+        _Result('a'), None,
+        nlp_client_types.BatchItemResult(error='text is empty')
+    ],
+                            priority=job_queue.HIGH)
+    self.assertEqual(job.pending, [1])
+    self.assertEqual(job_queue.Job.from_dict(job.to_dict()), job)
+
+  def test_status_holds_results_once_done(self):
+    job = job_queue.Job.New(['a', 'b'], [_Result('a'), None])
+    self.assertNotIn('results', job.Status())
+    job.items[1] = _Result('b')
+    job.status = job_queue.DONE
+    self.assertEqual([
+        item['result']['entities'][0]['text']
+        for item in job.Status()['results']
+    ], ['a', 'b'])
+
+
+class _JobQueueTests:
+  ''' Tests shared by all queues, which NewQueue() builds. '''
+
+  def NewQueue(self, max_depth=10, result_ttl_seconds=60):
+    raise NotImplementedError
+
+  def test_takes_by_priority_then_submission(self):
+    queue = self.NewQueue()
+    jobs = []
+    for priority in (job_queue.LOW, job_queue.NORMAL, job_queue.HIGH,
+                     job_queue.NORMAL):
+      job = job_queue.Job.New(['text'], [None], priority=priority)
+      jobs.append(job)
+      self.assertIsNone(queue.Put(job))
+    self.assertEqual(queue.Depth(), 4)
+
+    taken = [queue.Take(0).id for _ in range(4)]
+
+    self.assertEqual(taken, [jobs[2].id, jobs[1].id, jobs[3].id, jobs[0].id])
+    self.assertEqual(queue.Get(jobs[0].id).status, job_queue.RUNNING)
+    self.assertEqual(queue.Depth(), 0)
+    self.assertIsNone(queue.Take(0))
+
+  def test_rejects_jobs_beyond_max_depth(self):
+    queue = self.NewQueue(max_depth=1)
+    self.assertIsNone(queue.Put(job_queue.Job.New(['a'], [None])))
+    self.assertEqual(queue.Put(job_queue.Job.New(['b'], [None])),
+                     job_queue.FULL)
+    queue.Take(0)
+    self.assertIsNone(queue.Put(job_queue.Job.New(['b'], [None])))
+
+  def test_admits_only_jobs_with_room(self):
+    queue = self.NewQueue(max_depth=1)
+    admitted = []
+
+    def Admit(rejection=None):
+      admitted.append(rejection)
+      return rejection
+
+    rejected = job_queue.Job.New(['a'], [None])
+    self.assertEqual(queue.Put(rejected, admit=lambda: Admit('shed')), 'shed')
+    self.assertIsNone(queue.Get(rejected.id))
+    self.assertIsNone(queue.Put(job_queue.Job.New(['b'], [None]), admit=Admit))
+    self.assertEqual(queue.Put(job_queue.Job.New(['c'], [None]), admit=Admit),
+                     job_queue.FULL)
+    self.assertEqual(admitted, ['shed', None])
+    self.assertEqual(queue.Depth(), 1)
+
+  def test_saved_results_expire(self):
+    queue = self.NewQueue(result_ttl_seconds=60)
+    job = job_queue.Job.New(['a'], [None])
+    queue.Put(job)
+    job = queue.Take(0)
+    job.items = [_Result('a')]
+    job.status = job_queue.DONE
+    job.finished_at = self.clock.now
+    queue.Save(job)
+
+    self.clock.now += 59
+    self.assertEqual(queue.Get(job.id), job)
+    self.clock.now += 1
+    self.assertIsNone(queue.Get(job.id))
+    self.assertIsNone(queue.Get('unknown'))
+
+
+class MemoryJobQueueTest(_JobQueueTests, unittest.TestCase):
+
+  def NewQueue(self, max_depth=10, result_ttl_seconds=60):
+    self.clock = _Clock()
+    return job_queue.MemoryJobQueue(max_depth,
+                                    result_ttl_seconds,
+                                    clock=self.clock)
+
+
+class SqliteJobQueueTest(_JobQueueTests, unittest.TestCase):
+
+  def NewQueue(self, max_depth=10, result_ttl_seconds=60):
+    self.clock = _Clock()
+    queue = job_queue.SqliteJobQueue(':memory:',
+                                     max_depth,
+                                     result_ttl_seconds,
+                                     clock=self.clock)
+    self.addCleanup(queue.Close)
+    return queue
+
+  def test_requeues_jobs_whose_lease_expired(self):
+    queue = self.NewQueue()
+    queue.lease_seconds = 60
+    job = job_queue.Job.New(['a'], [None])
+    queue.Put(job)
+    self.assertEqual(queue.Take(0).id, job.id)
+
+    self.clock.now += 59
+    self.assertIsNone(queue.Take(0))
+    self.clock.now += 1
+    self.assertEqual(queue.Take(0).id, job.id)
+    self.assertEqual(queue.Get(job.id).status, job_queue.RUNNING)
+
+    self.clock.now += 60
+    self.assertIsNone(queue.Take(0))
+    failed = queue.Get(job.id)
+    self.assertEqual(failed.status, job_queue.FAILED)
+    self.assertEqual(failed.error, 'Job worker was lost')
+    self.assertEqual(failed.finished_at, self.clock.now)
+
+
+class NewJobQueueTest(unittest.TestCase):
+
+  def test_rejects_unknown_queue(self):
+    with self.assertRaises(ValueError):
+      job_queue.NewJobQueue('kafka://queue', 10, 60)
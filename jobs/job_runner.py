@@ -0,0 +1,177 @@
+'''
+  Worker pool running queued analysis jobs, so that large workloads never hold a request thread.
+  Each worker takes the first job of the queue by priority, analyzes its pending texts in one batch and saves the results for polling, then optionally POSTs them to the callback URL of the job.
+'''
+from jobs import job_queue
+from monitoring import metrics
+import ipaddress
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+_JOBS = metrics.Counter('jobs_total', 'Jobs run, by status.', ('status',))
+_JOB_WAIT_SECONDS = metrics.Histogram(
+    'job_wait_seconds',
+    'Seconds jobs were queued before running.',
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+_JOB_RUN_SECONDS = metrics.Histogram('job_run_seconds',
+                                     'Seconds jobs ran.',
+                                     buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300,
+                                              900, 3600))
+_WEBHOOKS = metrics.Counter('job_webhooks_total',
+                            'Callbacks of finished jobs, by outcome.',
+                            ('outcome',))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+  ''' Fails on redirects, which could lead a callback to a private address. '''
+
+  def redirect_request(self, req, fp, code, msg, headers, newurl):
+    return None
+
+
+_OPENER = urllib.request.build_opener(_NoRedirect)
+
+
+def PostJson(url: str, body: bytes, timeout_seconds: float):
+  ''' POSTs a JSON body to url, raising on failure or redirect. '''
+  request = urllib.request.Request(url,
+                                   data=body,
+                                   headers={'Content-Type': 'application/json'},
+                                   method='POST')
+  with _OPENER.open(request, timeout=timeout_seconds):
+    pass
+
+
+def IsPublicUrl(url: str, resolve=socket.getaddrinfo) -> bool:
+  ''' Whether url is http(s) to a host whose addresses are all public.
+
+    Rejects loopback, private, link-local, reserved and multicast addresses, so
+    that callbacks cannot reach the network of the server. Hosts that do not
+    resolve are rejected too.
+  '''
+  try:
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+      return False
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    infos = resolve(parts.hostname, port, proto=socket.IPPROTO_TCP)
+  except (ValueError, OSError):
+    return False
+  if not infos:
+    return False
+  for info in infos:
+    address = ipaddress.ip_address(info[4][0].split('%')[0])
+    if address.version == 6 and address.ipv4_mapped:
+      address = address.ipv4_mapped
+    if not address.is_global or address.is_multicast:
+      return False
+  return True
+
+
+class JobRunner:
+  ''' Runs the jobs of a queue on worker threads.
+
+    analyze maps texts to their BatchItemResult in order, e.g.
+    Service.AnalyzeTexts. A job whose analysis raises fails as a whole; errors
+    of single texts are items of a done job. Callbacks are best effort: a
+    failed POST is logged, the job can still be polled. Only public URLs are
+    called back, see IsPublicUrl.
+  '''
+
+  def __init__(self,
+               queue,
+               analyze,
+               workers: int,
+               webhooks: bool = False,
+               post=PostJson,
+               webhook_timeout_seconds: float = 10,
+               poll_seconds: float = 1,
+               resolve=socket.getaddrinfo):
+    self.queue = queue
+    self.analyze = analyze
+    self.workers = workers
+    self.webhooks = webhooks
+    self.post = post
+    self.webhook_timeout_seconds = webhook_timeout_seconds
+    self.poll_seconds = poll_seconds
+    self.resolve = resolve
+    self._stopped = threading.Event()
+    self._threads = []
+
+  def Start(self):
+    self._threads = [
+        threading.Thread(target=self._Run,
+                         name=f'job_worker_{index}',
+                         daemon=True) for index in range(self.workers)
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def Close(self):
+    ''' Stops the workers once their current job, if any, is finished.
+
+      Jobs still queued stay in the queue: a shared queue hands them to
+      workers of other processes, a memory queue drops them.
+    '''
+    self._stopped.set()
+    for thread in self._threads:
+      thread.join()
+
+  def _Run(self):
+    while not self._stopped.is_set():
+      try:
+        job = self.queue.Take(self.poll_seconds)
+      except Exception as e:
+        logging.warning('Failed to take a job: %s', e)
+        self._stopped.wait(self.poll_seconds)
+        continue
+      if job is not None:
+        self.RunJob(job)
+
+  def RunJob(self, job: job_queue.Job):
+    ''' Analyzes the pending texts of a taken job, then saves and calls back. '''
+    started_at = time.time()
+    _JOB_WAIT_SECONDS.Observe(max(0, started_at - job.created_at))
+    try:
+      items = self.analyze([job.texts[index] for index in job.pending])
+      for index, item in zip(job.pending, items):
+        job.items[index] = item
+      job.pending = []
+      job.status = job_queue.DONE
+    except Exception as e:
+      logging.warning('Job %s failed: %s', job.id, e)
+      job.status = job_queue.FAILED
+      job.error = 'Internal error'
+    job.finished_at = time.time()
+    _JOB_RUN_SECONDS.Observe(job.finished_at - started_at)
+    _JOBS.Inc(job.status)
+    self.queue.Save(job)
+    if self.webhooks and job.callback_url:
+      self.CallBack(job)
+
+  def AcceptsCallback(self, url: str) -> bool:
+    ''' Whether a job may name url as its callback URL. '''
+    return self.webhooks and IsPublicUrl(url, self.resolve)
+
+  def CallBack(self, job: job_queue.Job):
+    ''' POSTs the status of a finished job to its callback URL.
+
+      The URL is checked again, since its host may resolve elsewhere by now.
+    '''
+    if not IsPublicUrl(job.callback_url, self.resolve):
+      _WEBHOOKS.Inc('refused')
+      logging.warning('Refused to call back job %s: not a public URL', job.id)
+      return
+    try:
+      self.post(job.callback_url,
+                json.dumps(job.Status()).encode('utf-8'),
+                self.webhook_timeout_seconds)
+      _WEBHOOKS.Inc('sent')
+    except Exception as e:
+      _WEBHOOKS.Inc('failed')
+      logging.warning('Failed to call back job %s: %s', job.id, e)
@@ -0,0 +1,148 @@
+import json
+import socket
+import time
+import unittest
+
+from datatypes import nlp_client_types
+from jobs import job_queue, job_runner
+
+
+def _Analyze(texts):
+  return [
+      nlp_client_types.BatchItemResult(
+          result=nlp_client_types.MergedNlpEntities(
+              common_entities=[], entities=[nlp_client_types.Entity(
+                  text=text)])) for text in texts
+  ]
+
+
+def _Fail(texts):
+  raise RuntimeError('provider down')
+
+
+def _Resolver(addresses):
+  ''' Returns a getaddrinfo resolving each host to its addresses. '''
+
+  def Resolve(host, port, proto=0):
+    if host not in addresses:
+      raise socket.gaierror('unknown host')
+    return [(socket.AF_INET, socket.SOCK_STREAM, proto, '', (address, port))
+            for address in addresses[host]]
+
+  return Resolve
+
+
+class IsPublicUrlTest(unittest.TestCase):
+
+  def test_accepts_http_urls_of_public_hosts(self):
+    resolve = _Resolver({'hook': ['93.184.216.34']})
+    self.assertTrue(job_runner.IsPublicUrl('https://hook/done', resolve))
+    self.assertTrue(job_runner.IsPublicUrl('http://hook:8080/done', resolve))
+
+  def test_rejects_private_and_loopback_addresses(self):
+    resolve = _Resolver({
+        'localhost': ['127.0.0.1'],
+        'metadata': ['169.254.169.254'],
+        'internal': ['10.0.0.5'],
+        'lan': ['192.168.1.1'],
+        'mapped': ['::ffff:127.0.0.1'],
+        'mixed': ['93.184.216.34', '172.16.0.1'],
+    })
+    for url in ('http://localhost/', 'http://metadata/latest',
+                'http://internal/', 'http://lan/', 'http://mapped/',
+                'http://mixed/'):
+      self.assertFalse(job_runner.IsPublicUrl(url, resolve), url)
+
+  def test_rejects_other_schemes_and_unknown_hosts(self):
+    resolve = _Resolver({'hook': ['93.184.216.34']})
+    for url in ('ftp://hook/', 'file:///etc/passwd', 'http://unknown/',
+                'http://hook:port/', 'http:///'):
+      self.assertFalse(job_runner.IsPublicUrl(url, resolve), url)
+
+
+class JobRunnerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.queue = job_queue.MemoryJobQueue(max_depth=10, result_ttl_seconds=60)
+    self.posts = []
+
+  def _Post(self, url, body, timeout_seconds):
+    self.posts.append((url, json.loads(body)))
+
+  def test_analyzes_pending_texts_only(self):
+    analyzed = []
+
+    def Analyze(texts):
+      analyzed.extend(texts)
+      return _Analyze(texts)
+
+    cached = _Analyze(['a'])[0]
+    job = job_queue.Job.New(['a', 'b'], [cached, None])
+    runner = job_runner.JobRunner(self.queue, Analyze, workers=1)
+
+    runner.RunJob(job)
+
+    self.assertEqual(analyzed, ['b'])
+    job = self.queue.Get(job.id)
+    self.assertEqual(job.status, job_queue.DONE)
+    self.assertEqual([item.result.entities[0].text for item in job.items],
+                     ['a', 'b'])
+
+  def test_failed_analysis_fails_the_job(self):
+    job = job_queue.Job.New(['a'], [None])
+    job_runner.JobRunner(self.queue, _Fail, workers=1).RunJob(job)
+    job = self.queue.Get(job.id)
+    self.assertEqual(job.status, job_queue.FAILED)
+    self.assertEqual(job.Status()['error'], 'Internal error')
+
+  def test_calls_back_finished_jobs_if_enabled(self):
+    job = job_queue.Job.New(['a'], [None], callback_url='http://hook')
+    job_runner.JobRunner(self.queue,
+                         _Analyze,
+                         workers=1,
+                         webhooks=True,
+                         post=self._Post,
+                         resolve=_Resolver({'hook': ['93.184.216.34']
+                                           })).RunJob(job)
+    self.assertEqual(len(self.posts), 1)
+    url, body = self.posts[0]
+    self.assertEqual(url, 'http://hook')
+    self.assertEqual(body['id'], job.id)
+    self.assertEqual(body['status'], job_queue.DONE)
+
+    job = job_queue.Job.New(['a'], [None], callback_url='http://hook')
+    job_runner.JobRunner(self.queue, _Analyze, workers=1,
+                         post=self._Post).RunJob(job)
+    self.assertEqual(len(self.posts), 1)
+
+  def test_refuses_callbacks_to_private_addresses(self):
+    runner = job_runner.JobRunner(self.queue,
+                                  _Analyze,
+                                  workers=1,
+                                  webhooks=True,
+                                  post=self._Post,
+                                  resolve=_Resolver({'hook': ['10.0.0.5']}))
+    self.assertFalse(runner.AcceptsCallback('http://hook/done'))
+
+    job = job_queue.Job.New(['a'], [None], callback_url='http://hook/done')
+    runner.RunJob(job)
+
+    self.assertEqual(self.posts, [])
+    self.assertEqual(self.queue.Get(job.id).status, job_queue.DONE)
+
+  def test_workers_run_queued_jobs(self):
+    runner = job_runner.JobRunner(self.queue,
+                                  _Analyze,
+                                  workers=2,
+                                  poll_seconds=0.01)
+    runner.Start()
+    self.addCleanup(runner.Close)
+    jobs = [job_queue.Job.New([str(index)], [None]) for index in range(5)]
+    for job in jobs:
+      self.queue.Put(job)
+    deadline = time.monotonic() + 5
+    while (time.monotonic() < deadline and
+           any(not self.queue.Get(job.id).finished for job in jobs)):
+      time.sleep(0.01)
+    self.assertTrue(
+        all(self.queue.Get(job.id).status == job_queue.DONE for job in jobs))
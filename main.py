@@ -1,54 +1,621 @@
-import utils
-from clients import nlp_client
+import atexit
+import dataclasses
+import math
+import time
+import service
+from analytics import entity_store
+from bulk import bulk_analyzer
+from cache import result_cache
+from cost import admission
+from datatypes import nlp_client_types
+from jobs import job_queue
+from monitoring import metrics
 import logging
 from absl import flags, app
 import flask
-from cost import cost_controller
-from google.cloud import firestore
 
 _DEBUG = flags.DEFINE_bool('debug', True, 'Debug mode.')
+_PROVIDERS = flags.DEFINE_string(
+    'providers', service.ServiceConfig.providers,
+    'Comma-separated names of the NLP providers to analyze texts with.')
+_MODE = flags.DEFINE_enum(
+    'mode', service.ServiceConfig.mode, ['cloud', 'local', 'local_first'],
+    'cloud: call the providers. local: only the free local lexicon provider. '
+    'local_first: the local provider, escalating to the providers when unsure.')
+_LOCAL_LEXICON_FILE = flags.DEFINE_string(
+    'local_lexicon_file', service.ServiceConfig.local_lexicon_file,
+    'Tab-separated word and valence file of the local provider. Empty for the bundled lexicon.'
+)
+_LOCAL_MIN_POLAR_SCORE = flags.DEFINE_float(
+    'local_min_polar_score', service.ServiceConfig.local_min_polar_score,
+    'Min absolute local score of a positive or negative entity, weaker ones are unsure.'
+)
+_PACK_TEXTS = flags.DEFINE_bool(
+    'pack_texts', service.ServiceConfig.pack_texts,
+    'Whether batches pack short texts into shared provider requests, billed for fewer units.'
+)
+_ENTITY_ALIASES_FILE = flags.DEFINE_string(
+    'entity_aliases_file', service.ServiceConfig.entity_aliases_file,
+    'Tab-separated file of entity aliases and their canonical text, e.g. "Comprehend\tAWS Comprehend".'
+)
+_INCREMENTAL = flags.DEFINE_bool(
+    'incremental', service.ServiceConfig.incremental,
+    'Whether providers analyze texts sentence by sentence, only paying for the changed sentences of resubmitted texts.'
+)
+_INCREMENTAL_CACHE_SIZE = flags.DEFINE_integer(
+    'incremental_cache_size', service.ServiceConfig.incremental_cache_size,
+    'Max number of provider responses to sentences kept in memory.')
+_API_KEYS_FILE = flags.DEFINE_string(
+    'api_keys_file', service.ServiceConfig.api_keys_file,
+    'Tab-separated file of API keys, sent in the X-Api-Key header, and the tenant each authenticates.'
+)
+_TRUST_TENANT_HEADER = flags.DEFINE_bool(
+    'trust_tenant_header', service.ServiceConfig.trust_tenant_header,
+    'Whether requests without an API key are named by their X-Tenant-Id header. Only set it behind a proxy stripping and setting the header.'
+)
+_TRANSPORT = flags.DEFINE_enum(
+    'transport', service.ServiceConfig.transport, ['live', 'record', 'replay'],
+    'live: call the cloud providers. record: call them and record their responses to replay_dir. '
+    'replay: answer from the responses of replay_dir, with a local Firestore, e.g. to load test.'
+)
+_REPLAY_DIR = flags.DEFINE_string(
+    'replay_dir', service.ServiceConfig.replay_dir,
+    'Directory of the recorded provider responses.')
+_REPLAY_LATENCY_SECONDS = flags.DEFINE_float(
+    'replay_latency_seconds', service.ServiceConfig.replay_latency_seconds,
+    'Simulated latency of each replayed provider call.')
+_REPLAY_JITTER_SECONDS = flags.DEFINE_float(
+    'replay_jitter_seconds', service.ServiceConfig.replay_jitter_seconds,
+    'Max random latency added to each replayed provider call.')
+_REPLAY_ERROR_RATE = flags.DEFINE_float(
+    'replay_error_rate', service.ServiceConfig.replay_error_rate,
+    'Share of replayed provider calls failing with a transient error.')
+_BATCH_TIMEOUT_SECONDS = flags.DEFINE_float(
+    'batch_timeout_seconds', service.ServiceConfig.batch_timeout_seconds,
+    'Seconds batches wait for provider calls, e.g. for the rate limiter. Texts whose calls cannot finish in time fail.'
+)
+_TENANTS = flags.DEFINE_string(
+    'tenants', service.ServiceConfig.tenants,
+    'Comma-separated name:priority[:monthly_quota] tenants, with priorities low, normal or high.'
+)
 _AWS_CRED_FILE = flags.DEFINE_string(
-    'aws_cred_file', './key',
+    'aws_cred_file', service.ServiceConfig.aws_cred_file,
     'AWS credential file, with first line of access_key_id, second line of secret_access_key.'
 )
+_CACHE_SIZE = flags.DEFINE_integer(
+    'cache_size', service.ServiceConfig.cache_size,
+    'Max number of results kept in memory. 0 disables the cache.')
+_CACHE_TTL_SECONDS = flags.DEFINE_integer(
+    'cache_ttl_seconds', service.ServiceConfig.cache_ttl_seconds,
+    'Seconds a cached result is valid.')
+_CACHE_DIR = flags.DEFINE_string(
+    'cache_dir', service.ServiceConfig.cache_dir,
+    'Directory of the disk-backed cache tier, if any.')
+_CACHE_FIRESTORE = flags.DEFINE_bool(
+    'cache_firestore', service.ServiceConfig.cache_firestore,
+    'Whether to share cached results across servers through Firestore.')
+_COST_FLUSH_INTERVAL_SECONDS = flags.DEFINE_float(
+    'cost_flush_interval_seconds',
+    service.ServiceConfig.cost_flush_interval_seconds,
+    'Seconds between flushes of charged cost units to Firestore.')
+_COST_FLUSH_UNITS = flags.DEFINE_integer(
+    'cost_flush_units', service.ServiceConfig.cost_flush_units,
+    'Number of pending cost units that triggers an early flush.')
+_METRICS = flags.DEFINE_bool('metrics', service.ServiceConfig.metrics,
+                             'Whether to record metrics exposed on /metrics.')
+_METRICS_DIR = flags.DEFINE_string(
+    'metrics_dir', service.ServiceConfig.metrics_dir,
+    'Directory shared by all serving processes to sum their metrics on /metrics.'
+)
+_AWS_MAX_POOL_CONNECTIONS = flags.DEFINE_integer(
+    'aws_max_pool_connections', service.ServiceConfig.aws_max_pool_connections,
+    'Max number of connections to Comprehend.')
+_GCP_CHANNELS = flags.DEFINE_integer(
+    'gcp_channels', service.ServiceConfig.gcp_channels,
+    'Number of gRPC channels calls to GCP are spread on.')
+_KEEPALIVE_SECONDS = flags.DEFINE_integer(
+    'keepalive_seconds', service.ServiceConfig.keepalive_seconds,
+    'Seconds between keepalive pings of idle gRPC connections.')
+_AWS_TPS = flags.DEFINE_float(
+    'aws_tps', service.ServiceConfig.aws_tps,
+    'Max Comprehend calls per second of this process.')
+_GCP_TPS = flags.DEFINE_float(
+    'gcp_tps', service.ServiceConfig.gcp_tps,
+    'Max GCP Natural Language calls per second of this process.')
+_WARM_UP_CONNECTIONS = flags.DEFINE_integer(
+    'warm_up_connections', service.ServiceConfig.warm_up_connections,
+    'Number of Comprehend connections opened at startup. 0 disables the warm-up.'
+)
+_WARM_UP_TIMEOUT_SECONDS = flags.DEFINE_float(
+    'warm_up_timeout_seconds', service.ServiceConfig.warm_up_timeout_seconds,
+    'Seconds after which the server is ready even if the warm-up did not finish.'
+)
+_ANALYTICS_DB = flags.DEFINE_string(
+    'analytics_db', service.ServiceConfig.analytics_db,
+    'SQLite database recording served entities for /analytics queries. Empty disables it.'
+)
+_ANALYTICS_FIRESTORE = flags.DEFINE_bool(
+    'analytics_firestore', service.ServiceConfig.analytics_firestore,
+    'Whether to also append served entities to Firestore.')
+_ANALYTICS_FLUSH_INTERVAL_SECONDS = flags.DEFINE_float(
+    'analytics_flush_interval_seconds',
+    service.ServiceConfig.analytics_flush_interval_seconds,
+    'Seconds between writes of recorded entities.')
+_JOB_WORKERS = flags.DEFINE_integer(
+    'job_workers', service.ServiceConfig.job_workers,
+    'Number of threads running queued jobs of /jobs. 0, the default, disables /jobs.'
+)
+_JOB_QUEUE = flags.DEFINE_string(
+    'job_queue', service.ServiceConfig.job_queue,
+    'Queue of /jobs: memory, or sqlite:<path> shared by several serving processes.'
+)
+_JOB_QUEUE_MAX_DEPTH = flags.DEFINE_integer(
+    'job_queue_max_depth', service.ServiceConfig.job_queue_max_depth,
+    'Max number of queued jobs, beyond which submissions get a 429.')
+_JOB_RESULT_TTL_SECONDS = flags.DEFINE_integer(
+    'job_result_ttl_seconds', service.ServiceConfig.job_result_ttl_seconds,
+    'Seconds the results of a finished job can be polled.')
+_JOB_WEBHOOKS = flags.DEFINE_bool(
+    'job_webhooks', service.ServiceConfig.job_webhooks,
+    'Whether jobs may name a callback_url their results are POSTed to.')
+_INPUT = flags.DEFINE_string(
+    'input', '',
+    'JSONL file to analyze offline instead of serving, e.g. requests.jsonl.')
+_OUTPUT = flags.DEFINE_string('output', 'results.jsonl',
+                              'JSONL file the offline results are written to.')
+_TEXT_FIELD = flags.DEFINE_string(
+    'text_field', 'text', 'Field of each input record holding the text.')
+_ID_FIELD = flags.DEFINE_string(
+    'id_field', 'id', 'Field of each input record copied to its result.')
+_BULK_BATCH_SIZE = flags.DEFINE_integer(
+    'bulk_batch_size', 100, 'Number of input records analyzed at once.')
+
+# Max number of texts accepted by one batch request.
+_MAX_BATCH_SIZE = 1000
+# Default range of analytics queries, back from now.
+_ANALYTICS_DEFAULT_SECONDS = 7 * 24 * 60 * 60
+_ANALYTICS_MAX_N = 1000
+# Header of the API key naming the tenant a request is admitted and charged
+# for, or of the tenant itself when set by a trusted proxy.
+_API_KEY_HEADER = 'X-Api-Key'
+_TENANT_HEADER = 'X-Tenant-Id'
+# Error and status code of each admission decision rejecting a request.
+_REJECTIONS = {
+    admission.BUDGET_EXCEEDED: ('Insufficient budget', 400),
+    admission.SHED: ('Over budget for this priority, retry later', 429),
+    admission.QUOTA_EXCEEDED: ('Tenant quota exceeded', 429),
+}
+
+api = flask.Blueprint('api', __name__)
+
+_REQUEST_SECONDS = metrics.Histogram('http_request_seconds',
+                                     'Latency of API requests.', ('route',))
+_INTERNAL_ERRORS = metrics.Counter(
+    'http_internal_errors_total',
+    'Requests that failed with an internal error.', ('route',))
+_TEXT_CHARS = metrics.Histogram('request_text_chars',
+                                'Characters of each analyzed text.', ('route',),
+                                buckets=metrics.SIZE_BUCKETS)
+_BATCH_TEXTS = metrics.Histogram('request_batch_texts',
+                                 'Number of texts of each batch request.',
+                                 buckets=(1, 5, 10, 25, 50, 100, 250, 500,
+                                          1000))
+_CACHE_LOOKUP_SECONDS = metrics.Histogram('cache_lookup_seconds',
+                                          'Latency of result cache lookups.')
+
+
+def _JsonResponse(body: bytes) -> flask.Response:
+  ''' Returns a response of JSON already encoded, see nlp_client_types. '''
+  return flask.Response(body, mimetype='application/json')
 
-server = flask.Flask(__name__)
-client: nlp_client.NlpClient = None
-db: firestore.Client = None
 
+def _service() -> service.Service:
+  return flask.current_app.extensions['service']
 
-@server.route('/entity_sentiment', methods=['POST'])
+
+def _Admit(state: service.Service,
+           texts: list[str],
+           tenant_name: str,
+           charge: bool = True):
+  ''' Returns the decision rejecting texts in admission control, or None.
+
+    Admitted texts are charged, unless only checked without charge.
+  '''
+  if not state.client.billable:
+    return None
+  admission_controller = state.admission_controller
+  decide = admission_controller.Admit if charge else admission_controller.Check
+  decision = decide(state.client.BilledTexts(texts), tenant_name)
+  return None if decision.admitted else decision.decision
+
+
+class _RejectedError(Exception):
+  ''' Raised by the call of coalesced requests when admission control rejected its texts. '''
+
+  def __init__(self, decision: str):
+    super().__init__(decision)
+    self.decision = decision
+
+
+def _TenantName(state: service.Service) -> str:
+  ''' Returns the tenant authenticated by the API key of the request, or the default tenant.
+
+    Clients can send any X-Tenant-Id, so the header is only read with
+    trust_tenant_header, i.e. when the proxy strips and sets it.
+  '''
+  headers = flask.request.headers
+  api_key = headers.get(_API_KEY_HEADER)
+  if api_key:
+    return state.api_key_tenants.get(api_key, '')
+  if state.trust_tenant_header:
+    return headers.get(_TENANT_HEADER, '')
+  return ''
+
+
+def _Rejection(decision: str):
+  error, status = _REJECTIONS[decision]
+  return flask.jsonify({'error': error}), status
+
+
+def _Record(state: service.Service,
+            results: list[nlp_client_types.MergedNlpEntities]):
+  ''' Records the entities of served results for analytics, if enabled. '''
+  if state.analytics_recorder is None:
+    return
+  for merged_entities in results:
+    state.analytics_recorder.Record(merged_entities)
+
+
+def _LookUp(state: service.Service, texts: list[str],
+            route: str) -> list[nlp_client_types.BatchItemResult | None]:
+  ''' Returns the item of each invalid or cached text, None for the texts to analyze. '''
+  items: list[nlp_client_types.BatchItemResult | None] = [None] * len(texts)
+  for index, text in enumerate(texts):
+    if not text or not isinstance(text, str):
+      items[index] = nlp_client_types.BatchItemResult(error='text is empty')
+      continue
+    _TEXT_CHARS.Observe(len(text), route)
+    merged_entities = state.cache.Get(text)
+    if merged_entities is not None:
+      items[index] = nlp_client_types.BatchItemResult(result=merged_entities)
+  _Record(state, [item.result for item in items if item and item.result])
+  return items
+
+
+def _AnalyzeOnce(state: service.Service, text: str,
+                 tenant_name: str) -> nlp_client_types.MergedNlpEntities:
+  ''' Charges and analyzes text, once for all the concurrent requests of it. '''
+  rejection = _Admit(state, [text], tenant_name)
+  if rejection:
+    raise _RejectedError(rejection)
+  merged_entities = state.client.AnalyzeSentiment(text)
+  state.cache.Put(text, merged_entities)
+  return merged_entities
+
+
+@api.route('/entity_sentiment', methods=['POST'])
+@_REQUEST_SECONDS.Timed('entity_sentiment')
 def entity_sentiment():
   try:
     req_json = flask.request.json
     text = req_json.get('text')
     if not text:
       return flask.jsonify({'error': 'text is empty in payload'}), 400
+    _TEXT_CHARS.Observe(len(text), 'entity_sentiment')
 
-    cost = cost_controller.update_cost(db, text)
-    if cost.total_cost > 100:
-      return flask.jsonify({'error': 'Insufficient budget'}), 400
+    state = _service()
+    # Cached results were already paid for, skip both cost and providers.
+    with _CACHE_LOOKUP_SECONDS.Time():
+      merged_entities = state.cache.Get(text)
+    if merged_entities is not None:
+      _Record(state, [merged_entities])
+      return _JsonResponse(merged_entities.to_json_bytes())
 
-    return flask.jsonify(client.AnalyzeSentiment(text).to_dict())
+    # Every request is checked for its own tenant; concurrent requests for
+    # the same text then share one analysis, charged once.
+    tenant_name = _TenantName(state)
+    rejection = _Admit(state, [text], tenant_name, charge=False)
+    if rejection:
+      return _Rejection(rejection)
+    try:
+      merged_entities = state.in_flight.Do(
+          result_cache.CacheKey(text),
+          lambda: _AnalyzeOnce(state, text, tenant_name))
+    except _RejectedError as e:
+      return _Rejection(e.decision)
+    _Record(state, [merged_entities])
+    return _JsonResponse(merged_entities.to_json_bytes())
   except Exception as e:
+    _INTERNAL_ERRORS.Inc('entity_sentiment')
     print(f'Internal error {e}')
     return flask.jsonify({'error': 'Internal error'}), 500
 
 
-def main(_):
-  global client
-  global db
+@api.route('/entity_sentiment:batch', methods=['POST'])
+@_REQUEST_SECONDS.Timed('entity_sentiment_batch')
+def entity_sentiment_batch():
+  try:
+    req_json = flask.request.json
+    texts = req_json.get('texts')
+    if not texts or not isinstance(texts, list):
+      return flask.jsonify({'error': 'texts is empty in payload'}), 400
+    if len(texts) > _MAX_BATCH_SIZE:
+      return flask.jsonify(
+          {'error': f'texts exceeds the batch size of {_MAX_BATCH_SIZE}'}), 400
+    _BATCH_TEXTS.Observe(len(texts))
 
-  if not _AWS_CRED_FILE.value:
-    logging.fatal('Did not find any AWS credential provided.')
+    state = _service()
+    items = _LookUp(state, texts, 'entity_sentiment_batch')
+    # Indices of texts that are neither invalid nor cached.
+    to_analyze = [index for index, item in enumerate(items) if item is None]
+    if to_analyze:
+      rejection = _Admit(state, [texts[index] for index in to_analyze],
+                         _TenantName(state))
+      if rejection:
+        return _Rejection(rejection)
+
+      analyzed_items = state.AnalyzeTexts(
+          [texts[index] for index in to_analyze])
+      for index, item in zip(to_analyze, analyzed_items):
+        items[index] = item
+
+    return _JsonResponse(nlp_client_types.EncodeBatchResults(items))
+  except Exception as e:
+    _INTERNAL_ERRORS.Inc('entity_sentiment_batch')
+    print(f'Internal error {e}')
+    return flask.jsonify({'error': 'Internal error'}), 500
+
+
+@api.route('/jobs', methods=['POST'])
+@_REQUEST_SECONDS.Timed('submit_job')
+def submit_job():
+  ''' Queues the analysis of text or texts, answering before any provider call.
+
+    The job is admitted and charged on submission. Poll it on the Location of
+    the response, or name a callback_url if webhooks are enabled.
+  '''
+  state = _service()
+  if state.jobs is None:
+    return flask.jsonify({'error': 'Jobs are disabled'}), 404
+  try:
+    req_json = flask.request.json
+    texts = req_json.get('texts')
+    if texts is None and req_json.get('text'):
+      texts = [req_json.get('text')]
+    if not texts or not isinstance(texts, list):
+      return flask.jsonify({'error': 'texts is empty in payload'}), 400
+    if len(texts) > _MAX_BATCH_SIZE:
+      return flask.jsonify(
+          {'error': f'texts exceeds the batch size of {_MAX_BATCH_SIZE}'}), 400
+    priority = req_json.get('priority', job_queue.NORMAL)
+    if priority not in job_queue.PRIORITIES:
+      return flask.jsonify({
+          'error': f'priority must be one of {", ".join(job_queue.PRIORITIES)}'
+      }), 400
+    callback_url = req_json.get('callback_url')
+    if callback_url and (not isinstance(callback_url, str) or
+                         not state.job_pool.AcceptsCallback(callback_url)):
+      return flask.jsonify({'error': 'callback_url is not accepted'}), 400
+    _BATCH_TEXTS.Observe(len(texts))
+
+    job = job_queue.Job.New(texts,
+                            _LookUp(state, texts, 'submit_job'),
+                            priority=priority,
+                            callback_url=callback_url)
+    if job.pending:
+      tenant_name = _TenantName(state)
+      # Admitted, and charged, only once the queue has room for the job.
+      rejection = state.jobs.Put(
+          job,
+          admit=lambda: _Admit(state, [texts[index]
+                                       for index in job.pending], tenant_name))
+      if rejection == job_queue.FULL:
+        return flask.jsonify({'error': 'Too many queued jobs, retry later'
+                             }), 429
+      if rejection:
+        return _Rejection(rejection)
+    else:
+      state.jobs.Save(job)
+    response = flask.jsonify(job.Status())
+    response.headers['Location'] = flask.url_for('api.get_job', job_id=job.id)
+    return response, 202
+  except Exception as e:
+    _INTERNAL_ERRORS.Inc('submit_job')
+    print(f'Internal error {e}')
+    return flask.jsonify({'error': 'Internal error'}), 500
+
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+@_REQUEST_SECONDS.Timed('get_job')
+def get_job(job_id: str):
+  state = _service()
+  if state.jobs is None:
+    return flask.jsonify({'error': 'Jobs are disabled'}), 404
+  job = state.jobs.Get(job_id)
+  if job is None:
+    return flask.jsonify({'error': 'Unknown or expired job'}), 404
+  return flask.jsonify(job.Status())
+
+
+def _TimestampArg(args, name: str, default: float) -> float:
+  ''' Returns a finite timestamp query parameter, or raises ValueError naming it. '''
+  try:
+    value = float(args.get(name, default))
+  except ValueError:
+    value = math.nan
+  if not math.isfinite(value):
+    raise ValueError(f'{name} must be a finite timestamp')
+  return value
+
+
+def _PositiveIntArg(args, name: str, default: int) -> int:
+  ''' Returns an integer query parameter of at least 1, or raises ValueError naming it. '''
+  try:
+    value = int(args.get(name, default))
+  except ValueError:
+    value = 0
+  if value < 1:
+    raise ValueError(f'{name} must be a positive integer')
+  return value
+
+
+def _AnalyticsRange(args) -> tuple[str, float, float]:
+  ''' Returns the granularity and [since, until) range of an analytics query. '''
+  granularity = args.get('granularity', entity_store.HOUR)
+  if granularity not in entity_store.BUCKET_SECONDS:
+    raise ValueError(f'granularity must be one of '
+                     f'{", ".join(entity_store.BUCKET_SECONDS)}')
+  until = _TimestampArg(args, 'until', time.time())
+  since = _TimestampArg(args, 'since', until - _ANALYTICS_DEFAULT_SECONDS)
+  return granularity, since, until
+
+
+@api.route('/analytics/trend', methods=['GET'])
+@_REQUEST_SECONDS.Timed('analytics_trend')
+def analytics_trend():
+  store = _service().analytics_store
+  if store is None:
+    return flask.jsonify({'error': 'Analytics are disabled'}), 404
+  entity = flask.request.args.get('entity')
+  if not entity:
+    return flask.jsonify({'error': 'entity is empty'}), 400
+  try:
+    granularity, since, until = _AnalyticsRange(flask.request.args)
+  except ValueError as e:
+    return flask.jsonify({'error': str(e)}), 400
+  rollups = store.Trend(entity, granularity, since, until)
+  return flask.jsonify({
+      'entity': entity,
+      'granularity': granularity,
+      'buckets': [rollup.to_dict() for rollup in rollups]
+  })
+
+
+@api.route('/analytics/top', methods=['GET'])
+@_REQUEST_SECONDS.Timed('analytics_top')
+def analytics_top():
+  store = _service().analytics_store
+  if store is None:
+    return flask.jsonify({'error': 'Analytics are disabled'}), 404
+  args = flask.request.args
+  order = args.get('order', entity_store.MOST_MENTIONED)
+  try:
+    granularity, since, until = _AnalyticsRange(args)
+    n = min(_PositiveIntArg(args, 'n', 10), _ANALYTICS_MAX_N)
+    min_mentions = _PositiveIntArg(args, 'min_mentions', 1)
+  except ValueError as e:
+    return flask.jsonify({'error': str(e)}), 400
+  if order not in entity_store.ORDERS:
+    return flask.jsonify({'error': f'Invalid order {order}'}), 400
+  rollups = store.Top(granularity,
+                      since,
+                      until,
+                      n,
+                      order=order,
+                      min_mentions=min_mentions)
+  return flask.jsonify({
+      'granularity': granularity,
+      'order': order,
+      'entities': [rollup.to_dict() for rollup in rollups]
+  })
+
+
+@api.route('/cache_stats', methods=['GET'])
+def cache_stats():
+  return flask.jsonify(dataclasses.asdict(_service().cache.Stats()))
+
+
+@api.route('/readyz', methods=['GET'])
+def readyz():
+  state = _service()
+  if not state.Ready():
+    return flask.jsonify({'ready': False}), 503
+  return flask.jsonify({'ready': True, 'providers': state.warm_up_status})
+
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+  return flask.Response(metrics.Render(), mimetype='text/plain; version=0.0.4')
+
+
+def create_app(state: service.Service) -> flask.Flask:
+  ''' Returns a server handling requests with the given per-process state. '''
+  server = flask.Flask(__name__)
+  server.extensions['service'] = state
+  server.register_blueprint(api)
+  return server
+
+
+def main(_):
+  try:
+    state = service.Service.FromConfig(
+        service.ServiceConfig(
+            providers=_PROVIDERS.value,
+            mode=_MODE.value,
+            local_lexicon_file=_LOCAL_LEXICON_FILE.value,
+            local_min_polar_score=_LOCAL_MIN_POLAR_SCORE.value,
+            entity_aliases_file=_ENTITY_ALIASES_FILE.value,
+            tenants=_TENANTS.value,
+            batch_timeout_seconds=_BATCH_TIMEOUT_SECONDS.value,
+            api_keys_file=_API_KEYS_FILE.value,
+            trust_tenant_header=_TRUST_TENANT_HEADER.value,
+            transport=_TRANSPORT.value,
+            replay_dir=_REPLAY_DIR.value,
+            replay_latency_seconds=_REPLAY_LATENCY_SECONDS.value,
+            replay_jitter_seconds=_REPLAY_JITTER_SECONDS.value,
+            replay_error_rate=_REPLAY_ERROR_RATE.value,
+            pack_texts=_PACK_TEXTS.value,
+            incremental=_INCREMENTAL.value,
+            incremental_cache_size=_INCREMENTAL_CACHE_SIZE.value,
+            aws_cred_file=_AWS_CRED_FILE.value,
+            cache_size=_CACHE_SIZE.value,
+            cache_ttl_seconds=_CACHE_TTL_SECONDS.value,
+            cache_dir=_CACHE_DIR.value,
+            cache_firestore=_CACHE_FIRESTORE.value,
+            cost_flush_interval_seconds=_COST_FLUSH_INTERVAL_SECONDS.value,
+            cost_flush_units=_COST_FLUSH_UNITS.value,
+            metrics=_METRICS.value,
+            metrics_dir=_METRICS_DIR.value,
+            aws_max_pool_connections=_AWS_MAX_POOL_CONNECTIONS.value,
+            gcp_channels=_GCP_CHANNELS.value,
+            keepalive_seconds=_KEEPALIVE_SECONDS.value,
+            aws_tps=_AWS_TPS.value,
+            gcp_tps=_GCP_TPS.value,
+            warm_up_connections=_WARM_UP_CONNECTIONS.value,
+            warm_up_timeout_seconds=_WARM_UP_TIMEOUT_SECONDS.value,
+            analytics_db=_ANALYTICS_DB.value,
+            analytics_firestore=_ANALYTICS_FIRESTORE.value,
+            analytics_flush_interval_seconds=_ANALYTICS_FLUSH_INTERVAL_SECONDS.
+            value,
+            job_workers=_JOB_WORKERS.value,
+            job_queue=_JOB_QUEUE.value,
+            job_queue_max_depth=_JOB_QUEUE_MAX_DEPTH.value,
+            job_result_ttl_seconds=_JOB_RESULT_TTL_SECONDS.value,
+            job_webhooks=_JOB_WEBHOOKS.value))
+  except ValueError as e:
+    logging.fatal(e)
     exit(-1)
+  atexit.register(state.Close)
 
-  client = nlp_client.NlpClient.NewNlpClient(
-      utils.LoadAwsCredentials(_AWS_CRED_FILE.value), None)
-  db = firestore.Client(project='news-collector-371409')
+  if _INPUT.value:
+    try:
+      checkpoint = bulk_analyzer.Run(_INPUT.value,
+                                     _OUTPUT.value,
+                                     state.client,
+                                     state.ledger,
+                                     state.cache,
+                                     text_field=_TEXT_FIELD.value,
+                                     id_field=_ID_FIELD.value,
+                                     batch_size=_BULK_BATCH_SIZE.value)
+    except bulk_analyzer.BudgetExceededError as e:
+      logging.fatal('Stopped, rerun to resume from the checkpoint: %s', e)
+      exit(-1)
+    logging.info('Analyzed %d bytes of %s.', checkpoint.input_offset,
+                 _INPUT.value)
+    return
 
-  # NOTE: This is a dev server but it's fine.
-  server.run(debug=_DEBUG.value, host="0.0.0.0", port=8080)
+  # NOTE: This is a dev server, see wsgi.py for the production server.
+  create_app(state).run(debug=_DEBUG.value, host="0.0.0.0", port=8080)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+
+import main
+import service
+from analytics import entity_store
+from cache import result_cache
+from cost import admission, cost_controller
+from datatypes import nlp_client_types
+
+
+class _SlowClient:
+  ''' Answers every text with one entity once released. '''
+  billable = True
+
+  def __init__(self):
+    self.release = threading.Event()
+    self.started = threading.Event()
+    self.calls = 0
+
+  def BilledTexts(self, texts):
+    return texts
+
+  def AnalyzeSentiment(self, text):
+    self.calls += 1
+    self.started.set()
+    self.release.wait(5)
+    entity = nlp_client_types.Entity(text='coffee', scores={'aws': 0.5})
+    return nlp_client_types.MergedNlpEntities(common_entities=[entity],
+                                              entities=[entity],
+                                              providers=['aws'])
+
+
+def _NewState(client, tenants='', **kwargs):
+  ledger = cost_controller.CostLedger(db=None)
+  return service.Service(client=client,
+                         db=None,
+                         ledger=ledger,
+                         cache=result_cache.ResultCache(
+                             result_cache.LruTtlCache(100, 60)),
+                         admission_controller=admission.AdmissionController(
+                             ledger, tenants=admission.ParseTenants(tenants)),
+                         **kwargs)
+
+
+class EntitySentimentTest(unittest.TestCase):
+
+  def test_coalesced_requests_are_admitted_per_tenant(self):
+    client = _SlowClient()
+    app = main.create_app(
+        _NewState(client,
+                  tenants='acme:high,trial:low:0.0000001',
+                  trust_tenant_header=True))
+    responses = {}
+
+    def Post(tenant):
+      responses[tenant] = app.test_client().post(
+          '/entity_sentiment',
+          json={'text': 'I like coffee.'},
+          headers={'X-Tenant-Id': tenant})
+
+    leader = threading.Thread(target=Post, args=('acme',))
+    leader.start()
+    self.assertTrue(client.started.wait(5))
+    # Over its quota, trial does not get the result acme is waiting for.
+    Post('trial')
+    self.assertEqual(responses['trial'].status_code, 429)
+    waiter = threading.Thread(target=Post, args=('default',))
+    waiter.start()
+    client.release.set()
+    leader.join()
+    waiter.join()
+
+    self.assertEqual(responses['acme'].status_code, 200)
+    self.assertEqual(responses['default'].status_code, 200)
+    self.assertEqual(client.calls, 1)
+
+  def test_coalesced_requests_are_charged_once(self):
+    client = _SlowClient()
+    state = _NewState(client)
+    app = main.create_app(state)
+    statuses = []
+
+    def Post():
+      statuses.append(app.test_client().post('/entity_sentiment',
+                                             json={
+                                                 'text': 'I like coffee.'
+                                             }).status_code)
+
+    threads = [threading.Thread(target=Post) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    self.assertTrue(client.started.wait(5))
+    time.sleep(0.2)
+    client.release.set()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(statuses, [200] * 4)
+    self.assertEqual(client.calls, 1)
+    self.assertEqual(
+        (state.ledger.View().aws_unit, state.ledger.View().gcp_unit),
+        cost_controller.Units(['I like coffee.']))
+
+
+class TenantTest(unittest.TestCase):
+
+  def setUp(self):
+    client = _SlowClient()
+    client.release.set()
+    # Only the trial tenant is over its quota.
+    self.state = _NewState(client,
+                           tenants='trial:low:0.0000001',
+                           api_key_tenants={'trial-key': 'trial'})
+    self.app = main.create_app(self.state).test_client()
+
+  def _Post(self, headers):
+    return self.app.post('/entity_sentiment',
+                         json={
+                             'text': 'I like coffee.'
+                         },
+                         headers=headers).status_code
+
+  def test_tenant_is_named_by_api_key(self):
+    self.assertEqual(self._Post({'X-Api-Key': 'trial-key'}), 429)
+    self.assertEqual(self._Post({'X-Api-Key': 'unknown-key'}), 200)
+
+  def test_tenant_header_is_only_trusted_if_configured(self):
+    self.assertEqual(self._Post({'X-Tenant-Id': 'trial'}), 200)
+    self.state.cache = result_cache.ResultCache(
+        result_cache.LruTtlCache(100, 60))
+    self.state.trust_tenant_header = True
+    self.assertEqual(self._Post({'X-Tenant-Id': 'trial'}), 429)
+
+
+class AnalyticsTest(unittest.TestCase):
+
+  def test_non_finite_range_is_rejected(self):
+    store = entity_store.SqliteEntityStore(':memory:')
+    self.addCleanup(store.Close)
+    client = main.create_app(_NewState(_SlowClient(),
+                                       analytics_store=store)).test_client()
+
+    for query in ('since=nan', 'until=inf', 'since=-inf&until=0'):
+      response = client.get(f'/analytics/trend?entity=coffee&{query}')
+      self.assertEqual(response.status_code, 400, query)
+    self.assertEqual(
+        client.get(
+            '/analytics/trend?entity=coffee&since=0&until=1').status_code, 200)
+
+  def test_top_rejects_n_below_one_by_name(self):
+    store = entity_store.SqliteEntityStore(':memory:')
+    self.addCleanup(store.Close)
+    client = main.create_app(_NewState(_SlowClient(),
+                                       analytics_store=store)).test_client()
+
+    for n in ('-1', '0', 'abc'):
+      response = client.get(f'/analytics/top?n={n}')
+      self.assertEqual(response.status_code, 400, n)
+      self.assertEqual(response.json['error'], 'n must be a positive integer')
+    self.assertEqual(client.get('/analytics/top?n=5').status_code, 200)
@@ -0,0 +1,269 @@
+'''
+  Minimal in-process metrics exposed in the Prometheus text format.
+  Metrics are defined once at module level and record nothing until Enable() is called, so instrumenting a hot path costs a single flag check while disabled.
+  With several serving processes, EnableMultiprocess() has each one snapshot its metrics to a shared directory, and Render() sums the snapshots of all of them.
+'''
+import abc
+import bisect
+import contextlib
+import copy
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from a cache hit to a slow provider round-trip.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+# Payload size buckets in characters; 5,000 is the Comprehend limit.
+SIZE_BUCKETS = (100, 300, 1000, 3000, 5000, 10000, 30000, 100000)
+
+_enabled = False
+_registry = []
+_registry_lock = threading.Lock()
+_NULL_CONTEXT = contextlib.nullcontext()
+# Directory shared by all serving processes for their snapshots, if any.
+_multiprocess_dir = None
+
+
+def Enable(enabled: bool = True):
+  global _enabled
+  _enabled = enabled
+
+
+def EnableMultiprocess(directory: str, interval_seconds: float = 1):
+  ''' Snapshots the metrics of this process to directory every interval_seconds, for Render() to sum. '''
+  global _multiprocess_dir
+  os.makedirs(directory, exist_ok=True)
+  _multiprocess_dir = directory
+
+  def Run():
+    while True:
+      time.sleep(interval_seconds)
+      try:
+        WriteSnapshot()
+      except OSError as e:
+        logging.warning('Failed to snapshot metrics: %s', e)
+
+  threading.Thread(target=Run, name='metrics_snapshot', daemon=True).start()
+
+
+def WriteSnapshot():
+  ''' Writes the metrics of this process to the multiprocess directory, if enabled.
+
+    Snapshots of exited processes are kept, so counters never go back.
+  '''
+  if _multiprocess_dir is None:
+    return
+  with _registry_lock:
+    metrics = list(_registry)
+  path = os.path.join(_multiprocess_dir, f'{os.getpid()}.json')
+  with open(path + '.tmp', 'w') as f:
+    json.dump({metric.name: metric.Snapshot() for metric in metrics}, f)
+  # Renders in other processes never read a partial snapshot.
+  os.replace(path + '.tmp', path)
+
+
+def _ReadSnapshots() -> list[dict]:
+  snapshots = []
+  for path in glob.glob(os.path.join(_multiprocess_dir, '*.json')):
+    try:
+      with open(path) as f:
+        snapshots.append(json.load(f))
+    except (OSError, ValueError) as e:
+      logging.warning('Skipping metrics snapshot %s: %s', path, e)
+  return snapshots
+
+
+def _EscapeLabelValue(value) -> str:
+  return str(value).replace('\\', '\\\\').replace('"',
+                                                  '\\"').replace('\n', '\\n')
+
+
+def _FormatLabels(labelnames: tuple[str],
+                  label_values: tuple,
+                  extra: str = '') -> str:
+  labels = [
+      f'{name}="{_EscapeLabelValue(value)}"'
+      for name, value in zip(labelnames, label_values)
+  ]
+  if extra:
+    labels.append(extra)
+  return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class _Metric(abc.ABC):
+
+  def __init__(self, name: str, documentation: str, labelnames: tuple[str]):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = labelnames
+    self._lock = threading.Lock()
+    with _registry_lock:
+      _registry.append(self)
+
+  def Snapshot(self) -> list:
+    ''' Returns [label values, value] pairs of the metric, as JSON. '''
+    with self._lock:
+      return [[list(label_values), copy.deepcopy(value)]
+              for label_values, value in self._values.items()]
+
+  @abc.abstractmethod
+  def Merge(self, values: dict, snapshot: list):
+    ''' Adds the values of a snapshot to values, keyed by label values. '''
+
+  @abc.abstractmethod
+  def Render(self, values: dict | None = None) -> list[str]:
+    ''' Returns the lines of the metric in the Prometheus text format, of values if given. '''
+
+
+class Counter(_Metric):
+
+  def __init__(self, name: str, documentation: str,
+               labelnames: tuple[str] = ()):
+    super().__init__(name, documentation, labelnames)
+    self._values = {}  # label values -> count
+
+  def Inc(self, *label_values, amount: float = 1):
+    if not _enabled:
+      return
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+
+  def Value(self, *label_values) -> float:
+    return self._values.get(label_values, 0)
+
+  def Merge(self, values: dict, snapshot: list):
+    for label_values, value in snapshot:
+      label_values = tuple(label_values)
+      values[label_values] = values.get(label_values, 0) + value
+
+  def Render(self, values: dict | None = None) -> list[str]:
+    lines = [
+        f'# HELP {self.name} {self.documentation}',
+        f'# TYPE {self.name} counter'
+    ]
+    if values is None:
+      with self._lock:
+        values = dict(self._values)
+    for label_values, value in sorted(values.items()):
+      lines.append(
+          f'{self.name}{_FormatLabels(self.labelnames, label_values)} {value}')
+    return lines
+
+
+class _HistogramTimer:
+
+  def __init__(self, histogram: 'Histogram', label_values: tuple):
+    self.histogram = histogram
+    self.label_values = label_values
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.histogram.Observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Histogram(_Metric):
+
+  def __init__(self,
+               name: str,
+               documentation: str,
+               labelnames: tuple[str] = (),
+               buckets: tuple[float] = LATENCY_BUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = tuple(buckets)
+    # label values -> [per bucket counts (last one is +Inf), sum]
+    self._values = {}
+
+  def Observe(self, value: float, *label_values):
+    if not _enabled:
+      return
+    bucket = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      entry = self._values.get(label_values)
+      if entry is None:
+        entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+      entry[0][bucket] += 1
+      entry[1] += value
+
+  def Time(self, *label_values):
+    ''' Returns a context manager observing the seconds spent in it. '''
+    if not _enabled:
+      return _NULL_CONTEXT
+    return _HistogramTimer(self, label_values)
+
+  def Timed(self, *label_values):
+    ''' Decorator observing the seconds spent in each call. '''
+
+    def Decorator(fn):
+
+      @functools.wraps(fn)
+      def Wrapper(*args, **kwargs):
+        if not _enabled:
+          return fn(*args, **kwargs)
+        with _HistogramTimer(self, label_values):
+          return fn(*args, **kwargs)
+
+      return Wrapper
+
+    return Decorator
+
+  def Count(self, *label_values) -> int:
+    entry = self._values.get(label_values)
+    return sum(entry[0]) if entry else 0
+
+  def Merge(self, values: dict, snapshot: list):
+    for label_values, (counts, total) in snapshot:
+      entry = values.setdefault(tuple(label_values),
+                                [[0] * (len(self.buckets) + 1), 0])
+      entry[0] = [a + b for a, b in zip(entry[0], counts)]
+      entry[1] += total
+
+  def Render(self, values: dict | None = None) -> list[str]:
+    lines = [
+        f'# HELP {self.name} {self.documentation}',
+        f'# TYPE {self.name} histogram'
+    ]
+    if values is None:
+      with self._lock:
+        values = copy.deepcopy(self._values)
+    for label_values, (counts, total) in sorted(values.items()):
+      cumulative = 0
+      for bound, count in zip(self.buckets + ('+Inf',), counts):
+        cumulative += count
+        bucket_labels = _FormatLabels(self.labelnames, label_values,
+                                      f'le="{bound}"')
+        lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+      labels = _FormatLabels(self.labelnames, label_values)
+      lines.append(f'{self.name}_sum{labels} {total}')
+      lines.append(f'{self.name}_count{labels} {cumulative}')
+    return lines
+
+
+def Render() -> str:
+  ''' Returns all metrics in the Prometheus text exposition format.
+
+    In multiprocess mode, the metrics of this process are snapshotted first,
+    and each metric is the sum of the snapshots of all processes.
+  '''
+  with _registry_lock:
+    metrics = list(_registry)
+  snapshots = None
+  if _multiprocess_dir is not None:
+    WriteSnapshot()
+    snapshots = _ReadSnapshots()
+  lines = []
+  for metric in metrics:
+    values = None
+    if snapshots is not None:
+      values = {}
+      for snapshot in snapshots:
+        metric.Merge(values, snapshot.get(metric.name, []))
+    lines.extend(metric.Render(values))
+  return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from monitoring import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    metrics.Enable()
+    self.addCleanup(metrics.Enable, False)
+
+  def test_nothing_is_recorded_while_disabled(self):
+    counter = metrics.Counter('test_disabled_total', 'Test counter.')
+    histogram = metrics.Histogram('test_disabled_seconds', 'Test histogram.')
+    metrics.Enable(False)
+
+    counter.Inc()
+    histogram.Observe(1)
+    with histogram.Time():
+      pass
+
+    self.assertEqual(counter.Value(), 0)
+    self.assertEqual(histogram.Count(), 0)
+
+  def test_counter_renders_per_label_values(self):
+    counter = metrics.Counter('test_errors_total', 'Test errors.',
+                              ('provider',))
+
+    counter.Inc('aws')
+    counter.Inc('aws', amount=2)
+    counter.Inc('g"cp')
+
+    self.assertEqual(counter.Render(), [
+        '# HELP test_errors_total Test errors.',
+        '# TYPE test_errors_total counter',
+        'test_errors_total{provider="aws"} 3',
+        'test_errors_total{provider="g\\"cp"} 1',
+    ])
+
+  def test_histogram_buckets_are_cumulative(self):
+    histogram = metrics.Histogram('test_latency_seconds',
+                                  'Test latency.',
+                                  buckets=(0.1, 1))
+
+    histogram.Observe(0.05)
+    histogram.Observe(0.1)
+    histogram.Observe(0.5)
+    histogram.Observe(5)
+
+    self.assertEqual(histogram.Render()[2:], [
+        'test_latency_seconds_bucket{le="0.1"} 2',
+        'test_latency_seconds_bucket{le="1"} 3',
+        'test_latency_seconds_bucket{le="+Inf"} 4',
+        'test_latency_seconds_sum 5.65',
+        'test_latency_seconds_count 4',
+    ])
+
+  def test_timed_observes_each_call(self):
+    histogram = metrics.Histogram('test_timed_seconds', 'Test timing.',
+                                  ('stage',))
+
+    @histogram.Timed('merge')
+    def Merge(value):
+      return value
+
+    self.assertEqual(Merge(1), 1)
+    self.assertEqual(Merge.__name__, 'Merge')
+    self.assertEqual(histogram.Count('merge'), 1)
+
+  def test_render_includes_registered_metrics(self):
+    metrics.Counter('test_registered_total', 'Test counter.').Inc()
+
+    self.assertIn('test_registered_total 1\n', metrics.Render())
+
+  def test_render_sums_snapshots_of_all_processes(self):
+    counter = metrics.Counter('test_shared_total', 'Test counter.', ('stage',))
+    histogram = metrics.Histogram('test_shared_seconds',
+                                  'Test histogram.',
+                                  buckets=(1,))
+    counter.Inc('merge', amount=2)
+    histogram.Observe(0.5)
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    with open(os.path.join(directory.name, '1.json'), 'w') as f:
+      json.dump(
+          {
+              'test_shared_total': [[['merge'], 3]],
+              'test_shared_seconds': [[[], [[0, 1], 2]]]
+          }, f)
+
+    with mock.patch.object(metrics, '_multiprocess_dir', directory.name):
+      rendered = metrics.Render()
+
+    self.assertIn('test_shared_total{stage="merge"} 5\n', rendered)
+    self.assertIn('test_shared_seconds_bucket{le="1"} 1\n', rendered)
+    self.assertIn('test_shared_seconds_count 2\n', rendered)
+    self.assertTrue(
+        os.path.exists(os.path.join(directory.name, f'{os.getpid()}.json')))
@@ -0,0 +1,96 @@
+'''
+  Canonical keys of entity texts, so that providers' spellings of the same entity group and merge together.
+  A key is the casefolded text without punctuation, leading article or plural, optionally mapped through an alias index, e.g. "The Comprehend APIs" and "comprehend API" share a key, and an alias can map "Comprehend" to "AWS Comprehend". Keys are computed once per distinct text and looked up in dicts, so grouping stays linear in the number of entities.
+'''
+import functools
+import re
+
+# Joins words, as in "e-mail" or "input/output".
+_WORD_JOINERS = re.compile(r'[-_/]+')
+_POSSESSIVE = re.compile(r"['’]s\b", re.IGNORECASE)
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_ARTICLES = frozenset(('the', 'a', 'an'))
+# Singular words ending with s, whose final s is not a plural.
+_SINGULAR_ENDINGS = ('ss', 'us', 'sis', 'ics')
+# Plurals that are their own singular.
+_INVARIANT_PLURALS = frozenset(('series', 'species', 'news', 'means',
+                                'headquarters', 'crossroads', 'corps'))
+_KEY_CACHE_SIZE = 1 << 16
+
+# Key of each alias -> key of its canonical text.
+_alias_keys: dict[str, str] = {}
+# Key of each canonical text -> canonical text.
+_canonical_texts: dict[str, str] = {}
+
+
+def _IsCommonNoun(word: str) -> bool:
+  ''' Whether word is lowercase, or an acronym plural such as "APIs".
+
+    Capitalized words are taken for names, e.g. "Windows" or "Mars", whose
+    final s is no plural.
+  '''
+  return word.islower() or (word.endswith('s') and word[:-1].isupper())
+
+
+def _Singular(word: str) -> str:
+  if (len(word) <= 3 or not word.endswith('s') or
+      word.endswith(_SINGULAR_ENDINGS) or word in _INVARIANT_PLURALS):
+    return word
+  if word.endswith('ies'):
+    return word[:-3] + 'y'
+  if word.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+    return word[:-2]
+  return word[:-1]
+
+
+@functools.lru_cache(maxsize=_KEY_CACHE_SIZE)
+def NormalizedKey(text: str) -> str:
+  ''' Returns the casefolded text without punctuation, leading article or plural of its last word.
+
+    Only common nouns are made singular, see _IsCommonNoun.
+  '''
+  key = _POSSESSIVE.sub('', text)
+  key = _PUNCTUATION.sub('', _WORD_JOINERS.sub(' ', key))
+  words = key.split()
+  common_noun = bool(words) and _IsCommonNoun(words[-1])
+  words = [word.casefold() for word in words]
+  if len(words) > 1 and words[0] in _ARTICLES:
+    words = words[1:]
+  if common_noun:
+    words[-1] = _Singular(words[-1])
+  return ' '.join(words)
+
+
+def CanonicalKey(text: str) -> str:
+  ''' Returns the key entities with the same meaning as text share. '''
+  key = NormalizedKey(text)
+  return _alias_keys.get(key, key)
+
+
+def CanonicalText(text: str) -> str:
+  ''' Returns the canonical text of an alias, or text itself. '''
+  return _canonical_texts.get(CanonicalKey(text), text)
+
+
+def LoadAliases(path: str) -> dict[str, str]:
+  ''' Reads a tab-separated file of aliases and their canonical text. '''
+  aliases = {}
+  with open(path, 'r', encoding='utf-8') as file:
+    for line in file:
+      if not line.strip() or line.startswith('#'):
+        continue
+      alias, canonical_text = line.rstrip('\n').split('\t')
+      aliases[alias.strip()] = canonical_text.strip()
+  return aliases
+
+
+def SetAliases(aliases: dict[str, str]):
+  ''' Replaces the alias index, e.g. {"Comprehend": "AWS Comprehend"}. '''
+  global _alias_keys, _canonical_texts
+  alias_keys = {}
+  canonical_texts = {}
+  for alias, canonical_text in aliases.items():
+    canonical_key = NormalizedKey(canonical_text)
+    alias_keys[NormalizedKey(alias)] = canonical_key
+    canonical_texts[canonical_key] = canonical_text
+  _alias_keys, _canonical_texts = alias_keys, canonical_texts
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from normalization import canonicalizer
+
+
+class CanonicalKeyTest(unittest.TestCase):
+
+  def tearDown(self):
+    canonicalizer.SetAliases({})
+    super().tearDown()
+
+  def test_spellings_of_an_entity_share_a_key(self):
+    self.assertEqual(
+        {
+            canonicalizer.CanonicalKey(text) for text in [
+                'Comprehend API', 'the comprehend APIs', 'Comprehend-API',
+                'COMPREHEND API.'
+            ]
+        }, {'comprehend api'})
+
+  def test_plurals_and_possessives_are_singular(self):
+    self.assertEqual(canonicalizer.CanonicalKey('batteries'), 'battery')
+    self.assertEqual(canonicalizer.CanonicalKey('boxes'), 'box')
+    self.assertEqual(canonicalizer.CanonicalKey("Apple's"), 'apple')
+    self.assertEqual(canonicalizer.CanonicalKey('news'), 'news')
+    self.assertEqual(canonicalizer.CanonicalKey('series'), 'series')
+    self.assertEqual(canonicalizer.CanonicalKey('the species'), 'species')
+    self.assertEqual(canonicalizer.CanonicalKey('URLs'), 'url')
+    self.assertEqual(canonicalizer.CanonicalKey('business'), 'business')
+    self.assertEqual(canonicalizer.CanonicalKey('bus'), 'bus')
+
+  def test_capitalized_words_are_not_plurals(self):
+    self.assertNotEqual(canonicalizer.CanonicalKey('Windows'),
+                        canonicalizer.CanonicalKey('window'))
+    self.assertEqual(canonicalizer.CanonicalKey('Microsoft Windows'),
+                     'microsoft windows')
+    self.assertEqual(canonicalizer.CanonicalKey('Paris'), 'paris')
+    self.assertEqual(canonicalizer.CanonicalKey('Mars'), 'mars')
+    self.assertEqual(canonicalizer.CanonicalKey('WINDOWS'), 'windows')
+    self.assertEqual(canonicalizer.CanonicalKey("Texas's"), 'texas')
+    self.assertEqual(canonicalizer.CanonicalKey('the windows'), 'window')
+
+  def test_aliases_share_the_key_of_their_canonical_text(self):
+    canonicalizer.SetAliases({'Comprehend': 'AWS Comprehend'})
+
+    self.assertEqual(canonicalizer.CanonicalKey('comprehend'),
+                     canonicalizer.CanonicalKey('AWS Comprehend'))
+    self.assertEqual(canonicalizer.CanonicalText('Comprehend'),
+                     'AWS Comprehend')
+    self.assertEqual(canonicalizer.CanonicalText('coffee'), 'coffee')
+
+  def test_load_aliases_reads_tab_separated_file(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'aliases.tsv')
+      with open(path, 'w', encoding='utf-8') as file:
+        file.write('# alias\tcanonical text\nComprehend\tAWS Comprehend\n\n')
+
+      self.assertEqual(canonicalizer.LoadAliases(path),
+                       {'Comprehend': 'AWS Comprehend'})
@@ -1,11 +1,30 @@
 from datatypes import aws_types, gcp_types, nlp_client_types
+from monitoring import metrics
+from normalization import canonicalizer
 import collections
 
+NORMALIZE_SECONDS = metrics.Histogram(
+    'nlp_normalize_seconds', 'Latency of normalizing provider responses.',
+    ('provider', 'path'))
+
 
 def ArithmeticMean(values):
   return sum(values) / len(values)
 
 
+def GroupByCanonicalKey(items, text) -> dict[str, list]:
+  ''' Groups items by the canonical key of text(item), in order of appearance, under the first text of each group. '''
+  key_to_text = {}
+  text_to_items = collections.defaultdict(list)
+  for item in items:
+    item_text = text(item)
+    group_text = key_to_text.setdefault(canonicalizer.CanonicalKey(item_text),
+                                        item_text)
+    text_to_items[group_text].append(item)
+  return text_to_items
+
+
+@NORMALIZE_SECONDS.Timed('gcp', 'scalar')
 def NormalizeGcpSentiment(
     gcp_entities: list[gcp_types.GcpEntity]) -> list[nlp_client_types.Entity]:
 
@@ -20,20 +39,20 @@ def NormalizeGcpSentiment(
           entity.sentiment.magnitude + 1)
       weighted_sentiments.append(entity.sentiment.score * normalized_magnitude)
     return nlp_client_types.Entity(
-        text=text, gcp_score=ArithmeticMean(weighted_sentiments))
+        text=text, scores={'gcp': ArithmeticMean(weighted_sentiments)})
 
   entities = []
 
-  # Reduce entities by entity name (entity text).
-  text_to_entities = collections.defaultdict(list)
-  for gcp_entity in gcp_entities:
-    text_to_entities[gcp_entity.name].append(gcp_entity)
+  # Reduce entities by canonical entity name (entity text).
+  text_to_entities = GroupByCanonicalKey(gcp_entities,
+                                         lambda gcp_entity: gcp_entity.name)
   for text, gcp_entities in text_to_entities.items():
     entities.append(NormalizeEach(text, gcp_entities))
 
   return entities
 
 
+@NORMALIZE_SECONDS.Timed('aws', 'scalar')
 def NormalizeAwsSentiment(
     aws_entities: list[aws_types.AwsEntity]) -> list[nlp_client_types.Entity]:
 
@@ -50,14 +69,13 @@ def NormalizeAwsSentiment(
             (mention.sentiments.positive - mention.sentiments.negative) *
             mention.score)
     return nlp_client_types.Entity(
-        text=text, aws_score=ArithmeticMean(weighted_sentiments))
+        text=text, scores={'aws': ArithmeticMean(weighted_sentiments)})
 
   entities = []
 
-  # Reduce entities by entity name (entity text).
-  text_to_entities = collections.defaultdict(list)
-  for aws_entity in aws_entities:
-    text_to_entities[aws_entity.text].append(aws_entity)
+  # Reduce entities by canonical entity name (entity text).
+  text_to_entities = GroupByCanonicalKey(aws_entities,
+                                         lambda aws_entity: aws_entity.text)
   for text, aws_entities in text_to_entities.items():
     entities.append(NormalizeEach(text, aws_entities))
 
@@ -19,7 +19,7 @@ class TestNormalizeGcpSentiment(unittest.TestCase):
     ])
     self.assertEqual(len(entities), 1)
     self.assertEqual(entities[0].text, 'text')
-    self.assertAlmostEqual(entities[0].gcp_score, 0)
+    self.assertAlmostEqual(entities[0].scores['gcp'], 0)
 
   def test_normalize_opposite_sentiment_entities_returns_neutral_sentiment_score(
       self):
@@ -35,7 +35,7 @@ class TestNormalizeGcpSentiment(unittest.TestCase):
     ])
     self.assertEqual(len(entities), 1)
     self.assertEqual(entities[0].text, 'text')
-    self.assertAlmostEqual(entities[0].gcp_score, 0)
+    self.assertAlmostEqual(entities[0].scores['gcp'], 0)
 
   def test_normalize_entities_with_different_text_returns_multiple_entities(
       self):
@@ -72,7 +72,7 @@ class TestNormalizeAwsSentiment(unittest.TestCase):
     ])
     self.assertEqual(len(entities), 1)
     self.assertEqual(entities[0].text, 'text')
-    self.assertAlmostEqual(entities[0].aws_score, 0)
+    self.assertAlmostEqual(entities[0].scores['aws'], 0)
 
   def test_normalize_opposite_sentiment_entities_returns_neutral_sentiment_score(
       self):
@@ -94,7 +94,7 @@ class TestNormalizeAwsSentiment(unittest.TestCase):
     ])
     self.assertEqual(len(entities), 1)
     self.assertEqual(entities[0].text, 'text')
-    self.assertAlmostEqual(entities[0].aws_score, 0)
+    self.assertAlmostEqual(entities[0].scores['aws'], 0)
 
   def test_normalize_entities_with_different_text_returns_multiple_entities(
       self):
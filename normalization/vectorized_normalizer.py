@@ -0,0 +1,119 @@
+'''
+  Array-backed equivalent of normalizer, normalizing many raw provider responses in one call.
+  Mention scores are read straight from the responses into NumPy arrays, skipping the per-mention aws_types/gcp_types objects, then weighted in bulk and reduced per entity group with np.bincount.
+  np.bincount accumulates in input order like ArithmeticMean, so results are identical to converting the responses and running normalizer on them.
+'''
+from datatypes import aws_types, nlp_client_types
+from normalization import canonicalizer, normalizer
+import numpy as np
+
+
+def _GroupMeans(group_index: np.ndarray, values: np.ndarray,
+                group_count: int) -> tuple[np.ndarray, np.ndarray]:
+  ''' Returns the mean of values and the number of values of each group. '''
+  sums = np.bincount(group_index, weights=values, minlength=group_count)
+  counts = np.bincount(group_index, minlength=group_count)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return sums / counts, counts
+
+
+def _Group(text: str, key_to_group: dict[str, int], group_texts: list[str],
+           group_offset: int) -> int:
+  ''' Returns the group of the canonical key of text, adding it under text if new. '''
+  key = canonicalizer.CanonicalKey(text)
+  group = key_to_group.get(key)
+  if group is None:
+    group = key_to_group[key] = group_offset + len(group_texts)
+    group_texts.append(text)
+  return group
+
+
+def _ToEntities(document_groups: list[list[str]], means: np.ndarray,
+                counts: np.ndarray, provider: str) -> list:
+  ''' Splits group means back to documents.
+
+    A document with a group without any value gets ZeroDivisionError in place of
+    its entities, as normalizer raises on it.
+  '''
+  results = []
+  group_begin = 0
+  for texts in document_groups:
+    group_end = group_begin + len(texts)
+    if not counts[group_begin:group_end].all():
+      results.append(ZeroDivisionError('division by zero'))
+    else:
+      results.append([
+          nlp_client_types.Entity(text=text, scores={provider: mean})
+          for text, mean in zip(texts, means[group_begin:group_end].tolist())
+      ])
+    group_begin = group_end
+  return results
+
+
+@normalizer.NORMALIZE_SECONDS.Timed('aws', 'vectorized')
+def NormalizeAwsResponses(responses: list[dict]) -> list:
+  ''' Same as normalizer.NormalizeAwsSentiment(convert_aws_response(response)) on each response. '''
+  document_groups = []
+  group_index = []
+  # Positive, negative, score and group score of each mention.
+  values = []
+  group_offset = 0
+  for response in responses:
+    # Reduce entities by canonical entity name (entity text), in order of
+    # appearance.
+    key_to_group = {}
+    group_texts = []
+    for raw_entity in response.get('Entities', []):
+      group = _Group(
+          canonicalizer.CanonicalText(aws_types.DescriptiveText(raw_entity)),
+          key_to_group, group_texts, group_offset)
+      raw_mentions = raw_entity['Mentions']
+      group_index.extend([group] * len(raw_mentions))
+      for raw_mention in raw_mentions:
+        sentiment_score = raw_mention['MentionSentiment']['SentimentScore']
+        values += (sentiment_score['Positive'], sentiment_score['Negative'],
+                   raw_mention['Score'], raw_mention['GroupScore'])
+    document_groups.append(group_texts)
+    group_offset += len(group_texts)
+
+  mention_values = np.array(values, dtype=np.float64).reshape(-1, 4)
+  positive, negative, score, group_score = mention_values.T
+  # Skip mentions with low group score, which are likely not related to the same entity.
+  related = group_score >= 0.5
+  weighted_sentiments = (positive - negative) * score
+
+  means, counts = _GroupMeans(
+      np.array(group_index, dtype=np.intp)[related],
+      weighted_sentiments[related], group_offset)
+  return _ToEntities(document_groups, means, counts, 'aws')
+
+
+@normalizer.NORMALIZE_SECONDS.Timed('gcp', 'vectorized')
+def NormalizeGcpResponses(responses: list) -> list:
+  ''' Same as normalizer.NormalizeGcpSentiment(convert_gcp_response(response)) on each response. '''
+  document_groups = []
+  group_index = []
+  # Score and magnitude of each entity.
+  values = []
+  group_offset = 0
+  for response in responses:
+    # Reduce entities by canonical entity name (entity text), in order of
+    # appearance.
+    key_to_group = {}
+    group_texts = []
+    for raw_entity in response.entities:
+      group_index.append(
+          _Group(canonicalizer.CanonicalText(raw_entity.name), key_to_group,
+                 group_texts, group_offset))
+      sentiment = raw_entity.sentiment
+      values += (sentiment.score, sentiment.magnitude)
+    document_groups.append(group_texts)
+    group_offset += len(group_texts)
+
+  score, magnitude = np.array(values, dtype=np.float64).reshape(-1, 2).T
+  # Normalize magnitudes from [0, inf) to [0, 1)
+  weighted_sentiments = score * (magnitude / (magnitude + 1))
+
+  means, counts = _GroupMeans(np.array(group_index, dtype=np.intp),
+                              weighted_sentiments, group_offset)
+  return _ToEntities(document_groups, means, counts, 'gcp')
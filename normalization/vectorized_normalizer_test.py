@@ -0,0 +1,113 @@
+import random
+import unittest
+
+from clients import aws_comprehend, gcp_language
+from google.cloud import language_v1
+from normalization import normalizer, vectorized_normalizer
+
+
+def _RawAwsMention(rng: random.Random, group_score: float) -> dict:
+  return {
+      'Text': 'mention',
+      'Score': rng.random(),
+      'GroupScore': group_score,
+      'MentionSentiment': {
+          'SentimentScore': {
+              'Positive': rng.random(),
+              'Negative': rng.random()
+          }
+      }
+  }
+
+
+def _RandomAwsResponse(rng: random.Random) -> dict:
+  entities = []
+  for _ in range(rng.randint(0, 6)):
+    mentions = [
+        _RawAwsMention(rng, rng.uniform(0.5, 1))
+        for _ in range(rng.randint(1, 5))
+    ]
+    mentions[0]['Text'] = rng.choice(['a', 'b', 'c'])
+    entities.append({'DescriptiveMentionIndex': [0], 'Mentions': mentions})
+  return {'Entities': entities}
+
+
+def _RandomGcpResponse(
+    rng: random.Random) -> language_v1.AnalyzeEntitySentimentResponse:
+  return language_v1.AnalyzeEntitySentimentResponse(entities=[
+      language_v1.Entity(name=rng.choice(['a', 'b', 'c']),
+                         salience=rng.random(),
+                         sentiment=language_v1.Sentiment(
+                             score=rng.uniform(-1, 1),
+                             magnitude=rng.uniform(0, 5)))
+      for _ in range(rng.randint(0, 6))
+  ])
+
+
+class NormalizeAwsResponsesTest(unittest.TestCase):
+
+  def test_normalize_empty_responses_returns_empty_result(self):
+    self.assertEqual(vectorized_normalizer.NormalizeAwsResponses([]), [])
+    self.assertEqual(
+        vectorized_normalizer.NormalizeAwsResponses([{
+            'Entities': []
+        }]), [[]])
+
+  def test_normalize_matches_scalar_normalizer_exactly(self):
+    rng = random.Random(0)
+    responses = [_RandomAwsResponse(rng) for _ in range(50)]
+
+    self.assertEqual(vectorized_normalizer.NormalizeAwsResponses(responses), [
+        normalizer.NormalizeAwsSentiment(
+            aws_comprehend.convert_aws_response(response))
+        for response in responses
+    ])
+
+  def test_mentions_with_low_group_score_are_skipped(self):
+    rng = random.Random(0)
+    related_mention = _RawAwsMention(rng, 0.7)
+    unrelated_mention = _RawAwsMention(rng, 0.4)
+
+    entities = vectorized_normalizer.NormalizeAwsResponses([{
+        'Entities': [{
+            'Mentions': [related_mention, unrelated_mention]
+        }]
+    }])[0]
+
+    sentiment_score = related_mention['MentionSentiment']['SentimentScore']
+    self.assertEqual(
+        entities[0].scores['aws'],
+        (sentiment_score['Positive'] - sentiment_score['Negative']) *
+        related_mention['Score'])
+
+  def test_response_without_related_mentions_gets_error(self):
+    rng = random.Random(0)
+    results = vectorized_normalizer.NormalizeAwsResponses(
+        [{
+            'Entities': [{
+                'Mentions': [_RawAwsMention(rng, 0.4)]
+            }]
+        },
+         _RandomAwsResponse(rng)])
+
+    self.assertIsInstance(results[0], ZeroDivisionError)
+    self.assertIsInstance(results[1], list)
+
+
+class NormalizeGcpResponsesTest(unittest.TestCase):
+
+  def test_normalize_empty_responses_returns_empty_result(self):
+    self.assertEqual(vectorized_normalizer.NormalizeGcpResponses([]), [])
+    self.assertEqual(
+        vectorized_normalizer.NormalizeGcpResponses(
+            [language_v1.AnalyzeEntitySentimentResponse()]), [[]])
+
+  def test_normalize_matches_scalar_normalizer_exactly(self):
+    rng = random.Random(0)
+    responses = [_RandomGcpResponse(rng) for _ in range(50)]
+
+    self.assertEqual(vectorized_normalizer.NormalizeGcpResponses(responses), [
+        normalizer.NormalizeGcpSentiment(
+            gcp_language.convert_gcp_response(response))
+        for response in responses
+    ])
@@ -0,0 +1,64 @@
+'''
+  Packs short documents into shared provider requests, the inverse of segmenter.Chunk.
+  Providers bill every request at least a minimum number of units (3 Comprehend units of 100 characters, 1 GCP unit of 1,000 characters), so tweet-sized documents sent alone pay mostly for rounding. Packed together, they pay for their characters. Each pack records where its documents lie, so providers can split entities back to their documents by mention offsets.
+'''
+import dataclasses
+
+# Separates packed documents: a line break ends a sentence, so no sentence
+# spans two documents.
+SEPARATOR = '\n\n'
+
+
+@dataclasses.dataclass(slots=True)
+class Pack:
+  text: str
+  # Indices of the packed documents, in the list given to PackDocuments.
+  documents: list[int]
+  # [begin, end) of each document in text, in characters and in UTF-8 bytes.
+  char_spans: list[tuple[int, int]]
+  byte_spans: list[tuple[int, int]]
+
+  def Locate(self, offset: int, spans: list[tuple[int, int]]) -> int | None:
+    ''' Returns the position in documents of the document holding offset, or None if offset falls in a separator. '''
+    for position, (begin, end) in enumerate(spans):
+      if offset < begin:
+        return None
+      if offset < end:
+        return position
+    return None
+
+
+def _Bytes(text: str) -> int:
+  return len(text.encode('utf-8'))
+
+
+def PackDocuments(documents: list[str], max_bytes: int) -> list[Pack]:
+  ''' Packs consecutive documents into packs of at most max_bytes UTF-8 bytes.
+
+    A document longer than max_bytes gets a pack of its own.
+  '''
+  separator_chars = len(SEPARATOR)
+  separator_bytes = _Bytes(SEPARATOR)
+  packs = []
+  pack = None
+  pack_chars = pack_bytes = 0
+  for index, document in enumerate(documents):
+    document_chars = len(document)
+    document_bytes = _Bytes(document)
+    if pack is not None and (pack_bytes + separator_bytes + document_bytes
+                             <= max_bytes):
+      pack_chars += separator_chars
+      pack_bytes += separator_bytes
+    else:
+      pack = Pack(text='', documents=[], char_spans=[], byte_spans=[])
+      packs.append(pack)
+      pack_chars = pack_bytes = 0
+    pack.documents.append(index)
+    pack.char_spans.append((pack_chars, pack_chars + document_chars))
+    pack.byte_spans.append((pack_bytes, pack_bytes + document_bytes))
+    pack_chars += document_chars
+    pack_bytes += document_bytes
+
+  for pack in packs:
+    pack.text = SEPARATOR.join(documents[index] for index in pack.documents)
+  return packs
@@ -0,0 +1,26 @@
+import unittest
+
+from segmentation import packer
+
+
+class PackDocumentsTest(unittest.TestCase):
+
+  def test_packs_consecutive_documents_up_to_max_bytes(self):
+    packs = packer.PackDocuments(['ab', 'cd', 'ef'], 6)
+
+    self.assertEqual([pack.text for pack in packs], ['ab\n\ncd', 'ef'])
+    self.assertEqual([pack.documents for pack in packs], [[0, 1], [2]])
+
+  def test_long_document_gets_its_own_pack(self):
+    packs = packer.PackDocuments(['ab', 'abcdefgh', 'cd'], 6)
+
+    self.assertEqual([pack.text for pack in packs], ['ab', 'abcdefgh', 'cd'])
+
+  def test_spans_locate_documents_in_characters_and_bytes(self):
+    pack, = packer.PackDocuments(['café', 'tea'], 100)
+
+    self.assertEqual(pack.char_spans, [(0, 4), (6, 9)])
+    self.assertEqual(pack.byte_spans, [(0, 5), (7, 10)])
+    self.assertEqual(pack.Locate(7, pack.char_spans), 1)
+    self.assertIsNone(pack.Locate(5, pack.char_spans))
+    self.assertEqual(pack.Locate(4, pack.byte_spans), 0)
@@ -0,0 +1,69 @@
+'''
+  Splits long documents into chunks that fit in a single provider request.
+  Chunks end on sentence boundaries where possible, so that providers still see whole sentences, and concatenating the chunks gives back the document.
+'''
+import re
+
+# A sentence runs up to its terminal punctuation (and closing quotes or
+# brackets) followed by whitespace, or up to a line break, and keeps the
+# whitespace after it.
+_SENTENCE = re.compile(r'.*?(?:[.!?]+[\'")\]”’]*(?=\s)|\n|$)\s*', re.DOTALL)
+_WORD = re.compile(r'\s*\S+\s*')
+
+
+def _Bytes(text: str) -> int:
+  return len(text.encode('utf-8'))
+
+
+def SplitSentences(text: str) -> list[str]:
+  return [match.group() for match in _SENTENCE.finditer(text) if match.group()]
+
+
+def _SplitBytes(text: str, max_bytes: int) -> list[str]:
+  ''' Splits text between characters into pieces of at most max_bytes. '''
+  pieces = []
+  begin = 0
+  piece_bytes = 0
+  for end, char in enumerate(text):
+    char_bytes = _Bytes(char)
+    if piece_bytes + char_bytes > max_bytes:
+      pieces.append(text[begin:end])
+      begin = end
+      piece_bytes = 0
+    piece_bytes += char_bytes
+  pieces.append(text[begin:])
+  return pieces
+
+
+def _Pieces(text: str, max_bytes: int):
+  ''' Yields sentences, splitting the ones longer than max_bytes on words, or between characters as a last resort. '''
+  for sentence in SplitSentences(text):
+    if _Bytes(sentence) <= max_bytes:
+      yield sentence
+      continue
+    for word in _WORD.findall(sentence) or [sentence]:
+      if _Bytes(word) <= max_bytes:
+        yield word
+      else:
+        yield from _SplitBytes(word, max_bytes)
+
+
+def Chunk(text: str, max_bytes: int) -> list[str]:
+  ''' Packs the sentences of text into as few chunks of at most max_bytes UTF-8 bytes as possible. '''
+  if _Bytes(text) <= max_bytes:
+    return [text]
+
+  chunks = []
+  chunk = []
+  chunk_bytes = 0
+  for piece in _Pieces(text, max_bytes):
+    piece_bytes = _Bytes(piece)
+    if chunk and chunk_bytes + piece_bytes > max_bytes:
+      chunks.append(''.join(chunk))
+      chunk = []
+      chunk_bytes = 0
+    chunk.append(piece)
+    chunk_bytes += piece_bytes
+  if chunk:
+    chunks.append(''.join(chunk))
+  return chunks
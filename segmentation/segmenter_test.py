@@ -0,0 +1,34 @@
+import unittest
+
+from segmentation import segmenter
+
+
+class SplitSentencesTest(unittest.TestCase):
+
+  def test_splits_after_terminal_punctuation_and_line_breaks(self):
+    self.assertEqual(
+        segmenter.SplitSentences(
+            'Prices rose 3.5%. "Why?" she asked.\nNo answer'),
+        ['Prices rose 3.5%. ', '"Why?" ', 'she asked.\n', 'No answer'])
+
+
+class ChunkTest(unittest.TestCase):
+
+  def test_short_text_is_a_single_chunk(self):
+    self.assertEqual(segmenter.Chunk('I like coffee.', 100), ['I like coffee.'])
+
+  def test_chunks_end_on_sentence_boundaries(self):
+    self.assertEqual(segmenter.Chunk('One two. Three. Four five six.', 16),
+                     ['One two. Three. ', 'Four five six.'])
+
+  def test_long_sentence_is_split_on_words(self):
+    self.assertEqual(segmenter.Chunk('one two three four', 9),
+                     ['one two ', 'three ', 'four'])
+
+  def test_chunks_fit_in_max_bytes_and_keep_the_text(self):
+    text = ('Café crème. ' * 50) + ('é' * 30)
+
+    chunks = segmenter.Chunk(text, 25)
+
+    self.assertEqual(''.join(chunks), text)
+    self.assertTrue(all(len(chunk.encode('utf-8')) <= 25 for chunk in chunks))
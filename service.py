@@ -0,0 +1,274 @@
+'''
+  Per-process state of the server: NLP clients, Firestore, cost ledger and result cache.
+  Each serving process (the dev server, or every gunicorn worker) builds exactly one Service.
+'''
+from analytics import entity_store
+from cache import result_cache, single_flight
+from clients import nlp_client, replay
+from cost import admission, cost_controller, local_firestore
+from datatypes import nlp_client_types
+from jobs import job_queue, job_runner
+from monitoring import metrics
+from normalization import canonicalizer
+import dataclasses
+import logging
+import os
+import threading
+import utils
+
+firestore = utils.LazyModule('google.cloud.firestore')
+
+_GCP_PROJECT = 'news-collector-371409'
+
+
+@dataclasses.dataclass
+class ServiceConfig:
+  # Comma-separated names of the registered providers to analyze texts with.
+  providers: str = 'aws,gcp'
+  # cloud, local or local_first, see nlp_client.NewClient.
+  mode: str = 'cloud'
+  # Lexicon of the local provider, the bundled one if empty.
+  local_lexicon_file: str = ''
+  # Local results with a weaker entity score are unsure, and escalated in
+  # local_first mode.
+  local_min_polar_score: float = 0.3
+  # Whether batches pack short texts into shared provider requests, billed for
+  # fewer units.
+  pack_texts: bool = False
+  # Whether providers analyze texts sentence by sentence, only sending the
+  # sentences of resubmitted texts that changed.
+  incremental: bool = False
+  # Max number of provider responses to sentences kept in memory.
+  incremental_cache_size: int = 100000
+  # Tab-separated aliases and canonical texts of entities, see canonicalizer.
+  entity_aliases_file: str = ''
+  # live, record or replay: whether the cloud providers are called, called and
+  # recorded to replay_dir, or replayed from it, see replay.Transport.
+  transport: str = replay.LIVE
+  replay_dir: str = ''
+  # Simulated latency of replayed calls, plus a uniform jitter.
+  replay_latency_seconds: float = 0
+  replay_jitter_seconds: float = 0
+  # Share of replayed calls failing with a transient provider error.
+  replay_error_rate: float = 0
+  # Tenants, see admission.ParseTenants. Requests name theirs with an API key.
+  tenants: str = ''
+  # Tab-separated API keys and the tenant each authenticates, see
+  # admission.LoadApiKeys.
+  api_keys_file: str = ''
+  # Whether requests without an API key are named by their X-Tenant-Id header,
+  # which the proxy in front of the server must then strip and set.
+  trust_tenant_header: bool = False
+  aws_cred_file: str = './key'
+  cache_size: int = 10000
+  cache_ttl_seconds: int = 24 * 60 * 60
+  cache_dir: str = ''
+  cache_firestore: bool = False
+  cost_flush_interval_seconds: float = 5
+  cost_flush_units: int = 10000
+  metrics: bool = True
+  # Directory where each serving process snapshots its metrics, so /metrics
+  # sums those of all processes. Only this process's metrics if empty.
+  metrics_dir: str = ''
+  aws_max_pool_connections: int = 32
+  gcp_channels: int = 4
+  keepalive_seconds: int = 60
+  # Per process, i.e. the provider quota divided by the number of processes.
+  aws_tps: float = 10
+  gcp_tps: float = 10
+  warm_up_connections: int = 8
+  warm_up_timeout_seconds: float = 10
+  # SQLite database of the analytics store, which is disabled if empty.
+  analytics_db: str = ''
+  # Whether entity records are also appended to Firestore.
+  analytics_firestore: bool = False
+  analytics_flush_interval_seconds: float = 5
+  # Seconds batches wait for provider calls, below the gunicorn timeout; the
+  # texts of calls that cannot finish in time fail.
+  batch_timeout_seconds: float = 45
+  # Number of threads running queued jobs of /jobs, which is disabled if 0.
+  job_workers: int = 0
+  # memory or sqlite:<path>, see job_queue.NewJobQueue. Only a shared queue
+  # serves several processes.
+  job_queue: str = 'memory'
+  # Max number of queued jobs, beyond which submissions are rejected.
+  job_queue_max_depth: int = 1000
+  job_result_ttl_seconds: int = 24 * 60 * 60
+  # Whether jobs may name a callback URL their results are POSTed to.
+  job_webhooks: bool = False
+  # Number of processes serving requests, set by gunicorn.conf.py.
+  serving_processes: int = 1
+
+  @classmethod
+  def FromEnv(cls, environ=os.environ) -> 'ServiceConfig':
+    ''' Reads each field from the environment variable of the same name. '''
+    config = cls()
+    for field in dataclasses.fields(cls):
+      if field.name not in environ:
+        continue
+      value = environ[field.name]
+      if field.type is bool:
+        value = value.lower() in ('1', 'true', 'yes')
+      else:
+        value = field.type(value)
+      setattr(config, field.name, value)
+    return config
+
+
+@dataclasses.dataclass
+class Service:
+  client: (nlp_client.NlpClient | nlp_client.IncrementalNlpClient |
+           nlp_client.EscalatingNlpClient)
+  db: 'firestore.Client | local_firestore.LocalFirestore'
+  ledger: cost_controller.CostLedger
+  cache: result_cache.ResultCache
+  # Defaults to the budget check of the ledger, without tenants.
+  admission_controller: admission.AdmissionController | None = None
+  # API key -> name of the tenant it authenticates.
+  api_key_tenants: dict[str, str] = dataclasses.field(default_factory=dict)
+  trust_tenant_header: bool = False
+  # Whether each provider was reached by the warm-up, once it finished.
+  warm_up_status: dict[str, bool] = dataclasses.field(default_factory=dict)
+  warm_up_thread: threading.Thread | None = None
+  # Serves analytics queries, if analytics_db is set.
+  analytics_store: entity_store.SqliteEntityStore | None = None
+  # Records served entities, if analytics_db or analytics_firestore is set.
+  analytics_recorder: entity_store.EntityRecorder | None = None
+  # Coalesces concurrent analyses of the same text, keyed by cache key.
+  in_flight: single_flight.SingleFlight = dataclasses.field(
+      default_factory=single_flight.SingleFlight)
+  # Queue of /jobs and the workers running it, if job_workers is set.
+  jobs: job_queue.MemoryJobQueue | job_queue.SqliteJobQueue | None = None
+  job_pool: job_runner.JobRunner | None = None
+
+  @classmethod
+  def FromConfig(cls, config: ServiceConfig) -> 'Service':
+    metrics.Enable(config.metrics)
+    if config.metrics and config.metrics_dir:
+      metrics.EnableMultiprocess(config.metrics_dir)
+    if (config.job_workers and config.job_queue == 'memory' and
+        config.serving_processes > 1):
+      # Polls would land on processes which do not hold the job.
+      raise ValueError(
+          f'The memory job queue serves a single process, not '
+          f'{config.serving_processes}: set job_queue to sqlite:<path>.')
+    if config.entity_aliases_file:
+      canonicalizer.SetAliases(
+          canonicalizer.LoadAliases(config.entity_aliases_file))
+    tenants = admission.ParseTenants(config.tenants)
+    api_key_tenants = {}
+    if config.api_keys_file:
+      api_key_tenants = admission.LoadApiKeys(config.api_keys_file)
+    # Replays never reach Google Cloud, Firestore included.
+    if config.transport == replay.REPLAY:
+      db = local_firestore.LocalFirestore()
+      transact = local_firestore.LocalFirestore.Transact
+    else:
+      db = firestore.Client(project=_GCP_PROJECT)
+      transact = cost_controller.FirestoreTransact
+    ledger = cost_controller.CostLedger(
+        db,
+        flush_interval_seconds=config.cost_flush_interval_seconds,
+        flush_units=config.cost_flush_units,
+        transact=transact)
+    ledger.Start()
+    admission_controller = admission.AdmissionController(ledger,
+                                                         tenants=tenants)
+    # Texts escalated to the cloud providers are charged when escalated, to
+    # the default tenant.
+    client = nlp_client.NewClient(
+        config, admit=lambda texts: admission_controller.Admit(texts).admitted)
+
+    second_tier = None
+    if config.cache_dir:
+      second_tier = result_cache.DiskTier(config.cache_dir,
+                                          config.cache_ttl_seconds)
+    elif config.cache_firestore:
+      second_tier = result_cache.FirestoreTier(db, config.cache_ttl_seconds)
+    cache = result_cache.ResultCache(result_cache.LruTtlCache(
+        config.cache_size, config.cache_ttl_seconds),
+                                     second_tier=second_tier)
+
+    analytics_store = None
+    analytics_sinks = []
+    if config.analytics_db:
+      analytics_store = entity_store.SqliteEntityStore(config.analytics_db)
+      analytics_sinks.append(analytics_store)
+    if config.analytics_firestore:
+      analytics_sinks.append(entity_store.FirestoreEntitySink(db))
+    analytics_recorder = None
+    if analytics_sinks:
+      analytics_recorder = entity_store.EntityRecorder(
+          analytics_sinks,
+          flush_interval_seconds=config.analytics_flush_interval_seconds)
+      analytics_recorder.Start()
+
+    state = cls(client=client,
+                db=db,
+                ledger=ledger,
+                cache=cache,
+                admission_controller=admission_controller,
+                api_key_tenants=api_key_tenants,
+                trust_tenant_header=config.trust_tenant_header,
+                analytics_store=analytics_store,
+                analytics_recorder=analytics_recorder)
+    if config.job_workers:
+      state.jobs = job_queue.NewJobQueue(config.job_queue,
+                                         config.job_queue_max_depth,
+                                         config.job_result_ttl_seconds)
+      state.job_pool = job_runner.JobRunner(state.jobs,
+                                            state.AnalyzeTexts,
+                                            config.job_workers,
+                                            webhooks=config.job_webhooks)
+      state.job_pool.Start()
+    if config.warm_up_connections:
+      state.StartWarmUp(config.warm_up_connections,
+                        config.warm_up_timeout_seconds)
+    return state
+
+  def __post_init__(self):
+    if self.admission_controller is None:
+      self.admission_controller = admission.AdmissionController(self.ledger)
+
+  def StartWarmUp(self, connections: int, timeout_seconds: float):
+    ''' Opens provider connections in the background, see Ready(). '''
+
+    def WarmUp():
+      self.warm_up_status = self.client.WarmUp(connections, timeout_seconds)
+      logging.info('Warmed up provider connections: %s', self.warm_up_status)
+
+    self.warm_up_thread = threading.Thread(target=WarmUp,
+                                           name='warm_up',
+                                           daemon=True)
+    self.warm_up_thread.start()
+
+  def Ready(self) -> bool:
+    ''' Whether the warm-up, if any, finished and requests no longer pay for opening connections. '''
+    return self.warm_up_thread is None or not self.warm_up_thread.is_alive()
+
+  def AnalyzeTexts(self,
+                   texts: list[str]) -> list[nlp_client_types.BatchItemResult]:
+    ''' Analyzes texts already admitted, caching and recording their results. '''
+    items = self.client.AnalyzeSentimentBatch(texts)
+    for text, item in zip(texts, items):
+      if item.result is None:
+        continue
+      self.cache.Put(text, item.result)
+      if self.analytics_recorder is not None:
+        self.analytics_recorder.Record(item.result)
+    return items
+
+  def Close(self):
+    ''' Flushes pending state. Called once when the serving process exits. '''
+    logging.info('Closing service, flushing pending cost.')
+    # Running jobs still charge cost and record entities.
+    if self.job_pool is not None:
+      self.job_pool.Close()
+    if self.jobs is not None:
+      self.jobs.Close()
+    self.ledger.Close()
+    if self.analytics_recorder is not None:
+      self.analytics_recorder.Close()
+    if self.analytics_store is not None:
+      self.analytics_store.Close()
+    metrics.WriteSnapshot()
@@ -1,4 +1,6 @@
 import dataclasses
+import importlib
+import threading
 
 
 @dataclasses.dataclass
@@ -12,3 +14,28 @@ def LoadAwsCredentials(key_path: str) -> AwsCredentials:
     access_key_id, secret_access_key = file.read().splitlines()[:2]
     return AwsCredentials(access_key_id=access_key_id,
                           secret_access_key=secret_access_key)
+
+
+class LazyModule:
+  ''' Stands in for a module, importing it on first attribute access.
+
+    Keeps cloud SDKs, which take hundreds of milliseconds to import, off the
+    startup path until a backend actually uses them.
+  '''
+
+  def __init__(self, name: str):
+    self._name = name
+    self._module = None
+    self._lock = threading.Lock()
+
+  def _Load(self):
+    with self._lock:
+      if self._module is None:
+        self._module = importlib.import_module(self._name)
+    return self._module
+
+  def __getattr__(self, attr: str):
+    return getattr(self._module or self._Load(), attr)
+
+  def __repr__(self) -> str:
+    return f'<LazyModule {self._name}>'
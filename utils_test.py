@@ -0,0 +1,35 @@
+import subprocess
+import sys
+import unittest
+
+import utils
+
+
+class LazyModuleTest(unittest.TestCase):
+
+  def test_module_is_imported_on_first_attribute_access(self):
+    module = utils.LazyModule('json')
+
+    self.assertIsNone(module._module)
+    self.assertEqual(module.dumps([1]), '[1]')
+    self.assertIsNotNone(module._module)
+
+  def test_missing_module_raises_on_first_attribute_access(self):
+    module = utils.LazyModule('no_such_module')
+
+    with self.assertRaises(ModuleNotFoundError):
+      module.attribute
+
+  def test_cloud_sdks_are_not_imported_at_startup(self):
+    # A fresh interpreter, as this one already imported the SDKs in other tests.
+    completed = subprocess.run([
+        sys.executable, '-c', 'import sys, main; print(" ".join('
+        'module for module in ("google.cloud.firestore", '
+        '"google.cloud.language_v1", "botocore", "grpc", "numpy") '
+        'if module in sys.modules))'
+    ],
+                               capture_output=True,
+                               text=True,
+                               check=True)
+
+    self.assertEqual(completed.stdout.strip(), '')
@@ -0,0 +1,10 @@
+'''
+  Production entry point, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+  Configured through environment variables named after the fields of service.ServiceConfig.
+  Gunicorn imports this module in each worker after forking, so every worker builds its own clients.
+'''
+import main
+import service
+
+state = service.Service.FromConfig(service.ServiceConfig.FromEnv())
+app = main.create_app(state)